@@ -191,6 +191,19 @@ class HistoryLinesFilter(filters.FilterSet):
             'line_gnumber',
         )
 
+    def get_lines_kwargs(self):
+        # Arguments for `History.get_lines()` with compressed output
+        data = self.form.cleaned_data
+        return dict(
+            filters=[
+                Q(**{field: data[field]})
+                for field in self.Meta.fields
+                if data.get(field, None) is not None
+            ],
+            after=data.get('after', None),
+            before=data.get('before', None),
+        )
+
 
 class TeamFilter(_BaseFilter):
     class Meta:
@@ -13,7 +13,7 @@ from vstutils.api import serializers as vst_serializers, fields as vst_fields
 from vstutils.api import auth as vst_auth
 from vstutils.api.serializers import DataSerializer, EmptySerializer
 from vstutils.api.base import Response
-from ...main.utils import AnsibleArgumentsReference
+from ...main.utils import AnsibleArgumentsReference, WORKDIR_STRATEGIES
 from ...main.settings import LANGUAGES
 from ...main.validators import path_validator
 
@@ -431,7 +431,8 @@ class ProjectVariableSerializer(VariableSerializer):
     )
     value = vst_fields.DependEnumField(allow_blank=True, field='key', choices={
         'repo_type': list(models.Project.repo_handlers.keys()),
-        'repo_sync_on_run': [True, False]
+        'repo_sync_on_run': [True, False],
+        'workdir_strategy': list(WORKDIR_STRATEGIES),
     }, types={
         'repo_password': 'password',
         'repo_key': 'secretfile',
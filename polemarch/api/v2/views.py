@@ -1,6 +1,11 @@
 # pylint: disable=unused-argument,protected-access,too-many-ancestors
+import re
+import json
+import hashlib
 from collections import OrderedDict
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
 from django.utils.decorators import method_decorator
 from rest_framework import exceptions as excepts, status, permissions
 from rest_framework.authtoken import views as token_views
@@ -23,6 +28,7 @@ action_kw.update(dict(
     response_serializer=sers.ActionResponseSerializer,
     response_code=status.HTTP_200_OK
 ))
+bytes_range_regex = re.compile(r'^bytes=(\d*)-(\d*)$')
 execute_kw = dict(**default_action)
 execute_kw.update(dict(
     response_serializer=sers.ExecuteResponseSerializer,
@@ -40,6 +46,15 @@ def concat_classes(*args):
     return concated_object
 
 
+class _VariablesPrefetchMixin(base.ModelViewSet):
+    def get_extra_queryset(self):
+        queryset = super(_VariablesPrefetchMixin, self).get_extra_queryset()
+        if self.action == 'list':
+            # List serializer reads variables of every object.
+            queryset = queryset.prefetch_related('variables')
+        return queryset
+
+
 class _VariablesCopyMixin(base.CopyMixin):
     def copy_instance(self, instance):
         new_instance = super(_VariablesCopyMixin, self).copy_instance(instance)
@@ -268,9 +283,30 @@ class __HistoryLineViewSet(base.ReadOnlyModelViewSet):
     serializer_class = sers.HistoryLinesSerializer
     filter_class = filters.HistoryLinesFilter
 
+    def list(self, request, *args, **kwargs):
+        history = self.nested_parent_object
+        if not history.compressed_output:
+            return super().list(request, *args, **kwargs)
+        filterset = self.filter_class(request.query_params, self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            raise excepts.ValidationError(filterset.errors)  # nocv
+        lines_kwargs = filterset.get_lines_kwargs()
+        if lines_kwargs['filters']:
+            lines = history.get_lines(**lines_kwargs)
+            lines.reverse()
+        else:
+            # Only chunks of requested page are unpacked.
+            lines = history.get_reversed_lines(lines_kwargs['after'], lines_kwargs['before'])
+        page = self.paginate_queryset(lines)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return responses.HTTP_200_OK(self.get_serializer(lines, many=True).data)  # nocv
+
 
 @method_decorator(name='lines_list', decorator=swagger_auto_schema(auto_schema=None))
 @method_decorator(name='raw', decorator=swagger_auto_schema(auto_schema=None))
+@method_decorator(name='tail', decorator=swagger_auto_schema(auto_schema=None))
+@method_decorator(name='stream', decorator=swagger_auto_schema(auto_schema=None))
 @deco.nested_view('lines', manager_name='raw_history_line', view=__HistoryLineViewSet)
 class HistoryViewSet(base.HistoryModelViewSet):
     '''
@@ -299,6 +335,99 @@ class HistoryViewSet(base.HistoryModelViewSet):
         result = self.get_serializer(self.get_object()).get_raw(request)
         return HttpResponse(result, content_type="text/plain")
 
+    def _get_tail_range(self, request, size):
+        # Returns (start, end, is_partial) for requested part of output
+        header = request.META.get('HTTP_RANGE', None)
+        if header is None:
+            offset = request.query_params.get('offset', None)
+            if offset is None or not offset.isdigit():
+                return 0, size, False
+            return min(int(offset), size), size, False
+        match = bytes_range_regex.match(header.strip())
+        if match is None or match.groups() == ('', ''):
+            return 0, size, False
+        start, end = match.groups()
+        if not start:
+            return max(size - int(end), 0), size, True
+        end = min(int(end) + 1, size) if end else size
+        return int(start), end, True
+
+    @deco.action(["get"], detail=yes, serializer_class=sers.EmptySerializer)
+    def tail(self, request, *args, **kwargs):
+        '''
+        New lines of executions output after `after_gnumber`
+        or part of RAW output by `offset` in bytes or `Range` header.
+        '''
+        history = self.get_object()
+        cursor = history.last_line_gnumber
+        # Response depends on requested part of output too.
+        variant = hashlib.md5(json.dumps([
+            request.query_params.get(name, None) for name in ('after_gnumber', 'offset', 'color')
+        ] + [request.META.get('HTTP_RANGE', None)]).encode('utf-8')).hexdigest()[:12]
+        etag = '"{}-{}-{}-{}"'.format(history.id, history.status, cursor, variant)
+        headers = {'ETag': etag, 'Accept-Ranges': 'bytes', 'X-History-Status': history.status}
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        elif 'after_gnumber' in request.query_params:
+            after = request.query_params['after_gnumber']
+            if not after.isdigit():
+                raise excepts.ValidationError({'after_gnumber': 'A valid integer is required.'})
+            response = HttpResponse(
+                history.get_tail(int(after), cursor + 1, request.query_params.get("color", "no") == "yes"),
+                content_type="text/plain"
+            )
+            headers['X-Cursor'] = str(cursor)
+        else:
+            result = self.get_serializer(history).get_raw(request).encode('utf-8')
+            start, end, partial = self._get_tail_range(request, len(result))
+            headers['X-Cursor'] = str(end)
+            if not partial:
+                response = HttpResponse(result[start:end], content_type="text/plain; charset=utf-8")
+            elif start < end:
+                response = HttpResponse(
+                    result[start:end], content_type="text/plain; charset=utf-8",
+                    status=status.HTTP_206_PARTIAL_CONTENT
+                )
+                headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end - 1, len(result))
+            else:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                headers['Content-Range'] = 'bytes */{}'.format(len(result))
+                headers['X-Cursor'] = str(len(result))
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def _get_stream_events(self, history, after):
+        max_duration = getattr(settings, 'HISTORY_STREAM_MAX_DURATION', None) or None
+        for batch in utils.HistoryStream(history.id).follow(history, after, max_duration):
+            if not batch:
+                yield ':\n\n'
+                continue
+            data = [dict(line_gnumber=gnumber, line=line) for gnumber, line in batch]
+            yield 'id: {}\ndata: {}\n\n'.format(batch[-1][0], json.dumps(data))
+        history.refresh_from_db(fields=['status'])
+        if history.working:
+            # Stream doesn't hold worker for whole execution, client reconnects with `Last-Event-ID`.
+            yield 'retry: 1000\n\n'
+            return
+        yield 'event: finish\ndata: {}\n\n'.format(json.dumps(history.status))
+
+    @deco.action(["get"], detail=yes, serializer_class=sers.EmptySerializer)
+    def stream(self, request, *args, **kwargs):
+        '''
+        Live executions output as server-sent events.
+        '''
+        history = self.get_object()
+        after = request.META.get('HTTP_LAST_EVENT_ID', request.query_params.get('after_gnumber', '0'))
+        if not after.isdigit():
+            raise excepts.ValidationError({'after_gnumber': 'A valid integer is required.'})
+        response = StreamingHttpResponse(
+            self._get_stream_events(history, int(after)), content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
     @deco.subaction(serializer_class=sers.EmptySerializer, **action_kw)
     def cancel(self, request, *args, **kwargs):
         '''
@@ -601,7 +730,7 @@ class __ProjectHistoryViewSet(HistoryViewSet):
 @deco.nested_view('periodic_task', 'id', view=__PeriodicTaskViewSet)
 @deco.nested_view('history', 'id', manager_name='history', view=__ProjectHistoryViewSet)
 @deco.nested_view('variables', 'id', view=__ProjectVarsViewSet)
-class ProjectViewSet(OwnedView, _VariablesCopyMixin):
+class ProjectViewSet(_VariablesPrefetchMixin, OwnedView, _VariablesCopyMixin):
     '''
     retrieve:
         Return a project instance.
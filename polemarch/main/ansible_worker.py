@@ -0,0 +1,71 @@
+"""
+Long-lived worker for `pm_ansible` commands.
+
+Started by :class:`polemarch.main.utils.PMAnsibleWorker` with executor
+interpreter and imports ansible only once. Reads one json-request
+``{"args": [...], "cwd": "..."}`` per line from stdin and writes one
+json-response ``{"output": "...", "error": null}`` per line to stdout.
+"""
+# pylint: disable=broad-except
+import io
+import os
+import sys
+import json
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+
+
+def warm_up():
+    # pylint: disable=unused-import,import-outside-toplevel
+    import ansible.release
+    for name in ('inventory_parser', 'reference', 'config'):
+        try:
+            __import__('pm_ansible.cli.{}'.format(name))
+        except Exception:  # nocv
+            pass
+    return ansible.release
+
+
+def handle(pm_ansible, request):
+    output, error = io.StringIO(), None
+    environ, cwd = os.environ.copy(), os.getcwd()
+    try:
+        os.chdir(request.get('cwd') or cwd)
+        with redirect_stdout(output):
+            pm_ansible(['pm_ansible'] + list(request['args']))
+    except SystemExit as exit_err:
+        if exit_err.code not in (None, 0):
+            error = 'Exit with code {}.'.format(exit_err.code)
+    except BaseException:
+        error = traceback.format_exc()
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+    return dict(output=output.getvalue(), error=error)
+
+
+def main():
+    # Protocol uses duplicate of stdout, so stray writes of
+    # ansible plugins or C-extensions could not break it.
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    devnull = open(os.devnull, 'w')
+    os.dup2(devnull.fileno(), sys.stdout.fileno())
+
+    with redirect_stderr(devnull):
+        from pm_ansible.cli import main as pm_ansible  # pylint: disable=import-outside-toplevel
+        release = warm_up()
+        protocol.write(json.dumps(dict(
+            version=release.__version__, release=release.__file__, pid=os.getpid()
+        )) + '\n')
+        protocol.flush()
+
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            protocol.write(json.dumps(handle(pm_ansible, json.loads(line))) + '\n')
+            protocol.flush()
+
+
+if __name__ == '__main__':
+    main()
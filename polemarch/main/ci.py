@@ -15,6 +15,7 @@ class DefaultHandler:
     def __init__(self, repo, results):
         self.repo = repo
         self.repo_obj, self.result = results
+        self.unchanged = getattr(repo, 'unchanged', False)
         self.ci_vars = self.repo.proj.get_vars_prefixed('ci')
 
     def event_log(self, message: Text, *args, **kwargs) -> NoReturn:
@@ -29,6 +30,9 @@ class DefaultHandler:
         return ci_model.objects.get(pk=self.ci_vars[ci_type_name])
 
     def trigger_execution(self) -> NoReturn:
+        if self.unchanged:
+            self.event_log('Project revision is unchanged, CI context is skipped.')
+            return
         if self.result:
             ci_object = self.get_ci_call_object()
             if ci_object:
@@ -31,3 +31,7 @@ class NotApplicable(exceptions.NotApplicable):
 
 class Conflict(PMException):
     status = exceptions.status.HTTP_409_CONFLICT
+
+
+class HookDeliveryError(PMException):
+    pass
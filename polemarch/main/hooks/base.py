@@ -1,8 +1,19 @@
 from typing import Dict
+import logging
+import traceback
 from django.conf import settings
+from ..exceptions import HookDeliveryError
+
+
+logger = logging.getLogger("polemarch")
 
 
 class BaseHook:
+    # Errors of transport which are worth to retry delivery.
+    retry_exceptions = (HookDeliveryError, OSError)
+    # Same as fallback of `hooks_timeout` setting.
+    default_timeout = 30
+
     def __init__(self, hook_object, when_types=None, **kwargs):
         self.when_types = when_types or []
         self.hook_object = hook_object
@@ -29,12 +40,33 @@ class BaseHook:
         return message
 
     def execute(self, recipient, when, message):  # nocv
+        '''
+        Send message to recipient. Raises exception when delivery failed.
+        '''
         raise NotImplementedError
 
+    def get_error_details(self, recipient, when) -> str:
+        return 'RECIPIENT:{}\nWHEN:{}\n'.format(recipient, when)
+
+    def safe_execute(self, recipient, when, message) -> str:
+        try:
+            return self.execute(recipient, when, message)
+        except BaseException as err:
+            logger.error(traceback.format_exc())
+            logger.error('Details:\n{}ERR:{}\n'.format(self.get_error_details(recipient, when), err))
+            return str(err)
+
+    def deliver(self, recipient, when, message) -> str:
+        self.when = when
+        try:
+            return self.execute(recipient, when, self.modify_message(message))
+        except self.retry_exceptions as err:
+            raise HookDeliveryError(str(err))
+
     def send(self, message, when: str) -> str:
         self.when = when
         filtered = filter(lambda r: r, self.conf['recipients'])
-        execute = self.execute
+        execute = self.safe_execute
         message = self.modify_message(message)
         mapping = map(lambda r: execute(r, when, message), filtered)
         return '\n'.join(mapping)
@@ -1,23 +1,47 @@
-import logging
-import traceback
+import os
 import requests
+from requests.adapters import HTTPAdapter
 from .base import BaseHook
+from ..exceptions import HookDeliveryError
 
 
-logger = logging.getLogger("polemarch")
+class Backend(BaseHook):
+    retry_exceptions = BaseHook.retry_exceptions + (requests.RequestException,)
+    retry_statuses = frozenset((408, 429, 500, 502, 503, 504))
+    # Keep-alive connections are shared by all hooks of process with the same pool size.
+    _sessions = {}
+    _sessions_pid = None
 
+    @classmethod
+    def get_session(cls, pool_size=10) -> requests.Session:
+        if cls._sessions_pid != os.getpid():
+            cls._sessions, cls._sessions_pid = {}, os.getpid()
+        if pool_size not in cls._sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            cls._sessions[pool_size] = session
+        return cls._sessions[pool_size]
+
+    def setup(self, **kwargs):
+        super(Backend, self).setup(**kwargs)
+        self.conf['timeout'] = self.get_settings('HOOKS_TIMEOUT', self.default_timeout)
+        self.conf['pool_size'] = self.get_settings('HOOKS_POOL_SIZE', 10)
+
+    def get_error_details(self, recipient, when) -> str:
+        return 'URL:{}\nWHEN:{}\n'.format(recipient, when)
 
-class Backend(BaseHook):
     def execute(self, url, when, message) -> str:
         data = dict(type=when, payload=message)
-        try:
-            response = requests.post(url, data=data)
-            return "{} {}: {}".format(
-                response.status_code, response.reason, response.text
-            )
-        except BaseException as err:
-            logger.error(traceback.format_exc())
-            logger.error("Details:\nURL:{}\nWHEN:{}\n".format(
-                url, when
-            ))
-            return str(err)
+        # Batch of messages can't be form-encoded, so it is sent as json.
+        kwargs = dict(json=data) if isinstance(message, list) else dict(data=data)
+        response = self.get_session(self.conf['pool_size']).request(
+            'post', url, timeout=self.conf['timeout'], **kwargs
+        )
+        result = "{} {}: {}".format(
+            response.status_code, response.reason, response.text
+        )
+        if response.status_code in self.retry_statuses:
+            raise HookDeliveryError(result)
+        return result
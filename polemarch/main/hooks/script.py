@@ -2,39 +2,174 @@ from __future__ import unicode_literals
 from typing import Dict
 import os
 import json
-import traceback
-import logging
+import time
+import select
+import threading
 import subprocess
 from .base import BaseHook
+from ..exceptions import HookDeliveryError
 
 
-logger = logging.getLogger("polemarch")
+class ScriptRunner:
+    '''
+    Long-lived process of hook script. Every event is written to stdin
+    as json-line with sequence `id` and script answers with json-line with
+    the same `id` to stdout. Other lines of output are skipped.
+    '''
+    __slots__ = ('script', 'cwd', 'process', 'output', 'sequence')
+
+    def __init__(self, script, cwd):
+        self.script, self.cwd, self.process = script, cwd, None
+        self.output, self.sequence = b'', 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [self.script], cwd=self.cwd, bufsize=0, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        # Writes should not block, when script doesn't read stdin.
+        os.set_blocking(self.process.stdin.fileno(), False)
+        self.output = b''
+
+    def stop(self):
+        process, self.process = self.process, None
+        if process is not None:
+            process.kill()
+            process.wait()
+
+    def _wait(self, deadline: float, timeout, read=(), write=()):
+        if not any(select.select(read, write, [], max(deadline - time.monotonic(), 0))):
+            raise subprocess.TimeoutExpired(self.script, timeout)
+
+    def _write(self, data: bytes, deadline: float, timeout):
+        fd = self.process.stdin.fileno()
+        while data:
+            self._wait(deadline, timeout, write=[fd])
+            try:
+                data = data[os.write(fd, data):]
+            except BlockingIOError:  # nocv
+                continue
+
+    def _readline(self, deadline: float, timeout) -> bytes:
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self.output:
+            self._wait(deadline, timeout, read=[fd])
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise HookDeliveryError('Script exited with code {}.'.format(self.process.wait()))
+            self.output += chunk
+        line, self.output = self.output.split(b'\n', 1)
+        return line
+
+    def execute(self, when, message, timeout) -> str:
+        if not self.alive:
+            self.stop()
+            self.start()
+        self.sequence += 1
+        deadline = time.monotonic() + timeout
+        event = '{{"id": {}, "when": {}, "payload": {}}}\n'.format(self.sequence, json.dumps(when), message)
+        try:
+            self._write(event.encode('utf-8'), deadline, timeout)
+            while True:
+                result = self._readline(deadline, timeout).decode('utf-8', 'replace').rstrip('\r')
+                try:
+                    reply = json.loads(result) if result.startswith('{') else None
+                except ValueError:
+                    reply = None
+                if isinstance(reply, dict) and reply.get('id', None) == self.sequence:
+                    break
+        except BaseException:
+            # Script in unknown state, so it will be restarted for next event.
+            self.stop()
+            raise
+        if reply.get('error', None):
+            raise HookDeliveryError(reply['error'])
+        return result
+
+
+class ScriptRunnerPool:
+    '''
+    Processes of one persistent script in current process.
+    Count of processes is limited and events wait for free one.
+    '''
+    __slots__ = ('script', 'cwd', 'semaphore', 'idle', 'lock')
+    _pools = {}
+    _pid = None
+
+    def __init__(self, script, cwd, limit):
+        self.script, self.cwd = script, cwd
+        self.semaphore = threading.BoundedSemaphore(limit)
+        self.idle = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get(cls, script, cwd, limit) -> 'ScriptRunnerPool':
+        if cls._pid != os.getpid():
+            # Process was forked, so runners belong to parent.
+            cls._pools, cls._pid = {}, os.getpid()
+        pool = cls._pools.get(script, None)
+        if pool is None:
+            pool = cls._pools.setdefault(script, cls(script, cwd, max(limit, 1)))
+        return pool
+
+    @classmethod
+    def stop_all(cls):
+        for pool in cls._pools.values():
+            with pool.lock:
+                runners, pool.idle = pool.idle, []
+            for runner in runners:
+                runner.stop()
+
+    def execute(self, when, message, timeout) -> str:
+        if not self.semaphore.acquire(timeout=timeout):
+            raise HookDeliveryError('All processes of {} are busy.'.format(self.script))
+        try:
+            with self.lock:
+                runner = self.idle.pop() if self.idle else ScriptRunner(self.script, self.cwd)
+            try:
+                return runner.execute(when, message, timeout)
+            finally:
+                with self.lock:
+                    self.idle.append(runner)
+        finally:
+            self.semaphore.release()
 
 
 class Backend(BaseHook):
+    retry_exceptions = BaseHook.retry_exceptions + (subprocess.SubprocessError,)
 
     def execute(self, script, when, file) -> str:
-        try:
-            work_dir = self.conf['HOOKS_DIR']
-            script = '{}/{}'.format(work_dir, script)
-            return subprocess.check_output(
-                [script, when],
-                cwd=work_dir, universal_newlines=True, input=file
-            )
-        except BaseException as err:
-            logger.error(traceback.format_exc())
-            logger.error(
-                f'Details:\n'
-                f'SCRIPT:{script}\n'
-                f'WHEN:{when}\n'
-                f'CWD:{self.conf["HOOKS_DIR"]}\n'
-                f'ERR:{str(err)}\n'
-            )
-            return str(err)
+        work_dir = self.conf['HOOKS_DIR']
+        name, script = script, '{}/{}'.format(work_dir, script)
+        if self.is_persistent(name):
+            pool = ScriptRunnerPool.get(script, work_dir, self.conf['concurrency'])
+            return pool.execute(when, file, self.conf['timeout'])
+        return subprocess.check_output(
+            [script, when],
+            cwd=work_dir, universal_newlines=True, input=file,
+            timeout=self.conf['timeout']
+        )
+
+    def is_persistent(self, script) -> bool:
+        persistent = self.conf['persistent']
+        return '*' in persistent or script in persistent
+
+    def get_error_details(self, script, when) -> str:
+        return (
+            f'SCRIPT:{self.conf["HOOKS_DIR"]}/{script}\n'
+            f'WHEN:{when}\n'
+            f'CWD:{self.conf["HOOKS_DIR"]}\n'
+        )
 
     def setup(self, **kwargs):
         super(Backend, self).setup(**kwargs)
         self.conf['HOOKS_DIR'] = self.get_settings('HOOKS_DIR', '/tmp/')
+        self.conf['timeout'] = self.get_settings('HOOKS_TIMEOUT', self.default_timeout)
+        self.conf['persistent'] = self.get_settings('HOOKS_PERSISTENT_SCRIPTS', [])
+        self.conf['concurrency'] = self.get_settings('HOOKS_SCRIPT_CONCURRENCY', 1)
 
     def validate(self) -> Dict:
         errors = super(Backend, self).validate()
@@ -0,0 +1,47 @@
+import time
+from django.conf import settings
+from ..base import ServiceCommand
+from ...models import History
+from ...models.utils import OutputBuffer
+
+
+class Command(ServiceCommand):
+    help = "Measure writing of execution output to history line by line and by buffer."
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--lines', action='store', dest='lines', type=int, default=20000,
+            help='Count of written lines for every way.',
+        )
+
+    def write_unbuffered(self, history, lines):
+        # Executor wrote every line of output by own insert before buffering.
+        for number, line in enumerate(lines, 1):
+            history.write_line(line, number, '\n')
+
+    def write_buffered(self, history, lines):
+        output = OutputBuffer(history, settings.HISTORY_OUTPUT_BUFFER_SIZE, settings.HISTORY_OUTPUT_BUFFER_TIMEOUT)
+        for number, line in enumerate(lines, 1):
+            output.append(line, number)
+        output.flush()
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        lines = [
+            'ok: [host-{}] => {{"changed": false, "ping": "pong"}}'.format(number)
+            for number in range(options['lines'])
+        ]
+        for way in ('unbuffered', 'buffered'):
+            # Histories are written with autocommit like by executor and removed after measurement.
+            history = History.objects.create(mode='benchmark', status='RUN')
+            try:
+                started = time.perf_counter()
+                getattr(self, 'write_' + way)(history, lines)
+                elapsed = max(time.perf_counter() - started, 1e-6)
+                written = history.raw_history_line.count()
+            finally:
+                history.delete()
+            self._print('{}: {} lines in {:.2f}s, {:.0f} lines/s.'.format(
+                way, written, elapsed, len(lines) / elapsed
+            ), 'SUCCESS')
@@ -0,0 +1,48 @@
+import os
+import time
+import shutil
+import tempfile
+from ..base import ServiceCommand
+from ...utils import copy_tree, WORKDIR_STRATEGIES
+
+
+class Command(ServiceCommand):
+    help = "Measure preparing of execution directory by every workdir strategy."
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--files', action='store', dest='files', type=int, default=2000,
+            help='Count of files in generated project.',
+        )
+        parser.add_argument(
+            '--size', action='store', dest='size', type=int, default=128 * 1024,
+            help='Size of every file in bytes.',
+        )
+        parser.add_argument(
+            '--dir', action='store', dest='dir', type=str, default=None,
+            help='Directory on filesystem to measure (i.e. filesystem of projects dir).',
+        )
+
+    def generate_project(self, path, files, size):
+        # Files are spread by directories like roles of real project.
+        for number in range(files):
+            directory = os.path.join(path, 'roles', 'role{}'.format(number // 10), 'files')
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, 'file{}'.format(number % 10)), 'wb') as fd:
+                fd.write(os.urandom(size))
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        tmp = tempfile.mkdtemp(dir=options['dir'])
+        try:
+            src = os.path.join(tmp, 'project')
+            self.generate_project(src, options['files'], options['size'])
+            for strategy in WORKDIR_STRATEGIES:
+                started = time.perf_counter()
+                copy_tree(src, os.path.join(tmp, strategy), strategy)
+                self._print('{}: {} files of {} bytes in {:.3f}s.'.format(
+                    strategy, options['files'], options['size'], time.perf_counter() - started
+                ), 'SUCCESS')
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,27 @@
+from ..base import ServiceCommand
+from ...models import History
+
+
+class Command(ServiceCommand):
+    help = "Convert output of finished executions to compressed chunks."
+    interactive = True
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--chunk-size', action='store', dest='chunk_size', type=int, default=None,
+            help='Size of uncompressed output stored in one chunk.',
+        )
+
+    def compress_histories(self, chunk_size=None):
+        qs = History.objects.filter(status__in=History.stoped_statuses, compressed_output=False)
+        counter = 0
+        for history in qs.iterator():
+            history.compress_output(chunk_size)
+            counter += 1
+        self._print('{} histories have been successfully compressed.'.format(counter), 'SUCCESS')
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        if self.ask_user_bool("Compress output of finished executions?[y/n]:"):
+            self.compress_histories(options['chunk_size'])
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_auto_20200622_0618'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='compressed_output',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='HistoryChunk',
+            fields=[
+                ('id', models.AutoField(max_length=20, primary_key=True, serialize=False)),
+                ('hidden', models.BooleanField(default=False)),
+                ('number', models.IntegerField(default=0)),
+                ('first_gnumber', models.IntegerField(default=0)),
+                ('last_gnumber', models.IntegerField(default=0)),
+                ('index', models.TextField(default='[]')),
+                ('data', models.BinaryField(default=b'')),
+                ('history', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='raw_history_chunk', related_query_name='raw_history_chunk', to='main.History')),
+            ],
+            options={
+                'ordering': ['history', 'number'],
+                'default_related_name': 'raw_history_chunk',
+            },
+        ),
+    ]
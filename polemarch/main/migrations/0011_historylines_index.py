@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_history_compressed_output'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='historylines',
+            index_together={('history', 'line_gnumber', 'line_number')},
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_historylines_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HookDeadLetter',
+            fields=[
+                ('id', models.AutoField(max_length=20, primary_key=True, serialize=False)),
+                ('hidden', models.BooleanField(default=False)),
+                ('recipient', models.TextField()),
+                ('when', models.CharField(max_length=32)),
+                ('message', models.TextField(default='null')),
+                ('error', models.TextField(default='')),
+                ('attempts', models.IntegerField(default=1)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('hook', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dead_letters', to='main.Hook')),
+            ],
+            options={
+                'ordering': ['created'],
+            },
+        ),
+    ]
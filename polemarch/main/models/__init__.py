@@ -9,20 +9,22 @@ from django_celery_beat.models import IntervalSchedule, CrontabSchedule, Periodi
 from django.db.models import signals, IntegerField
 from django.db import transaction
 from django.dispatch import receiver
+from django.contrib.contenttypes.models import ContentType
 from django.db.models.functions import Cast
 from django.core.validators import ValidationError
 from django.conf import settings
 from vstutils.utils import raise_context, KVExchanger
 
-from .vars import Variable
-from .hosts import Host, Group, Inventory
+from .base import signals_suppressed
+from .vars import Variable, AbstractModel, pre_vars_change, post_vars_change
+from .hosts import Host, Group, Inventory, inventory_imported
 from .projects import Project, Task, Module, ProjectTemplate, list_to_choices
 from .users import get_user_model, UserGroup, ACLPermission, UserSettings
-from .tasks import PeriodicTask, History, HistoryLines, Template
-from .hooks import Hook
+from .tasks import PeriodicTask, History, HistoryLines, HistoryChunk, Template
+from .hooks import Hook, HookDeadLetter
 from ..validators import RegexValidator, validate_hostname, path_validator
 from ..exceptions import UnknownTypeException, Conflict
-from ..utils import AnsibleArgumentsReference, CmdExecutor
+from ..utils import AnsibleArgumentsReference, CmdExecutor, WORKDIR_STRATEGIES
 
 
 logger = logging.getLogger('polemarch')
@@ -36,7 +38,7 @@ def send_hook(when: Text, target: Any) -> None:
     msg = OrderedDict(when=when)
     msg['target'] = target
     if 'loaddata' not in sys.argv:
-        Hook.objects.all().execute(when, msg)
+        Hook.objects.all().collect(when, msg)
 
 
 @raise_context()
@@ -60,6 +62,45 @@ def raise_linked_error(exception_class=ValidationError, **kwargs):
     raise exception_class(kwargs)
 
 
+def validate_variables(instance: AbstractModel, variables: Dict, keys: Iterable[Text] = None) -> None:
+    '''
+    Validates new values of instance variables.
+    :param keys: keys of all instance variables after change, existing keys by default.
+    '''
+    if isinstance(instance, PeriodicTask):
+        cmd = "module" if instance.kind == "MODULE" else "playbook"
+        AnsibleArgumentsReference().validate_args(cmd, variables)
+    elif isinstance(instance, Host):
+        if 'ansible_host' in variables:
+            validate_hostname(variables['ansible_host'])
+    elif isinstance(instance, Project):
+        validate_project_variables(instance, variables, keys)
+
+
+def validate_project_variables(instance: Project, variables: Dict, keys: Iterable[Text] = None) -> None:
+    if keys is None:
+        keys = instance.variables.values_list('key', flat=True)
+    keys = tuple(keys)
+    for key, value in variables.items():
+        if key == 'playbook_path':
+            path_validator(value)
+        if key == 'workdir_strategy' and value not in WORKDIR_STRATEGIES:
+            raise ValidationError('Unknown workdir strategy. Must be one of {}.'.format(list(WORKDIR_STRATEGIES)))
+
+        is_ci_var = key.startswith('ci_')
+        key_startswith = key.startswith('env_') or is_ci_var
+        if not key_startswith and key not in Project.VARS_KEY:
+            msg = 'Unknown variable key \'{}\'. Key must be in {} or starts from \'env_\' or \'ci_\'.'
+            raise ValidationError(msg.format(key, Project.VARS_KEY))
+
+        if is_ci_var and any(k.startswith('repo_sync_on_run') for k in keys):
+            raise Conflict('Couldnt install CI/CD to project with "repo_sync_on_run" settings.')
+        if key.startswith('repo_sync_on_run') and any(k.startswith('ci') for k in keys):
+            raise Conflict('Couldnt install "repo_sync_on_run" settings for CI/CD project.')
+        if key == 'ci_template' and not instance.template.filter(pk=value).exists():
+            raise ValidationError('Template does not exists in this project.')
+
+
 #####################################
 # SIGNALS
 #####################################
@@ -78,41 +119,14 @@ def remove_existed(instance: Variable, **kwargs) -> None:
 def check_variables_values(instance: Variable, *args, **kwargs) -> None:
     if 'loaddata' in sys.argv or kwargs.get('raw', False):  # nocv
         return
-    content_object = instance.content_object
-    if isinstance(content_object, PeriodicTask):
-        cmd = "module" if content_object.kind == "MODULE" else "playbook"
-        AnsibleArgumentsReference().validate_args(cmd, {instance.key: instance.value})
-    elif isinstance(content_object, Host):
-        if instance.key == 'ansible_host':
-            validate_hostname(instance.value)
+    validate_variables(instance.content_object, {instance.key: instance.value})
 
 
-@receiver(signals.pre_save, sender=Variable)
-def check_project_variables_values(instance: Variable, *args, **kwargs) -> None:
-    if 'loaddata' in sys.argv or kwargs.get('raw', False):  # nocv
+@receiver(pre_vars_change)
+def check_changed_variables_values(instance: AbstractModel, variables: Dict, keys: Iterable[Text], **kwargs) -> None:
+    if 'loaddata' in sys.argv:  # nocv
         return
-    if not isinstance(instance.content_object, Project):
-        return
-    if instance.key == 'playbook_path':
-        path_validator(instance.value)
-
-    project_object = instance.content_object
-
-    is_ci_var = instance.key.startswith('ci_')
-    key_startswith = instance.key.startswith('env_') or is_ci_var
-    if not key_startswith and instance.key not in Project.VARS_KEY:
-        msg = 'Unknown variable key \'{}\'. Key must be in {} or starts from \'env_\' or \'ci_\'.'
-        raise ValidationError(msg.format(instance.key, Project.VARS_KEY))
-
-    is_ci_template = instance.key == 'ci_template'
-    qs_variables = project_object.variables.all()
-
-    if is_ci_var and qs_variables.filter(key__startswith='repo_sync_on_run').exists():
-        raise Conflict('Couldnt install CI/CD to project with "repo_sync_on_run" settings.')
-    if instance.key.startswith('repo_sync_on_run') and project_object.get_vars_prefixed('ci'):
-        raise Conflict('Couldnt install "repo_sync_on_run" settings for CI/CD project.')
-    if is_ci_template and not project_object.template.filter(pk=instance.value).exists():
-        raise ValidationError('Template does not exists in this project.')
+    validate_variables(instance, variables, keys)
 
 
 @receiver(signals.pre_save, sender=Group)
@@ -370,6 +384,50 @@ def check_if_inventory_linked_project(instance: Inventory, **kwargs) -> None:
         )
 
 
+def update_inventories_content_version(*objects: Union[Host, Group, Inventory]) -> None:
+    # Inventories are resolved before changes, because relations may be deleted.
+    inventories_ids = Inventory.get_related_ids(*objects)
+    if not inventories_ids:
+        return
+    Inventory.update_content_version(inventories_ids)
+    transaction.on_commit(lambda: Inventory.update_content_version(inventories_ids))
+
+
+@receiver([signals.post_save, signals.post_delete], sender=Variable)
+@receiver([signals.post_save, signals.pre_delete], sender=Inventory)
+@receiver([signals.post_save, signals.pre_delete], sender=Group)
+@receiver([signals.post_save, signals.pre_delete], sender=Host)
+@receiver(signals.m2m_changed, sender=Inventory.hosts.through)
+@receiver(signals.m2m_changed, sender=Inventory.groups.through)
+@receiver(signals.m2m_changed, sender=Group.hosts.through)
+@receiver(signals.m2m_changed, sender=Group.parents.through)
+def update_inventory_content_version(instance: Any, **kwargs) -> None:
+    # Rendered inventories should be invalidated even on loaddata.
+    if kwargs.get('action', 'post_') in ('pre_add', 'pre_remove', 'post_clear') or signals_suppressed():
+        return
+    if isinstance(instance, Variable):
+        model = ContentType.objects.get_for_id(instance.content_type_id).model_class()
+        if model not in (Host, Group, Inventory):
+            return
+        instance = model(id=instance.object_id)
+    related = [kwargs['model'](id=pk) for pk in kwargs.get('pk_set', None) or ()]
+    update_inventories_content_version(instance, *related)
+
+
+@receiver([signals.post_save, signals.post_delete], sender=Hook)
+def update_hooks_routes_version(instance: Hook, **kwargs) -> None:
+    # Routing tables of all processes are reloaded after commit.
+    Hook.update_routes_version()
+    transaction.on_commit(Hook.update_routes_version)
+
+
+@receiver(post_vars_change)
+def update_inventory_content_version_by_vars(instance: AbstractModel, **kwargs) -> None:
+    if signals_suppressed() or not isinstance(instance, (Host, Group, Inventory)):
+        return
+    update_inventories_content_version(instance)
+
+
 @receiver(signals.pre_save, sender=Hook)
 def check_hook(instance: Hook, **kwargs) -> None:
     if 'loaddata' in sys.argv or kwargs.get('raw', False):  # noce
@@ -403,7 +461,7 @@ def user_add_hook(instance: BaseUser, **kwargs) -> None:
 @receiver([signals.post_save, signals.post_delete], sender=Group)
 @receiver([signals.post_save, signals.post_delete], sender=Host)
 def polemarch_hook(instance: Any, **kwargs) -> None:
-    if 'loaddata' in sys.argv or kwargs.get('raw', False):  # noce
+    if 'loaddata' in sys.argv or kwargs.get('raw', False) or signals_suppressed():  # noce
         return
     created = kwargs.get('created', None)
     when = "on_object_add"
@@ -419,6 +477,21 @@ def polemarch_hook(instance: Any, **kwargs) -> None:
     send_polemarch_models(when, instance)
 
 
+@receiver(post_vars_change)
+def polemarch_vars_hook(instance: AbstractModel, **kwargs) -> None:
+    if 'loaddata' in sys.argv or signals_suppressed():  # noce
+        return
+    send_polemarch_models("on_object_upd", instance)
+
+
+@receiver(inventory_imported, sender=Inventory)
+def inventory_import_hook(instance: Inventory, stats: Dict, **kwargs) -> None:
+    update_inventories_content_version(instance)
+    if 'loaddata' in sys.argv:  # nocv
+        return
+    send_polemarch_models("on_object_upd", instance, import_stats=stats)
+
+
 @receiver(signals.post_save, sender=BaseUser)
 def create_settings_for_user(instance: BaseUser, **kwargs) -> None:
     if 'loaddata' in sys.argv or kwargs.get('raw', False):  # nocv
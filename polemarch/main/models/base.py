@@ -1,6 +1,8 @@
 # pylint: disable=no-name-in-module
 from __future__ import unicode_literals
 from typing import Callable, Any
+import threading
+from contextlib import contextmanager
 from django.db import models
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -9,10 +11,30 @@ from vstutils.utils import classproperty
 from vstutils.models import BQuerySet as _BQSet, BaseModel as _BM, Manager as _BManager
 
 
+_signals_state = threading.local()
+
+
 def first_staff_user() -> int:
     return get_user_model().objects.filter(is_staff=True).first().id
 
 
+@contextmanager
+def suppress_signals():
+    '''
+    Context for bulk operations, which send aggregated signals by themselves.
+    '''
+    previous = signals_suppressed()
+    _signals_state.suppressed = True
+    try:
+        yield
+    finally:
+        _signals_state.suppressed = previous
+
+
+def signals_suppressed() -> bool:
+    return getattr(_signals_state, 'suppressed', False)
+
+
 class BQuerySet(_BQSet):
     use_for_related_fields = True
 
@@ -1,10 +1,16 @@
 from __future__ import unicode_literals
-from typing import NoReturn, Text, Any, List
+from typing import NoReturn, Text, Any, List, Dict
+import json
+import atexit
 import logging
+import threading
 import collections
 import uuid
+from django.conf import settings
+from django.db import transaction, connection
 from vstutils.utils import raise_context, ModelHandlers
 from .base import BModel, BQuerySet, models
+from ..utils import PMObject
 
 
 logger = logging.getLogger('polemarch')
@@ -31,6 +37,9 @@ class HookHandlers(ModelHandlers):
         logger.debug("Send hook {} triggered by {}.".format(obj.name, when))
         return getattr(self.get_handler(obj), when)(message)
 
+    def deliver(self, obj: BModel, recipient: Text, when: Text, message: Any):
+        return self.get_handler(obj).deliver(recipient, when, message)
+
     def validate(self, obj: BModel):
         return self.get_handler(obj).validate()
 
@@ -41,22 +50,126 @@ class HooksQuerySet(BQuerySet):
     def when(self, when: Text) -> BQuerySet:
         return self.filter(enable=True).filter(models.Q(when=when) | models.Q(when=None))
 
+    def routes(self, *whens: Text) -> List['Hook']:
+        # Unfiltered querysets are served by routing table without queries.
+        if self.query.where:
+            return list(self.filter(enable=True).filter(models.Q(when__in=whens) | models.Q(when=None)))
+        routes = self.model.get_routes()
+        hooks = list(routes.get(None, ()))
+        for when in whens:
+            hooks.extend(routes.get(when, ()))
+        return sorted(hooks, key=lambda hook: hook.id)
+
     def execute(self, when: Text, message: Any) -> NoReturn:
-        for hook in self.when(when):
+        for hook in self.routes(when):
             with raise_context():
-                hook.run(when, message)
+                hook.send(when, message)
+
+    def execute_batches(self, batches: Dict[Text, List[Any]]) -> NoReturn:
+        size = max(settings.HOOKS_BATCH_SIZE, 1)
+        for hook in self.routes(*batches):
+            for when, messages in batches.items():
+                for i in range(0, len(messages), size):
+                    batch = messages[i:i + size]
+                    with raise_context():
+                        hook.send(when, batch if len(batch) > 1 else batch[0])
+
+    def collect(self, when: Text, message: Any) -> NoReturn:
+        if settings.HOOKS_BATCH_SIZE > 0:
+            HookCollector.collect(when, message)
+        else:
+            self.execute(when, message)
+
+
+class HookCollector:
+    '''
+    Collects hook messages of transaction and sends them after commit.
+    Equal messages are sent once and others are grouped in batches.
+    '''
+    __slots__ = ('messages',)
+    _lock = threading.Lock()
+    _outbox = collections.OrderedDict()
+    _timer = None
+
+    def __init__(self):
+        self.messages = collections.OrderedDict()
+
+    def __call__(self) -> NoReturn:
+        self.put(self.messages)
+
+    def add(self, when: Text, message: Any) -> NoReturn:
+        key = (when, json.dumps(message, sort_keys=True, default=str))
+        self.messages.setdefault(key, message)
+
+    @classmethod
+    def collect(cls, when: Text, message: Any) -> NoReturn:
+        if not connection.in_atomic_block:
+            collector = cls()
+            collector.add(when, message)
+            return collector()
+        # Collector is kept on connection with position of its callback. Commit clears callbacks
+        # and rollback drops them, so next transaction gets new collector without scan of callbacks.
+        collector, position = getattr(connection, 'hook_collector', (None, 0))
+        callbacks = connection.run_on_commit
+        if collector is None or position >= len(callbacks) or callbacks[position][1] is not collector:
+            collector = cls()
+            connection.hook_collector = (collector, len(callbacks))
+            transaction.on_commit(collector)
+        collector.add(when, message)
+
+    @classmethod
+    def put(cls, messages: Dict) -> NoReturn:
+        with cls._lock:
+            for key, message in messages.items():
+                cls._outbox.setdefault(key, message)
+            linger = settings.HOOKS_BATCH_LINGER
+            if linger and len(cls._outbox) < settings.HOOKS_BATCH_SIZE:
+                if cls._timer is None:
+                    cls._timer = threading.Timer(linger, cls._flush_by_timer)
+                    cls._timer.daemon = True
+                    cls._timer.start()
+                return
+        cls.flush()
+
+    @classmethod
+    def flush(cls) -> NoReturn:
+        with cls._lock:
+            outbox, cls._outbox = cls._outbox, collections.OrderedDict()
+            if cls._timer is not None:
+                cls._timer.cancel()
+                cls._timer = None
+        batches = collections.OrderedDict()
+        for (when, _), message in outbox.items():
+            batches.setdefault(when, []).append(message)
+        if batches:
+            Hook.objects.all().execute_batches(batches)
+
+    @classmethod
+    def _flush_by_timer(cls) -> NoReturn:  # nocv
+        try:
+            cls.flush()
+        finally:
+            connection.close()
+
+
+atexit.register(raise_context()(HookCollector.flush))
 
 
 class Hook(BModel):
     # pylint: disable=no-member
     objects = HooksQuerySet.as_manager()
     handlers = HookHandlers("HOOKS", "'type' needed!")
+    task_handlers = ModelHandlers("TASKS_HANDLERS", "Unknown task type!")
     name       = models.CharField(max_length=512, default=uuid.uuid1)
     type       = models.CharField(max_length=32, null=False, db_index=True)
     when       = models.CharField(max_length=32, null=True, default=None, db_index=True)
     enable     = models.BooleanField(default=True, db_index=True)
     recipients = models.TextField()
 
+    routes_version_key = 'hooks-routes-version'
+    # Routing table of process: (version, {when: (hooks)})
+    _routes = (None, {})
+
     @property
     def reps(self) -> List[Text]:
         return self.recipients.split(' | ')
@@ -66,3 +179,57 @@ class Hook(BModel):
             self.handlers.handle(self, when, message)
             if self.when is None or self.when == when else ''
         )
+
+    def send(self, when: Text, message: Any) -> NoReturn:
+        '''
+        Queue delivery of message to every recipient.
+        Failed deliveries are retried and saved as dead letters in the end.
+        '''
+        if self.when is not None and self.when != when:
+            return
+        task_class = self.task_handlers.backend('HOOK')
+        for recipient in filter(bool, self.reps):
+            task_class.delay(self.id, recipient, when, message)
+
+    @classmethod
+    def get_routes(cls) -> Dict[Text, tuple]:
+        '''
+        Enabled hooks grouped by `when`. Table is reloaded only
+        when routes version was changed by any process.
+        '''
+        version = PMObject.get_django_cache('default').get(cls.routes_version_key)
+        if version is None:
+            version = cls.update_routes_version()
+        routes_version, routes = cls._routes
+        if routes_version != version:
+            routes = collections.defaultdict(tuple)
+            for hook in cls.objects.filter(enable=True).order_by('id'):
+                routes[hook.when] += (hook,)
+            routes = dict(routes)
+            cls._routes = (version, routes)
+        return routes
+
+    @classmethod
+    def update_routes_version(cls) -> Text:
+        version = uuid.uuid4().hex
+        PMObject.get_django_cache('default').set(cls.routes_version_key, version, None)
+        return version
+
+
+class HookDeadLetter(BModel):
+    hook      = models.ForeignKey(Hook, on_delete=models.CASCADE, related_name='dead_letters')
+    recipient = models.TextField()
+    when      = models.CharField(max_length=32)
+    message   = models.TextField(default='null')
+    error     = models.TextField(default='')
+    attempts  = models.IntegerField(default=1)
+    created   = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created']
+
+    def resend(self) -> NoReturn:
+        self.hook.task_handlers.backend('HOOK').delay(
+            self.hook_id, self.recipient, self.when, json.loads(self.message)
+        )
+        self.delete()
@@ -1,29 +1,46 @@
 # pylint: disable=protected-access,no-member
 from __future__ import unicode_literals
-from typing import Any, List, Tuple, Dict, Text
+from typing import Any, List, Tuple, Dict, Text, Iterable, Set
+import re
+import json
 import logging
+import uuid
+from collections import defaultdict, OrderedDict
+from functools import reduce
+from operator import or_
+from django.core.exceptions import ValidationError
 from django.db.models import Q
-from django.db import transaction
+from django.db.models.expressions import RawSQL
+from django.db import transaction, connections
+from django.contrib.contenttypes.models import ContentType
+from django.dispatch import Signal
+from vstutils.utils import tmp_file
 try:
     from yaml import dump as to_yaml, CDumper as Dumper, ScalarNode
 except ImportError:  # nocv
     from yaml import dump as to_yaml, Dumper, ScalarNode
 
-from .base import models
+from .base import models, first_staff_user, suppress_signals
 from .base import ManyToManyFieldACL, ManyToManyFieldACLReverse
-from .vars import AbstractModel, AbstractVarsQuerySet
+from .vars import AbstractModel, AbstractVarsQuerySet, Variable, update_boolean
 from ...main import exceptions as ex, utils
-from ..validators import RegexValidator
+from ..validators import RegexValidator, validate_hostname
 
 
 logger = logging.getLogger("polemarch")
+inventory_imported = Signal(providing_args=["instance", "stats"])
 
 
-def _delete_not_existing_objects(queryset, object_dict):
-    queryset.exclude(name__in=[n['name'] for n in object_dict]).delete()
+# Helpfull methods
+class SubquerySQL(RawSQL):
+    """
+    Raw subquery for `__in` lookups.
+    Lookup adds parentheses itself and double ones make scalar subquery in SQLite.
+    """
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
 
 
-# Helpfull methods
 def _get_dict(objects: AbstractVarsQuerySet, keys: List = None, tmp_dir: Text = '/tmp') -> Tuple[Dict, List]:
     keys = keys if keys else list()
     result = dict()
@@ -100,16 +117,51 @@ class Host(InventoryItems):
 class GroupQuerySet(AbstractVarsQuerySet):
     # pylint: disable=no-member
 
-    def get_subgroups_id(self, accumulated: AbstractVarsQuerySet = None, tp: Text = "parents") -> AbstractVarsQuerySet:
-        accumulated = accumulated if accumulated else self.none()
-        list_id = self.exclude(id__in=accumulated).values_list("id", flat=True)
-        accumulated = (accumulated | list_id)
-        kw = {tp + "__id__in": list_id}
-        subs = self.model.objects.filter(**kw)
-        subs_id = subs.values_list("id", flat=True)
-        if subs_id:
-            accumulated = (accumulated | subs.get_subgroups_id(accumulated, tp))
-        return accumulated
+    def _get_relations(self, tp: Text) -> Tuple[Any, Text, Text]:
+        # Relation table and columns for resolving of children ("parents") or parents ("childrens")
+        through = self.model.parents.through
+        columns = ('from_group', 'to_group') if tp == "parents" else ('to_group', 'from_group')
+        return (through,) + tuple(through._meta.get_field(c).column for c in columns)
+
+    def _supports_recursive_cte(self) -> bool:
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            return True
+        if connection.vendor == 'sqlite':
+            return connection.Database.sqlite_version_info >= (3, 8, 3)
+        if connection.vendor == 'mysql':  # nocv
+            if connection.mysql_is_mariadb:
+                return connection.mysql_version >= (10, 2, 2)
+            return connection.mysql_version >= (8, 0, 1)
+        return False  # nocv
+
+    def get_subgroups_id(self, tp: Text = "parents") -> AbstractVarsQuerySet:
+        """
+        Ids of groups from queryset with all descendants (tp="parents")
+        or ancestors (tp="childrens") resolved by one recursive query.
+        """
+        through, column, related_column = self._get_relations(tp)
+        if not self._supports_recursive_cte():
+            return self._get_subgroups_id_by_levels(tp)  # nocv
+        sql, params = self.order_by().values('id').query.sql_with_params()
+        cte_sql = (
+            'WITH RECURSIVE subgroups(id) AS ('
+            '{sql} UNION SELECT rel.{column} FROM {table} rel '
+            'INNER JOIN subgroups ON rel.{related_column} = subgroups.id'
+            ') SELECT id FROM subgroups'
+        ).format(sql=sql, column=column, related_column=related_column, table=through._meta.db_table)
+        return self.model.objects.filter(id__in=SubquerySQL(cte_sql, params)).values_list("id", flat=True)
+
+    def _get_subgroups_id_by_levels(self, tp: Text = "parents") -> AbstractVarsQuerySet:
+        # Fallback for databases without recursive CTE: one simple query per level.
+        through, column, related_column = self._get_relations(tp)
+        result = set(self.values_list("id", flat=True))
+        level = result
+        while level:
+            relations = through.objects.filter(**{related_column + '__in': level})
+            level = set(relations.values_list(column, flat=True)) - result
+            result |= level
+        return self.model.objects.filter(id__in=result).values_list("id", flat=True)
 
     def get_subgroups(self) -> AbstractVarsQuerySet:
         return self.model.objects.filter(id__in=self.get_subgroups_id(tp="parents"))
@@ -145,7 +197,7 @@ class Group(InventoryItems):
         objs_dict, obj_keys = _get_dict(objs.all(), keys, tmp_dir)
         if objs_dict:
             result[key_name] = objs_dict
-        if self.vars:
+        if hvars:
             result['vars'] = hvars
         keys += obj_keys
         return result, keys
@@ -163,6 +215,11 @@ class Inventory(InventoryItems):
         allow_unicode=True
     )
     parser_class = utils.AnsibleInventoryParser
+    content_version_key = 'inventory-content-version-{}'
+    render_cache_key = 'inventory-render-{}-{}'
+    render_cache_timeout = 86400
+    # Placeholder contains random nonce of render, so it could not be written in other values.
+    secret_placeholder = '__POLEMARCH_SECRET_{}_{}__'
 
     class Meta:
         default_related_name = "inventories"
@@ -190,19 +247,149 @@ class Inventory(InventoryItems):
         return self.hosts.all().order_by("name")
 
     def get_inventory(self, tmp_dir='/tmp/') -> Tuple[Text, List]:
+        cache = self.get_render_cache()
+        cache_key = self.render_cache_key.format(self.id, self.get_content_version())
+        rendered = cache.get(cache_key)
+        if rendered is None:
+            rendered = self._render_inventory()
+            cache.set(cache_key, rendered, self.render_cache_timeout)
+        inventory, nonce, secrets = rendered
+        if not secrets:
+            return inventory, []
+        # Secrets are never cached and always are read from database.
+        values = dict(Variable.objects.filter(id__in=[i for i, _ in secrets]).values_list('id', 'value'))
+        keys, key_files = [], dict()
+
+        def get_secret(match):
+            variable_id, is_key_file = secrets[int(match.group(1))]
+            value = values.get(variable_id, None) or ''
+            if not is_key_file:
+                return json.dumps(value, ensure_ascii=False)
+            if value not in key_files:
+                keys.append(tmp_file(value, dir=tmp_dir))
+                key_files[value] = keys[-1].name
+            return key_files[value]
+
+        regex = re.compile(self.secret_placeholder.format(nonce, r'(\d+)'))
+        return regex.sub(get_secret, inventory), keys
+
+    def _render_inventory(self) -> Tuple[Text, Text, List[Tuple[int, bool]]]:
+        # Inventory items are loaded by few queries instead of walking through
+        # `toDict()` of every item. Values of hidden variables are replaced by
+        # placeholders with variable id and are filled by `get_inventory()`.
+        hosts = {host.id: host for host in self.hosts.all()}
+        groups = {group.id: group for group in self.groups.all()}
+        groups_ids = list(groups.keys())
+        with_children = [group_id for group_id, group in groups.items() if group.children]
+        if with_children:
+            groups_ids += list(Group.objects.filter(id__in=with_children).get_subgroups_id(tp="parents"))
+        all_groups = {group.id: group for group in Group.objects.filter(id__in=groups_ids)}
+
+        children = defaultdict(list)
+        relations = Group.parents.through.objects.filter(to_group_id__in=all_groups.keys())
+        for child_id, parent_id in relations.values_list('from_group_id', 'to_group_id'):
+            children[parent_id].append(child_id)
+        groups_hosts = defaultdict(list)
+        relations = Group.hosts.through.objects.filter(group_id__in=all_groups.keys())
+        for group_id, host_id in relations.values_list('group_id', 'host_id'):
+            groups_hosts[group_id].append(host_id)
+        all_hosts = {host.id: host for host in Host.objects.filter(
+            Q(id__in=hosts.keys()) | Q(id__in=[i for ids in groups_hosts.values() for i in ids])
+        )}
+
+        content_types = ContentType.objects.get_for_models(Host, Group, Inventory)
+        variables = defaultdict(OrderedDict)
+        variables_ids = dict()
+        qs = Variable.objects.filter(
+            Q(content_type=content_types[Host], object_id__in=all_hosts.keys()) |
+            Q(content_type=content_types[Group], object_id__in=all_groups.keys()) |
+            Q(content_type=content_types[Inventory], object_id=self.id)
+        ).cleared()
+        values = qs.values_list('id', 'content_type_id', 'object_id', 'key', 'value')
+        for variable_id, content_type_id, object_id, key, value in values:
+            variables[(content_type_id, object_id)][key] = value
+            variables_ids[(content_type_id, object_id, key)] = variable_id
+
+        nonce, secrets = uuid.uuid4().hex, []
+
+        def get_vars(obj):
+            obj_key = (content_types[obj.__class__].id, obj.id)
+            obj_vars = variables.get(obj_key, None)
+            if not obj_vars:
+                return dict()
+            obj_vars = reduce(update_boolean, obj.BOOLEAN_VARS, OrderedDict(obj_vars))
+            for key in filter(obj_vars.__contains__, obj.HIDDEN_VARS):
+                obj_vars[key] = self.secret_placeholder.format(nonce, len(secrets))
+                secrets.append((variables_ids[obj_key + (key,)], key == "ansible_ssh_private_key_file"))
+            return dict(obj_vars)
+
+        def get_host(host):
+            return get_vars(host) or None
+
+        def get_group(group):
+            result = dict()
+            if group.children:
+                objs_dict = {all_groups[i].name: get_group(all_groups[i]) for i in children[group.id]}
+                key_name = 'children'
+            else:
+                objs_dict = {all_hosts[i].name: get_host(all_hosts[i]) for i in groups_hosts[group.id]}
+                key_name = 'hosts'
+            if objs_dict:
+                result[key_name] = objs_dict
+            group_vars = get_vars(group)
+            if group_vars:
+                result['vars'] = group_vars
+            return result
+
         inv = dict(all=dict())
-        hvars, keys = self.get_generated_vars(tmp_dir)
-        hosts = self.hosts.all().order_by("name")
-        groups = self.groups.all().order_by("name")
-        hosts_dicts, keys = _get_dict(hosts, keys, tmp_dir)
-        groups_dicts, keys = _get_dict(groups, keys, tmp_dir)
+        inv_vars = get_vars(self)
+        hosts_dicts = {host.name: get_host(host) for host in hosts.values()}
+        groups_dicts = {group.name: get_group(group) for group in groups.values()}
         if hosts_dicts:
             inv['all']['hosts'] = hosts_dicts
         if groups_dicts:
             inv['all']['children'] = groups_dicts
-        if hvars:
-            inv['all']['vars'] = hvars
-        return to_yaml(inv, **self._to_yaml_kwargs), keys
+        if inv_vars:
+            inv['all']['vars'] = inv_vars
+        return to_yaml(inv, **self._to_yaml_kwargs), nonce, secrets
+
+    @classmethod
+    def get_render_cache(cls):
+        return utils.PMObject.get_django_cache('default')
+
+    def get_content_version(self) -> Text:
+        version = self.get_render_cache().get(self.content_version_key.format(self.id))
+        return version or self.update_content_version([self.id])[self.id]
+
+    @classmethod
+    def update_content_version(cls, inventories_ids: Iterable[int]) -> Dict[int, Text]:
+        # Change of inventory content invalidates only rendered inventory itself.
+        versions = {inventory_id: uuid.uuid4().hex for inventory_id in inventories_ids}
+        cls.get_render_cache().set_many(
+            {cls.content_version_key.format(i): version for i, version in versions.items()},
+            cls.render_cache_timeout
+        )
+        return versions
+
+    @classmethod
+    def get_related_ids(cls, *objects: InventoryItems) -> Set[int]:
+        '''
+        :return: ids of inventories, which include objects directly or through groups.
+        '''
+        inventories = {obj.id for obj in objects if isinstance(obj, Inventory)}
+        groups = {obj.id for obj in objects if isinstance(obj, Group)}
+        hosts = {obj.id for obj in objects if isinstance(obj, Host)}
+        if hosts:
+            groups.update(Group.hosts.through.objects.filter(host_id__in=hosts).values_list('group_id', flat=True))
+            inventories.update(
+                cls.hosts.through.objects.filter(host_id__in=hosts).values_list('inventory_id', flat=True)
+            )
+        if groups:
+            parents = Group.objects.filter(id__in=groups).get_subgroups_id(tp="childrens")
+            inventories.update(
+                cls.groups.through.objects.filter(group_id__in=parents).values_list('inventory_id', flat=True)
+            )
+        return inventories
 
     @property
     def all_groups(self) -> GroupQuerySet:
@@ -222,33 +409,195 @@ class Inventory(InventoryItems):
     @transaction.atomic()
     def import_inventory_from_string(cls, name, raw_data, **kwargs):
         inv_json = cls.parse_inventory_from_str(raw_data)
+        importer = InventoryImporter(inv_json, **kwargs)
+        importer.validate()
 
         inventory = kwargs.pop('inventory_instance', None)
         if inventory is None:
             inventory = cls.objects.create(name=name, **kwargs)
 
-        inventory.vars = inv_json['vars']
-        created_hosts, created_groups = dict(), dict()
-
-        _delete_not_existing_objects(inventory.hosts, inv_json['hosts'])
-        for host in inv_json['hosts']:
-            inv_host, _ = inventory.hosts.get_or_create(name=host['name'], **kwargs)
-            inv_host.vars = host['vars']
-            created_hosts[inv_host.name] = inv_host
-
-        _delete_not_existing_objects(inventory.groups, inv_json['groups'])
-        for group in inv_json['groups']:
-            children = not len(group['groups']) == 0
-            inv_group, _ = inventory.groups.get_or_create(name=group['name'], children=children, **kwargs)
-            inv_group.vars = group['vars']
-            created_groups[inv_group.name] = inv_group
-
-        for group in inv_json['groups']:
-            inv_group = created_groups[group['name']]
-            if inv_group.children:
-                inv_group.groups.set((created_groups[n] for n in group['groups']))
-            else:
-                inv_group.hosts.set((created_hosts[n] for n in group['hosts']))
-
+        importer.apply(inventory)
+        inventory_imported.send(sender=cls, instance=inventory, stats=importer.stats)
         inventory.raw_data = raw_data
         return inventory
+
+
+class InventoryImporter:
+    """
+    Applies parsed inventory data to inventory by bulk queries.
+    Existing hosts, groups, variables and relations are compared with data
+    and only the difference is written. Signals are not sent for every object,
+    `inventory_imported` signal is sent for whole import instead.
+    """
+    encrypted_value = '[~~ENCRYPTED~~]'
+    group_name_validator = RegexValidator(regex=r'^[a-zA-Z0-9\-\._]*$', message='Name must be Alphanumeric')
+
+    def __init__(self, data: Dict, **kwargs):
+        self.data = data
+        self.kwargs = {k: v for k, v in kwargs.items() if k != 'inventory_instance'}
+        self.stats = OrderedDict((key, 0) for key in (
+            'hosts_created', 'hosts_deleted', 'groups_created', 'groups_deleted',
+            'variables_created', 'variables_updated', 'variables_deleted',
+        ))
+
+    def validate(self) -> None:
+        errors = defaultdict(list)
+        checks = [(validate_hostname, host['name'], host['name']) for host in self.data['hosts']]
+        checks += [
+            (validate_hostname, host['name'], host['vars']['ansible_host'])
+            for host in self.data['hosts'] if host['vars'].get('ansible_host', None) is not None
+        ]
+        checks += [(self.group_name_validator, group['name'], group['name']) for group in self.data['groups']]
+        for validator, name, value in checks:
+            try:
+                validator(value)
+            except ValidationError as err:
+                errors[name].extend(err.messages)
+        if errors:
+            raise ValidationError(dict(errors))
+        self._check_circular_deps()
+
+    def _check_circular_deps(self) -> None:
+        children = {group['name']: group['groups'] for group in self.data['groups']}
+        checked, path = set(), []
+
+        def visit(name):
+            if name in path:
+                raise CiclicDependencyError("The group has a dependence on itself.")
+            if name in checked:
+                return
+            path.append(name)
+            for child in children.get(name, ()):
+                visit(child)
+            path.pop()
+            checked.add(name)
+
+        for name in children:
+            visit(name)
+
+    def _get_fields_values(self, model) -> Dict[Text, Any]:
+        values = dict()
+        for key, value in self.kwargs.items():
+            field = model._meta.get_field(key)
+            values[field.attname] = getattr(value, 'pk', value) if field.is_relation else value
+        return values
+
+    def _create_objects(self, model, objects: List) -> List:
+        # Primary keys are returned from bulk insert not by all databases,
+        # so other databases re-select rows by unique marker of this insert.
+        if not objects or connections[model.objects.db].features.can_return_ids_from_bulk_insert:
+            return model.objects.bulk_create(objects)
+        notes, marker = defaultdict(list), '__import_{}__'.format(uuid.uuid4().hex)
+        for obj in objects:
+            notes[obj.notes].append(obj.name)
+            obj.notes = marker
+        model.objects.bulk_create(objects)
+        created = {obj.name: obj for obj in model.objects.filter(notes=marker)}
+        for value, names in notes.items():
+            model.objects.filter(notes=marker, name__in=names).update(notes=value)
+            for name in names:
+                created[name].notes = value
+        return [created[obj.name] for obj in objects]
+
+    def _sync_items(self, inventory: 'Inventory', field_name: Text, items: List[Dict]) -> Dict[Text, Any]:
+        manager = getattr(inventory, field_name)
+        model = manager.model
+        values = self._get_fields_values(model)
+        required = {item['name']: item.get('fields', {}) for item in items}
+        objects, deleted = dict(), []
+        for obj in manager.all():
+            fields = required.get(obj.name, None)
+            if fields is None or any(getattr(obj, k) != v for k, v in fields.items()):
+                deleted.append(obj.id)
+            elif all(getattr(obj, k) == v for k, v in values.items()):
+                objects[obj.name] = obj
+        model.objects.filter(id__in=deleted).delete()
+
+        owner_id = values.pop('owner_id', None) or first_staff_user()
+        created = self._create_objects(model, [
+            model(name=name, owner_id=owner_id, **values, **fields)
+            for name, fields in required.items() if name not in objects
+        ])
+        through = getattr(Inventory, field_name).through
+        through.objects.bulk_create([
+            through(**{'inventory_id': inventory.id, model._meta.model_name + '_id': obj.id})
+            for obj in created
+        ])
+        objects.update((obj.name, obj) for obj in created)
+        self.stats[field_name + '_created'] += len(created)
+        self.stats[field_name + '_deleted'] += len(deleted)
+        return objects
+
+    def _sync_relations(self, through, column: Text, related_column: Text, relations: Dict[int, List[int]]) -> None:
+        required = {(obj_id, related_id) for obj_id, related in relations.items() for related_id in related}
+        existing = dict()
+        qs = through.objects.filter(**{column + '__in': list(relations.keys())})
+        for relation_id, obj_id, related_id in qs.values_list('id', column, related_column):
+            existing[(obj_id, related_id)] = relation_id
+        through.objects.filter(id__in=[i for key, i in existing.items() if key not in required]).delete()
+        through.objects.bulk_create([
+            through(**{column: obj_id, related_column: related_id})
+            for obj_id, related_id in required if (obj_id, related_id) not in existing
+        ])
+
+    def _sync_variables(self, objects: List[Tuple[Any, Dict]]) -> None:
+        content_types = ContentType.objects.get_for_models(Host, Group, Inventory)
+        required = OrderedDict(
+            ((content_types[obj.__class__].id, obj.id), variables) for obj, variables in objects
+        )
+        existing = defaultdict(lambda: defaultdict(list))
+        qs = Variable.objects.filter(reduce(or_, (
+            Q(content_type_id=content_type.id, object_id__in=[i for ct, i in required if ct == content_type.id])
+            for content_type in content_types.values()
+        )))
+        for variable in qs.order_by('id'):
+            existing[(variable.content_type_id, variable.object_id)][variable.key].append(variable)
+
+        created, updated, deleted = [], [], []
+        for obj_key, variables in required.items():
+            obj_existing = existing.get(obj_key, {})
+            for key, current in obj_existing.items():
+                if key not in variables:
+                    deleted += [variable for variable in current if not variable.hidden]
+            for key, value in variables.items():
+                if value == self.encrypted_value:
+                    continue
+                value = None if value is None else str(value)
+                current = obj_existing.get(key, [])
+                visible = [variable for variable in current if not variable.hidden]
+                if not visible:
+                    deleted += current
+                    created.append(Variable(content_type_id=obj_key[0], object_id=obj_key[1], key=key, value=value))
+                    continue
+                deleted += [variable for variable in current if variable is not visible[-1]]
+                if visible[-1].value != value:
+                    visible[-1].value = value
+                    updated.append(visible[-1])
+
+        Variable.objects.filter(id__in=[variable.id for variable in deleted]).delete()
+        Variable.objects.bulk_update(updated, ['value'], batch_size=500)
+        Variable.objects.bulk_create(created)
+        self.stats['variables_created'] += len(created)
+        self.stats['variables_updated'] += len(updated)
+        self.stats['variables_deleted'] += len(deleted)
+
+    def apply(self, inventory: 'Inventory') -> None:
+        with suppress_signals():
+            hosts = self._sync_items(inventory, 'hosts', self.data['hosts'])
+            groups = self._sync_items(inventory, 'groups', [
+                dict(name=group['name'], fields=dict(children=bool(group['groups'])))
+                for group in self.data['groups']
+            ])
+            self._sync_relations(Group.parents.through, 'to_group_id', 'from_group_id', {
+                groups[group['name']].id: [groups[name].id for name in group['groups']]
+                for group in self.data['groups'] if group['groups']
+            })
+            self._sync_relations(Group.hosts.through, 'group_id', 'host_id', {
+                groups[group['name']].id: [hosts[name].id for name in group['hosts']]
+                for group in self.data['groups'] if not group['groups']
+            })
+            self._sync_variables(
+                [(inventory, self.data['vars'])] +
+                [(hosts[host['name']], host['vars']) for host in self.data['hosts']] +
+                [(groups[group['name']], group['vars']) for group in self.data['groups']]
+            )
@@ -1,11 +1,10 @@
 # pylint: disable=protected-access,no-member,unused-argument
 from __future__ import unicode_literals
 
-from typing import Any, Dict, List, Tuple, Iterable, NoReturn, TypeVar, Text
+from typing import Any, Dict, List, Tuple, Iterable, NoReturn, TypeVar, Text, Callable
 import os
 import logging
 import traceback
-import time
 import uuid
 import requests
 from docutils.core import publish_parts as rst_gen
@@ -28,7 +27,7 @@ from .vars import AbstractModel, AbstractVarsQuerySet, models
 from ..exceptions import PMException
 from .base import ManyToManyFieldACL, BQuerySet, BModel
 from .hooks import Hook
-from ..utils import AnsibleModules, AnsibleConfigParser, SubCacheInterface
+from ..utils import AnsibleModules, AnsibleConfigParser, SubCacheInterface, ProjectSyncLock
 
 
 logger = logging.getLogger("polemarch")
@@ -123,7 +122,8 @@ class Project(AbstractModel):
         'repo_branch',
         'repo_password',
         'repo_key',
-        'playbook_path'
+        'playbook_path',
+        'workdir_strategy',
     ]
 
     EXTRA_OPTIONS = {
@@ -187,18 +187,19 @@ class Project(AbstractModel):
 
     @property
     def type(self) -> Text:
-        try:
-            return self.variables.get(key="repo_type").value
-        except self.variables.model.DoesNotExist:  # nocv
-            return 'MANUAL'
+        return self.vars.get('repo_type', 'MANUAL')
 
     @property
     def repo_sync_timeout(self):
         try:
-            return self.variables.get(key="repo_sync_on_run_timeout").value
+            return int(self.variables.get(key="repo_sync_on_run_timeout").value)
         except self.variables.model.DoesNotExist:
             return settings.PROJECT_REPOSYNC_WAIT_SECONDS
 
+    @property
+    def workdir_strategy(self) -> Text:
+        return self.vars.get('workdir_strategy', settings.EXECUTION_WORKDIR_STRATEGY)
+
     @property
     def config(self) -> Dict[Text, Any]:
         return self.get_ansible_config_parser().get_data()
@@ -304,18 +305,17 @@ class Project(AbstractModel):
     def hook(self, when, msg) -> NoReturn:
         Hook.objects.all().execute(when, msg)
 
+    @property
+    def sync_lock(self) -> ProjectSyncLock:
+        return ProjectSyncLock(self.id)
+
     def sync_on_execution_handler(self) -> NoReturn:
         if not self.vars.get('repo_sync_on_run', False):
             return
         timeout = self.repo_sync_timeout
         try:
-            for i in range(timeout):  # pylint: disable=unused-variable
-                self.refresh_from_db(fields=['status'])
-                if self.status not in self.BUSY_STATUSES:
-                    self.sync()
-                    return
-                time.sleep(1)  # nocv
-            raise Exception('Project busy (timeout={}).'.format(timeout))  # nocv
+            # Executions started together wait for one sync instead of running own.
+            self.sync_lock.execute(self.repo_class.get, timeout)
         except Exception as exc:  # nocv
             raise self.SyncError("ERROR on Sync operation: " + str(exc))
 
@@ -344,11 +344,17 @@ class Project(AbstractModel):
         self.set_status("WAIT_SYNC")
         return self.task_handlers.backend("REPO").delay(self, operation)
 
+    def _locked_repo_operation(self, operation: Callable) -> Any:
+        # Explicit operations wait for running sync or clone as long as lock could be held,
+        # instead of timeout of sync on execution.
+        lock = self.sync_lock
+        return lock.execute(operation, lock.timeout, coalesce=False)
+
     def sync(self, *args, **kwargs) -> Any:
-        return self.repo_class.get()
+        return self._locked_repo_operation(self.repo_class.get)
 
     def clone(self, *args, **kwargs) -> Any:
-        return self.repo_class.clone()
+        return self._locked_repo_operation(self.repo_class.clone)
 
     @property
     @raise_context_decorator_with_default(default='NotReady')
@@ -5,7 +5,10 @@ import logging
 from collections import OrderedDict
 from datetime import timedelta, datetime
 from functools import partial
+from itertools import chain
+from operator import eq, gt, ge, lt, le
 import json
+import zlib
 
 import re
 import io
@@ -15,7 +18,7 @@ from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from django.db.models import functions as dbfunc, Count
+from django.db.models import functions as dbfunc, Count, Max
 from django.utils.timezone import now
 from django.test import Client
 from django.conf import settings
@@ -29,6 +32,15 @@ from .projects import Project, HISTORY_ID
 
 
 logger = logging.getLogger("polemarch")
+line_lookups = {
+    'exact': eq,
+    'gt': gt,
+    'gte': ge,
+    'lt': lt,
+    'lte': le,
+    'in': lambda value, variants: value in variants,
+    'contains': lambda value, part: part in value,
+}
 InvOrString = TypeVar('InvOrString', str, int, Inventory, None)
 User = get_user_model()
 
@@ -391,6 +403,7 @@ class History(BModel):
     executor       = models.ForeignKey(User, blank=True, null=True, default=None,
                                        on_delete=models.SET_NULL)
     json_options   = models.TextField(default="{}")
+    compressed_output = models.BooleanField(default=False)
 
     working_statuses = ['DELAY', 'RUN']
     stoped_statuses = ['OK', 'ERROR', 'OFFLINE', 'INTERRUPTED']
@@ -495,12 +508,84 @@ class History(BModel):
         result = "{" + result[:-1] + "\n}"
         return json.loads(result)
 
-    def get_raw(self, original=True, filters=(), excludes=()) -> Text:
+    def _get_compressed_lines(self, filters=(), excludes=(), after=None, before=None) -> Generator:
+        chunks = self.raw_history_chunk.all()
+        if after is not None:
+            chunks = chunks.filter(last_gnumber__gt=after)
+        if before is not None:
+            chunks = chunks.filter(first_gnumber__lt=before)
+        conditions = list(filters) + [~Q(exclude) for exclude in excludes]
+        for chunk in chunks.order_by('number'):
+            for line in chunk.lines():
+                if after is not None and line.line_gnumber <= after:
+                    continue
+                if before is not None and line.line_gnumber >= before:
+                    continue
+                if all(match_line(condition, line) for condition in conditions):
+                    yield line
+
+    def get_lines(self, filters=(), excludes=(), after=None, before=None) -> List[BModel]:
         qs = self.raw_history_line.filter(*filters).exclude(*excludes)
-        qs = qs.order_by('line_gnumber', 'line_number')
-        data = "".join(qs.values_list("line", flat=True))
+        if after is not None:
+            qs = qs.filter(line_gnumber__gt=after)
+        if before is not None:
+            qs = qs.filter(line_gnumber__lt=before)
+        lines = list(qs.order_by('line_gnumber', 'line_number'))
+        if self.compressed_output:
+            lines = list(self._get_compressed_lines(filters, excludes, after, before)) + lines
+        return lines
+
+    def get_reversed_lines(self, after=None, before=None) -> 'ReversedHistoryLines':
+        return ReversedHistoryLines(self, after, before)
+
+    def get_raw(self, original=True, filters=(), excludes=()) -> Text:
+        if self.compressed_output:
+            data = "".join(line.line for line in self.get_lines(filters, excludes))
+        else:
+            qs = self.raw_history_line.filter(*filters).exclude(*excludes)
+            qs = qs.order_by('line_gnumber', 'line_number')
+            data = "".join(qs.values_list("line", flat=True))
         return data if original else self.ansi_escape.sub('', data)
 
+    @property
+    def last_line_gnumber(self) -> int:
+        last = self.raw_history_line.aggregate(last=Max('line_gnumber'))['last'] or 0
+        if self.compressed_output:
+            last_chunk = self.raw_history_chunk.aggregate(last=Max('last_gnumber'))['last'] or 0
+            last = max(last, last_chunk)
+        return last
+
+    def get_tail(self, after=0, before=None, original=True) -> Text:
+        filters = [Q(line_gnumber__gt=after)]
+        if before is not None:
+            filters.append(Q(line_gnumber__lt=before))
+        return self.get_raw(original, filters)
+
+    @transaction.atomic
+    def compress_output(self, chunk_size: int = None) -> NoReturn:
+        chunk_size = chunk_size or settings.HISTORY_OUTPUT_CHUNK_SIZE
+        qs = self.raw_history_line.order_by('line_gnumber', 'line_number')
+        last_chunk = self.raw_history_chunk.order_by('-number').first()
+        number = last_chunk.number if last_chunk else 0
+        chunks, lines, size = [], [], 0
+        for line in qs.values_list('line_gnumber', 'line_number', 'line').iterator():
+            lines.append(line)
+            size += len(line[2])
+            if size >= chunk_size:
+                number += 1
+                chunks.append(HistoryChunk.pack(self, number, lines))
+                lines, size = [], 0
+        if lines:
+            number += 1
+            chunks.append(HistoryChunk.pack(self, number, lines))
+        self.raw_history_chunk.bulk_create(chunks)
+        if chunks:
+            # Lines written during compression are kept for next one.
+            qs.filter(line_gnumber__lte=chunks[-1].last_gnumber).delete()
+        if not self.compressed_output:
+            self.compressed_output = True
+            self.save(update_fields=['compressed_output'])
+
     @property
     def raw_stdout(self) -> str:
         return self.get_raw()
@@ -514,6 +599,10 @@ class History(BModel):
     @raw_stdout.deleter
     def raw_stdout(self) -> NoReturn:
         self.raw_history_line.all().delete()
+        if self.compressed_output:
+            self.raw_history_chunk.all().delete()
+            self.compressed_output = False
+            self.save(update_fields=['compressed_output'])
 
     def check_output(self, output: str) -> NoReturn:
         raw_count = self.raw_history_line.all().count()
@@ -540,8 +629,11 @@ class History(BModel):
             yield self.__create_line(number, nline, endl)
 
     def write_line(self, value: str, number: int, endl: Text = "") -> NoReturn:
+        self.write_lines(((value, number, endl),))
+
+    def write_lines(self, lines: Iterable[Tuple[str, int, Text]]) -> NoReturn:
         self.raw_history_line.bulk_create(
-            map(lambda l: l, self.__bulking_lines(value, number, endl))
+            chain.from_iterable(self.__bulking_lines(*line) for line in lines)
         )
 
 
@@ -555,3 +647,112 @@ class HistoryLines(BModel):
     class Meta:
         default_related_name = "raw_history_line"
         ordering = ['-line_gnumber', '-line_number']
+        index_together = [
+            ['history', 'line_gnumber', 'line_number'],
+        ]
+
+
+class HistoryChunk(BModel):
+    number        = models.IntegerField(default=0)
+    first_gnumber = models.IntegerField(default=0)
+    last_gnumber  = models.IntegerField(default=0)
+    index         = models.TextField(default="[]")
+    data          = models.BinaryField(default=b'')
+    history       = models.ForeignKey(History, on_delete=models.CASCADE,
+                                      related_query_name="raw_history_chunk")
+
+    class Meta:
+        default_related_name = "raw_history_chunk"
+        ordering = ['history', 'number']
+
+    @classmethod
+    def pack(cls, history: History, number: int, lines: List[Tuple[int, int, Text]]) -> BModel:
+        # Index keeps numbers and end offset of every line in uncompressed data
+        index, offset = [], 0
+        for gnumber, line_number, line in lines:
+            offset += len(line)
+            index.append((gnumber, line_number, offset))
+        return cls(
+            history=history,
+            number=number,
+            first_gnumber=lines[0][0],
+            last_gnumber=lines[-1][0],
+            index=json.dumps(index),
+            data=zlib.compress(''.join(line for _, _, line in lines).encode('utf-8')),
+        )
+
+    def lines(self) -> Generator:
+        data = zlib.decompress(self.data).decode('utf-8')
+        start = 0
+        for gnumber, line_number, end in json.loads(self.index):
+            yield HistoryLines(
+                history_id=self.history_id,
+                line_gnumber=gnumber,
+                line_number=line_number,
+                line=data[start:end]
+            )
+            start = end
+
+
+class ReversedHistoryLines:
+    '''
+    Lines of compressed history from last to first in `after`-`before` range.
+    Counted by chunk indexes, so only chunks of requested slice are unpacked.
+    '''
+    __slots__ = 'after', 'before', 'lines', 'lines_count', 'chunks', 'count'
+
+    def __init__(self, history: History, after: int = None, before: int = None):
+        self.after, self.before = after, before
+        lines = history.raw_history_line.all()
+        chunks = history.raw_history_chunk.all()
+        if after is not None:
+            lines = lines.filter(line_gnumber__gt=after)
+            chunks = chunks.filter(last_gnumber__gt=after)
+        if before is not None:
+            lines = lines.filter(line_gnumber__lt=before)
+            chunks = chunks.filter(first_gnumber__lt=before)
+        self.lines = lines.order_by('-line_gnumber', '-line_number')
+        self.lines_count = self.lines.count()
+        # Lines not compressed yet are newer than every chunk.
+        self.chunks = [
+            (pk, sum(1 for gnumber, _, _ in json.loads(index) if self.in_range(gnumber)))
+            for pk, index in chunks.order_by('-number').values_list('id', 'index')
+        ]
+        self.count = self.lines_count + sum(count for _, count in self.chunks)
+
+    def in_range(self, gnumber: int) -> bool:
+        return (self.after is None or gnumber > self.after) and (self.before is None or gnumber < self.before)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, item: slice) -> List[BModel]:
+        start, stop, _ = item.indices(self.count)
+        result = list(self.lines[start:stop]) if start < self.lines_count else []
+        offset = self.lines_count
+        for pk, count in self.chunks:
+            if offset >= stop:
+                break
+            if offset + count > start:
+                lines = [line for line in HistoryChunk.objects.get(pk=pk).lines() if self.in_range(line.line_gnumber)]
+                lines.reverse()
+                result += lines[max(start - offset, 0):stop - offset]
+            offset += count
+        return result
+
+
+def match_line(condition: Q, line: HistoryLines) -> bool:
+    '''
+    Check that unpacked output line satisfies condition
+    as it would be done by database.
+    '''
+    results = []
+    for child in condition.children:
+        if isinstance(child, Q):
+            results.append(match_line(child, line))
+            continue
+        field, value = child
+        field, _, lookup = field.partition('__')
+        results.append(line_lookups[lookup or 'exact'](getattr(line, field), value))
+    result = all(results) if condition.connector == Q.AND else any(results)
+    return not result if condition.negated else result
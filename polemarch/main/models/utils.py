@@ -4,10 +4,12 @@ from typing import NoReturn, Text, Any, Iterable, Tuple, List, Dict, Union
 import os
 import re
 import time
+import queue
 import signal
 import shutil
 import logging
 import tempfile
+import threading
 import traceback
 from pathlib import Path
 from collections import namedtuple, OrderedDict
@@ -18,7 +20,9 @@ from vstutils.utils import tmp_file, KVExchanger, raise_context
 from vstutils.tools import get_file_value
 from .hosts import Inventory
 from .tasks import History, Project
-from ...main.utils import CmdExecutor, AnsibleArgumentsReference, PMObject
+from ...main.utils import (
+    CmdExecutor, AnsibleArgumentsReference, PMObject, HistoryStream, WorkdirCache, Redactor, copy_tree
+)
 
 
 logger = logging.getLogger("polemarch")
@@ -58,18 +62,74 @@ class DummyHistory:
         # pylint: disable=unused-argument
         logger.info(value)
 
+    def write_lines(self, lines: Iterable[Tuple[Text, int, Text]]):
+        for line in lines:
+            self.write_line(*line)
+
+    def compress_output(self) -> None:
+        pass
+
     def save(self) -> None:
         pass
 
 
+class OutputBuffer:
+    """
+    Execution output sink, which writes lines to history by batches.
+    Batch is written when it has `size` lines or when
+    it was not flushed more than `timeout` seconds.
+    Written batches are published to live `stream` if it is set.
+    """
+    __slots__ = 'history', 'size', 'timeout', 'lines', 'last_flush', 'lock', 'stream'
+
+    def __init__(self, history: History, size: int = 500, timeout: float = 0.25, stream: HistoryStream = None):
+        self.history = history
+        self.stream = stream
+        self.size = size
+        self.timeout = timeout
+        self.lines = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.lines)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() - self.last_flush >= self.timeout
+
+    def append(self, value: Text, number: int, endl: Text = '\n') -> NoReturn:
+        with self.lock:
+            self.lines.append((value, number, endl))
+            if len(self.lines) >= self.size or self.expired:
+                self.flush()
+
+    def flush(self) -> NoReturn:
+        with self.lock:
+            lines, self.lines = self.lines, []
+            self.last_flush = time.monotonic()
+            if lines:
+                self.history.write_lines(lines)
+                if self.stream is not None:
+                    self.stream.publish([(number, value + endl) for value, number, endl in lines])
+
+
 class Executor(CmdExecutor):
-    __slots__ = 'history', 'counter', 'exchanger'
+    __slots__ = 'history', 'counter', 'exchanger', 'buffer', 'redactor', 'lines'
 
-    def __init__(self, history: History):
+    def __init__(self, history: History, redactor: Redactor = None):
         super(Executor, self).__init__()
         self.history = history
+        self.redactor = redactor
         self.counter = 0
+        self.lines = queue.Queue()
         self.exchanger = KVExchanger(self.CANCEL_PREFIX + str(self.history.id))
+        self.buffer = OutputBuffer(
+            history,
+            self.get_django_settings('HISTORY_OUTPUT_BUFFER_SIZE', 500),
+            self.get_django_settings('HISTORY_OUTPUT_BUFFER_TIMEOUT', 0.25),
+            HistoryStream(self.history.id) if self.history.id else None,
+        )
         env_vars = {}
         if self.history.project is not None:
             env_vars = self.history.project.env_vars
@@ -84,9 +144,40 @@ class Executor(CmdExecutor):
     def output(self, value) -> NoReturn:
         pass  # nocv
 
+    def _read_stream(self, stream, lines: queue.Queue) -> NoReturn:
+        try:
+            for line in iter(stream.readline, ''):
+                lines.put(line.rstrip())
+        except (ValueError, OSError):  # nocv
+            pass
+        finally:
+            lines.put(None)
+
+    def _unbuffered(self, proc: Popen, stream: Text = 'stdout'):
+        # Stream is read in separate thread, so buffered output
+        # is written even if command doesn't print anything for a while.
+        # Lines of stream and messages of process handler are written only by executing thread.
+        lines = self.lines = queue.Queue()
+        threading.Thread(target=self._handle_process, args=(proc, stream)).start()
+        out = getattr(proc, stream)
+        threading.Thread(target=self._read_stream, args=(out, lines), daemon=True).start()
+        try:
+            while True:
+                try:
+                    line = lines.get(timeout=self.buffer.timeout)
+                except queue.Empty:
+                    self.buffer.flush()
+                    continue
+                if line is None:
+                    break
+                yield line
+            proc.wait()
+        finally:
+            out.close()
+
     def working_handler(self, proc: Popen):
-        if proc.poll() is None and self.exchanger.get() is not None:  # nocv
-            self.write_output("\n[ERROR]: User interrupted execution")
+        if proc.poll() is None and self.exchanger.get() is not None:
+            self.lines.put("\n[ERROR]: User interrupted execution")
             self.exchanger.delete()
             for _ in range(5):
                 try:
@@ -102,7 +193,9 @@ class Executor(CmdExecutor):
 
     def write_output(self, line: Text):
         self.counter += 1
-        self.history.write_line(line, self.counter, '\n')
+        if self.redactor is not None:
+            line = self.redactor(line)
+        self.buffer.append(line, self.counter, '\n')
 
     def execute(self, cmd: Iterable[Text], cwd: Text):
         pm_ansible_path = ' '.join(self.pm_ansible())
@@ -113,7 +206,10 @@ class Executor(CmdExecutor):
                     one_cmd = one_cmd.decode('utf-8')
             new_cmd.append(one_cmd)
         self.history.raw_args = " ".join(new_cmd).replace(pm_ansible_path, '').lstrip()
-        return super(Executor, self).execute(new_cmd, cwd)
+        try:
+            return super(Executor, self).execute(new_cmd, cwd)
+        finally:
+            self.buffer.flush()
 
 
 class AnsibleCommand(PMObject):
@@ -130,6 +226,9 @@ class AnsibleCommand(PMObject):
         -15: "INTERRUPTED",
         "other": "ERROR"
     }
+    revision_regex = re.compile(r'^[0-9a-f]{40}$')
+    workdir_cache = None
+    redactor = None
 
     class ExecutorClass(Executor):
         '''
@@ -297,17 +396,20 @@ class AnsibleCommand(PMObject):
         return dict(cwd=self._get_tmp_name())
 
     def hide_passwords(self, raw: Text) -> Text:
-        regex = r'|'.join((
-            r"(?<=" + hide + r":\s).{1,}?(?=[\n\t\s])"
-            for hide in self.get_hidden_vars()
-        ))
-        subst = "[~~ENCRYPTED~~]"
-        raw = re.sub(regex, subst, raw, 0, re.MULTILINE)
-        return raw
+        redactor = self.redactor or Redactor(self.get_hidden_vars())
+        return redactor(raw)
 
     def get_execution_revision(self, project: Project):  # nocv
         return project.revision
 
+    def get_workdir_cache(self, revision: Text) -> Union[WorkdirCache, None]:
+        # Only git commits identify content of project tree.
+        if not WorkdirCache.is_enabled() or self.project.type != 'GIT':
+            return None
+        if not self.revision_regex.match(revision or ''):
+            return None  # nocv
+        return WorkdirCache('{}-{}'.format(self.project.id, revision))
+
     def prepare(self, target: Text, inventory: Any, history: History, project: Project) -> NoReturn:
         self.target, self.project = target, project
         self.history = history if history else DummyHistory()
@@ -315,6 +417,8 @@ class AnsibleCommand(PMObject):
         self.project.sync_on_execution_handler()
         if inventory:
             self.inventory_object = self.Inventory(inventory, cwd=self.project.path, tmpdir=self.cwd)
+            # Secrets of inventory are masked in saved inventory and in execution output.
+            self.redactor = Redactor.from_text(self.get_hidden_vars(), self.inventory_object.raw)
             self.history.raw_inventory = self.hide_passwords(
                 self.inventory_object.raw
             )
@@ -322,7 +426,7 @@ class AnsibleCommand(PMObject):
             self.inventory_object = None
         self.history.revision = self.get_execution_revision(project)
         self.history.save()
-        self.executor = self.ExecutorClass(self.history)
+        self.executor = self.ExecutorClass(self.history, self.redactor)
 
         prepare_func = getattr(
             self,
@@ -330,9 +434,17 @@ class AnsibleCommand(PMObject):
             self.dir_prepare_copy
         )
         work_dir = self._get_tmp_name()
-        self._verbose_output('Copy project to tmp directory.', 2)
-        prepare_func(self.project.path, work_dir, self.history.revision)
-        self._verbose_output('Project copied to {}.'.format(work_dir), 2)
+        self.workdir_cache = self.get_workdir_cache(self.history.revision)
+        if self.workdir_cache is not None:
+            shared_dir = self.workdir_cache.acquire(
+                lambda path: prepare_func(self.project.path, path, self.history.revision)
+            )
+            os.symlink(shared_dir, work_dir)
+            self._verbose_output('Project tree {} is shared in {}.'.format(shared_dir, work_dir), 2)
+        else:
+            self._verbose_output('Copy project to tmp directory.', 2)
+            prepare_func(self.project.path, work_dir, self.history.revision)
+            self._verbose_output('Project copied to {}.'.format(work_dir), 2)
         project_cfg = os.path.join(work_dir, 'ansible.cfg')
         if os.path.exists(project_cfg) and os.path.isfile(project_cfg):
             self.executor.env['ANSIBLE_CONFIG'] = os.environ.get(
@@ -342,9 +454,12 @@ class AnsibleCommand(PMObject):
     def dir_prepare_git(self, src: Text, work_dir: Text, revision: Text):
         # pylint: disable=no-member
         import git
+        # Only requested revision is checked out and objects are shared
+        # with project repo by default (see `[git.prepare]` section).
         repo = git.Repo.clone_from(
             url=src + "/.git",
             to_path=work_dir,
+            no_checkout=True,
             **self.project.repo_handlers.opts(self.project.type).get('PREP_KWARGS', {})
         )
         repo.git.checkout(revision or self.project.branch)
@@ -363,10 +478,15 @@ class AnsibleCommand(PMObject):
     def dir_prepare_copy(self, src: Text, work_dir: Text, revision: Text):
         # pylint: disable=unused-argument
         if os.path.exists(src):
-            shutil.copytree(src=src, dst=work_dir)
+            copy_tree(src, work_dir, self.project.workdir_strategy)
         else:  # nocv
             raise Exception('Project dir {} is not exist.'.format(src))
 
+    def flush_output(self) -> NoReturn:
+        executor = getattr(self, 'executor', None)
+        if executor is not None:
+            executor.buffer.flush()
+
     def error_handler(self, exception: BaseException) -> NoReturn:
         # pylint: disable=no-else-return
         default_code = self.status_codes["other"]
@@ -400,6 +520,7 @@ class AnsibleCommand(PMObject):
             self.executor.execute(args, **kwargs)
         except Exception as exception:
             logger.error(traceback.format_exc())
+            self.flush_output()
             self.error_handler(exception)
             if self.__will_raise_exception:
                 raise
@@ -411,6 +532,11 @@ class AnsibleCommand(PMObject):
             self.history.save()
             self._send_hook('after_execution')
             self.__del__()
+            self.flush_output()
+            if self.history.id:
+                HistoryStream(self.history.id).finish(self.history.status)
+            if self.get_django_settings('HISTORY_OUTPUT_COMPRESSION', False):
+                self.history.compress_output()
 
     def run(self):
         try:
@@ -420,6 +546,8 @@ class AnsibleCommand(PMObject):
             raise
 
     def __del__(self):
+        if self.workdir_cache is not None:
+            self.workdir_cache.release()
         if hasattr(self, 'cwd') and os.path.exists(self.cwd):
             self._verbose_output('Tmpdir "{}" was cleared.'.format(self.cwd))
             shutil.rmtree(self.cwd, ignore_errors=True)
@@ -8,13 +8,17 @@ from functools import reduce
 from collections import OrderedDict
 from django.db import transaction
 from django.db.models import Case, When, Value
+from django.dispatch import Signal
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from vstutils.utils import tmp_file
-from .base import ACLModel, BQuerySet, BModel, models
+from .base import ACLModel, BQuerySet, BModel, models, suppress_signals
 
 
 logger = logging.getLogger("polemarch")
+# Aggregated signals of `AbstractModel.set_vars` instead of signals for every variable.
+pre_vars_change = Signal(providing_args=["instance", "variables", "keys"])
+post_vars_change = Signal(providing_args=["instance", "created", "updated", "deleted"])
 
 
 def update_boolean(items: Dict[str, Any], item: Any):
@@ -86,6 +90,13 @@ class Variable(BModel):
     def __unicode__(self):  # pragma: no cover
         return "{}={}".format(self.key, self.value)
 
+    @classmethod
+    def sort_key(cls, key: Text) -> Tuple[int, Text]:
+        # Same order as `VariablesQuerySet.sort_by_key()`
+        if key in cls.variables_keys:
+            return cls.variables_keys.index(key), key
+        return (99 if key.startswith('ansible_') else 100), key
+
 
 class AbstractVarsQuerySet(BQuerySet):
     use_for_related_fields = True
@@ -130,16 +141,63 @@ class AbstractModel(ACLModel):
 
     @transaction.atomic()
     def set_vars(self, variables) -> NoReturn:
+        '''
+        Writes only difference between existing and new variables by bulk queries.
+        `pre_vars_change` signal validates changed variables and `post_vars_change`
+        is sent once for all changes.
+        '''
         encr = "[~~ENCRYPTED~~]"
-        encrypted_vars = {k: v for k, v in variables.items() if v == encr}
-        other_vars = {k: v for k, v in variables.items() if v != encr}
-        self.variables.cleared().exclude(key__in=list(encrypted_vars.keys()) + list(other_vars.keys())).delete()
-        for key, value in other_vars.items():
-            self.variables.create(key=key, value=value)
+        existing = OrderedDict()
+        for variable in self.variables.order_by('id'):
+            existing.setdefault(variable.key, []).append(variable)
+
+        changed, created, updated, deleted = OrderedDict(), [], [], []
+        for key, current in existing.items():
+            if key not in variables:
+                deleted += [variable for variable in current if not variable.hidden]
+        for key, value in variables.items():
+            if value == encr:
+                continue
+            value = None if value is None else str(value)
+            current = existing.get(key, [])
+            visible = [variable for variable in current if not variable.hidden]
+            if not visible:
+                deleted += current
+                created.append(Variable(content_object=self, key=key, value=value))
+            else:
+                deleted += [variable for variable in current if variable is not visible[-1]]
+                if visible[-1].value == value:
+                    continue
+                visible[-1].value = value
+                updated.append(visible[-1])
+            changed[key] = value
+
+        if not (created or updated or deleted):
+            return
+        deleted_ids = {variable.id for variable in deleted}
+        keys = [key for key, current in existing.items() if any(v.id not in deleted_ids for v in current)]
+        keys += [variable.key for variable in created]
+        pre_vars_change.send(sender=self.__class__, instance=self, variables=changed, keys=keys)
+        with suppress_signals():
+            Variable.objects.filter(id__in=deleted_ids).delete()
+        Variable.objects.bulk_update(updated, ['value'], batch_size=500)
+        Variable.objects.bulk_create(created)
+        getattr(self, '_prefetched_objects_cache', {}).pop('variables', None)
+        post_vars_change.send(
+            sender=self.__class__, instance=self, created=created, updated=updated, deleted=deleted
+        )
 
     def get_vars(self) -> Union[OrderedDict, Dict]:
-        qs = self.variables.cleared().sort_by_key().values_list('key', 'value')
-        return reduce(update_boolean, self.BOOLEAN_VARS, OrderedDict(qs))
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('variables', None)
+        if prefetched is not None:
+            # Variables were prefetched for list of objects, so they are sorted without query.
+            items = sorted(
+                ((variable.key, variable.value) for variable in prefetched if not variable.hidden),
+                key=lambda item: Variable.sort_key(item[0])
+            )
+        else:
+            items = self.variables.cleared().sort_by_key().values_list('key', 'value')
+        return reduce(update_boolean, self.BOOLEAN_VARS, OrderedDict(items))
 
     def get_vars_prefixed(self, prefix: Text):
         vars_by_prefix_dict = dict()
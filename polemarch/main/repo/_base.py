@@ -1,27 +1,89 @@
 # pylint: disable=expression-not-assigned,abstract-method,import-error
 from __future__ import unicode_literals
-from typing import Any, Text, Dict, List, Tuple, Union, Iterable, Callable, TypeVar, NoReturn
+from typing import Any, Text, Dict, List, Tuple, Union, Iterable, Callable, TypeVar, NoReturn, Pattern
 import os
+import re
 import shutil
+import hashlib
 import pathlib
+import posixpath
 import logging
 import traceback
 from itertools import chain
+from functools import lru_cache
 
 from six.moves.urllib.request import urlretrieve
 from django.db import transaction
 from django.conf import settings
 from vstutils.utils import raise_context, import_class
-from ..utils import AnsibleModules
+from ..utils import AnsibleModules, SubCacheInterface
 from ..models.projects import Project
 from ..models.tasks import Template
 
 logger = logging.getLogger("polemarch")
 FILENAME = TypeVar('FILENAME', Text, str)
+GLOB_MAGIC = re.compile(r'[*?[]')
+
+
+@lru_cache(maxsize=256)
+def glob_regex(pattern: Text) -> Pattern:
+    '''
+    Compile glob pattern of relative path to regex. `*` and `?` do not match `/`,
+    `**` matches any count of directories.
+    '''
+    regex = []
+    parts = posixpath.normpath(pattern).split('/')
+    for num, part in enumerate(parts, 1):
+        last = num == len(parts)
+        if part == '**':
+            regex.append('.*' if last else '(?:[^/]+/)*')
+            continue
+        pos, length = 0, len(part)
+        while pos < length:
+            char = part[pos]
+            pos += 1
+            if char == '*':
+                regex.append('[^/]*')
+            elif char == '?':
+                regex.append('[^/]')
+            elif char == '[' and part.find(']', pos + 1) != -1:
+                end = part.find(']', pos + 1)
+                chars = part[pos:end].replace('\\', '\\\\')
+                regex.append('[{}]'.format('^' + chars[1:] if chars.startswith('!') else chars))
+                pos = end + 1
+            else:
+                regex.append(re.escape(char))
+        if not last:
+            regex.append('/')
+    return re.compile(''.join(regex))
+
+
+class FilesIndex:
+    '''
+    Relative paths of project files collected once and searched by glob patterns.
+    '''
+    __slots__ = 'files', 'dirs'
+
+    def __init__(self, files: Iterable[Text]):
+        self.files = tuple(sorted(set(files)))
+        self.dirs = {}
+        for path in self.files:
+            self.dirs.setdefault(path.rpartition('/')[0], []).append(path)
+
+    def __len__(self):
+        return len(self.files)
+
+    def search(self, pattern: Text) -> Iterable[pathlib.Path]:
+        # Paths like `./roles` or `roles/` of settings are relative to project root too.
+        pattern = posixpath.normpath(pattern)
+        parent = pattern.rpartition('/')[0]
+        # Only one directory could contain files of pattern without magic in parent.
+        files = self.files if GLOB_MAGIC.search(parent) else self.dirs.get(parent, ())
+        return map(pathlib.Path, filter(glob_regex(pattern).fullmatch, files))
 
 
 class _Base:
-    __slots__ = 'options', 'proj', 'path'
+    __slots__ = 'options', 'proj', 'path', 'state', 'files_index', 'unchanged'
 
     regex = r"(^[\w\d\.\-_]{1,})\.yml"
     handler_class = import_class(settings.PROJECT_CI_HANDLER_CLASS)
@@ -30,10 +92,32 @@ class _Base:
         self.options = options
         self.proj = project
         self.path = self.proj.path
+        self.state = {}
+        self.files_index = None
+        self.unchanged = False
 
     def _set_status(self, status) -> NoReturn:
         self.proj.set_status(status)
 
+    @property
+    def sync_cache(self) -> SubCacheInterface:
+        '''
+        Markers of data synced on last successful sync of project.
+        '''
+        return self.proj.get_yaml_subcache('sync')
+
+    def _save_state(self) -> NoReturn:
+        state, cache = dict(self.state), self.sync_cache
+        transaction.on_commit(lambda: cache.set(state))
+
+    def _get_sync_revision(self, repo: Any) -> Union[Text, None]:
+        # pylint: disable=unused-argument
+        '''
+        Revision of project files. Files of the same revision are not processed again,
+        so without revision every sync step is always performed.
+        '''
+        return None
+
     @raise_context()
     def _load_yaml(self) -> Dict[Text, Any]:
         '''
@@ -133,24 +217,32 @@ class _Base:
 
     def _set_tasks_list(self, playbooks_names: Iterable[pathlib.Path]) -> NoReturn:
         """
-        Updates playbooks in project.
+        Updates playbooks in project by difference between found files and existing rows.
         """
         # pylint: disable=invalid-name
         project = self.proj
-        project.playbook.all().delete()
         PlaybookModel = self.proj.playbook.model
+        new_playbooks = dict.fromkeys(map(str, playbooks_names))
+        outdated = []
+        for pk, playbook in project.playbook.values_list('id', 'playbook'):
+            if playbook in new_playbooks:
+                del new_playbooks[playbook]
+            else:
+                outdated.append(pk)
+        if outdated:
+            PlaybookModel.objects.filter(pk__in=outdated).delete()
+        if not new_playbooks:
+            return
         hidden = project.hidden
         split = str.split
-        playbook_objects = (
+        PlaybookModel.objects.bulk_create([
             PlaybookModel(
-                name=split(str(p), ".yml")[0], playbook=p,
+                name=split(p, ".yml")[0], playbook=p,
                 hidden=hidden, project=project
-            ) for p in playbooks_names
-        )
-        PlaybookModel.objects.bulk_create(playbook_objects) if playbook_objects else None
+            ) for p in new_playbooks
+        ])
 
-    def __get_project_modules(self, module_path: Iterable[Text]) -> List[Union[Text, Dict]]:
-        valid_paths = tuple(filter(self._dir_exists, module_path))
+    def __get_project_modules(self, valid_paths: Tuple[Text]) -> List[Union[Text, Dict]]:
         if not valid_paths:
             return []
         modules = AnsibleModules(detailed=False, paths=valid_paths)
@@ -159,44 +251,94 @@ class _Base:
         modules_list.sort()
         return modules_list
 
+    def _get_modules_hash(self, valid_paths: Tuple[Text]) -> Text:
+        '''
+        Hash of names and content of files in module directories.
+        '''
+        digest = hashlib.sha1()
+        for path in valid_paths:
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    digest.update(file_path.encode('utf-8') + b'\0')
+                    with raise_context():
+                        digest.update(pathlib.Path(file_path).read_bytes())
+        return digest.hexdigest()
+
     @raise_context()
     def _set_project_modules(self) -> None:
         '''
-        Update project modules
+        Update project modules by difference between found and existing modules.
+        Skipped when module directories are the same as on last sync.
         '''
         # pylint: disable=invalid-name
         project = self.proj
         project.get_ansible_config_parser().clear_cache()
-        project.modules.all().delete()
-        ModuleClass = self.proj.modules.model
         paths = project.config.get('DEFAULT_MODULE_PATH', [])
-        paths = filter(lambda mp: project.path in mp, paths)
-        modules = self.__get_project_modules(paths)
+        valid_paths = tuple(filter(self._dir_exists, (path for path in paths if project.path in path)))
+        previous_hash = self.state.pop('modules', None)
+        modules_hash = self._get_modules_hash(valid_paths)
+        if modules_hash == previous_hash:
+            self.message('Modules are not changed.')
+            self.state['modules'] = modules_hash
+            return
+        ModuleClass = self.proj.modules.model
+        new_modules = dict.fromkeys(self.__get_project_modules(valid_paths))
+        outdated = []
+        for pk, path in project.modules.values_list('id', 'path'):
+            if path in new_modules:
+                del new_modules[path]
+            else:
+                outdated.append(pk)
+        if outdated:
+            ModuleClass.objects.filter(pk__in=outdated).delete()
+        # Documentation of existing modules could be changed too.
+        project.modules.exclude(_data='{}').update(_data='{}')
         ModuleClass.objects.bulk_create([
-            ModuleClass(path=path, project=project) for path in modules
-        ])
+            ModuleClass(path=path, project=project) for path in new_modules
+        ]) if new_modules else None
+        self.state['modules'] = modules_hash
 
-    def _update_tasks(self, files: Iterable[pathlib.Path]) -> NoReturn:
+    def _update_tasks(self, repo: Any) -> NoReturn:
         '''
         Find and update playbooks in project.
-        :param files: list of filenames.
+        Skipped when revision of files and `playbook_path` are the same as on last sync.
+        :param repo: repo-object of project.
         '''
-        self._set_tasks_list(files)
+        additional_pb_pattern = self.proj.vars.get('playbook_path', None)
+        revision = self._get_sync_revision(repo)
+        marker = '{}:{}'.format(revision, additional_pb_pattern or '') if revision else None
+        if marker is not None and marker == self.state.get('playbooks', None):
+            self.message('Playbooks are not changed.')
+            return
+        self._set_tasks_list(self._get_playbook_path(repo, additional_pb_pattern))
+        self.state['playbooks'] = marker
+
+    def _get_files(self, repo: Any = None) -> Iterable[Text]:
+        # pylint: disable=unused-argument
+        for root, dirs, files in os.walk(self.path):
+            prefix = os.path.relpath(root, self.path) + '/'
+            prefix = '' if prefix == './' else prefix
+            for name in chain(dirs, files):
+                yield prefix + name
+
+    def get_files_index(self, repo: Any = None) -> FilesIndex:
+        '''
+        Index of project files. Built once for sync and used by every search.
+        '''
+        if self.files_index is None:
+            self.files_index = FilesIndex(self._get_files(repo))
+        return self.files_index
 
     def search_files(self, repo: Any = None, pattern: Text = '**/*') -> Iterable[pathlib.Path]:
-        # pylint: disable=unused-argument
-        path = pathlib.Path(self.path)
-        return map(lambda x: x.relative_to(self.path), path.glob(pattern))
+        return self.get_files_index(repo).search(pattern)
 
     def _operate(self, operation: Callable, **kwargs) -> Any:
         return operation(kwargs)
 
-    def _get_playbook_path(self, repo: Any = None) -> Iterable[pathlib.Path]:
+    def _get_playbook_path(self, repo: Any = None, additional_pb_pattern: Text = None) -> Iterable[pathlib.Path]:
         path_list_additional = []
-        additional_pb_pattern = None
-
-        with raise_context():
-            additional_pb_pattern = self.proj.variables.get(key='playbook_path').value
 
         if additional_pb_pattern and (pathlib.Path(self.path) / additional_pb_pattern).exists():
             path_list_additional = self.search_files(repo, additional_pb_pattern  + '/*.yml')
@@ -226,13 +368,23 @@ class _Base:
         self._set_status("SYNC")
         try:
             with transaction.atomic():
+                self.state = dict(self.sync_cache.get() or {})
+                self.files_index = None
                 result = self._operate(operation)
                 self.proj.status = "OK"
-                self._update_tasks(self._get_playbook_path(result[0]))
-                self._set_project_modules()
-                self._handle_yaml(self._load_yaml() or dict())
-                self._update_slave_inventories(self.proj.slave_inventory.all())
+                revision = self._get_sync_revision(result[0])
+                self.unchanged = revision is not None and revision == self.state.get('revision', None)
+                self._update_tasks(result[0])
+                if self.unchanged:
+                    self.message('Revision {} is unchanged.'.format(revision), 'info')
+                else:
+                    self._set_project_modules()
+                    self._handle_yaml(self._load_yaml() or dict())
+                    self._update_slave_inventories(self.proj.slave_inventory.all())
+                # Failed module discovery should be repeated on next sync.
+                self.state['revision'] = revision if 'modules' in self.state else None
                 self.proj.save()
+                self._save_state()
         except Exception as err:
             logger.debug(traceback.format_exc())
             self.message('Sync error: {}'.format(err), 'error')
@@ -272,6 +424,7 @@ class _Base:
 
         :return: user message
         '''
+        self.sync_cache.clear()
         if os.path.exists(self.path):
             if os.path.isfile(self.path):
                 os.remove(self.path)  # nocv
@@ -283,10 +436,12 @@ class _Base:
     def clone(self) -> Text:
         # pylint: disable=broad-except
         attempt = 2
+        # Fresh clone is fully processed.
+        self.sync_cache.clear()
         for __ in range(attempt):
             try:
                 repo = self._make_operations(self.make_clone)[0]
-                return "Received {} files.".format(len(list(self.search_files(repo))))
+                return "Received {} files.".format(len(self.get_files_index(repo)))
             except:
                 self.delete()
         raise Exception("Clone didn't perform by {} attempts.".format(attempt))
@@ -7,7 +7,7 @@ try:
     import git
 except:  # nocv
     warnings.warn("Git is not installed or have problems.")
-from ._base import _Base, os, logger, pathlib
+from ._base import _Base, os, logger
 
 ENV_VARS_TYPE =  Dict[Text, Union[Text, bool]]  # pylint: disable=invalid-name
 
@@ -160,6 +160,11 @@ class Git(_VCS):
         repo = self.get_repo()
         return repo.head.object.hexsha
 
+    @raise_context()
+    def _get_sync_revision(self, repo: git.Repo) -> Text:
+        commit = repo.head.commit
+        return '{}:{}'.format(commit.hexsha, commit.tree.hexsha)
+
     def _with_password(self, tmp, env_vars: ENV_VARS_TYPE) -> ENV_VARS_TYPE:
         env_vars.update(self.env.get("PASSWORD", dict()))
         tmp.write("echo '{}'".format(self.proj.vars["repo_password"]))
@@ -187,28 +192,13 @@ class Git(_VCS):
                 env_vars = self._with_key(tmp, env_vars)
             return super(Git, self)._operate(operation, **env_vars)
 
-    def search_files(self, repo: git.Repo = None, pattern: Text = '**/*') -> Iterable[pathlib.Path]:
-        recursive = pattern.startswith('**/')
-        if recursive:
-            pattern = pattern.replace('**/', '')
-
-        search_parent_dir = pattern.rsplit('/')[0]
-        if search_parent_dir == pattern:
-            search_parent_dir = pathlib.Path('.')
-        else:
-            search_parent_dir = pathlib.Path(search_parent_dir)
-
-        for path in dict(repo.index.entries.keys()).keys():
-            result = pathlib.Path(path)
-            if not recursive and result.parent != search_parent_dir:
-                continue
-            if result.match(pattern):
-                yield result
-
+    def _get_files(self, repo: git.Repo = None, prefix: Text = '') -> Iterable[Text]:
+        for path, _ in repo.index.entries:
+            yield prefix + path
         for sm in repo.submodules:
-            if recursive or pattern.startswith(sm.name):
-                for file in self.search_files(sm.module(), pattern.replace(sm.name + '/', '')):
-                    yield pathlib.Path(sm.name)/file
+            # Uninitialized or unreachable submodules have no files in working tree.
+            if sm.module_exists():
+                yield from self._get_files(sm.module(), '{}{}/'.format(prefix, sm.path))
 
     def get(self) -> Dict[str, str]:
         return {
@@ -201,6 +201,8 @@ class GitCloneSection(GitSection):
 
 git_fetch = {}
 git_clone = {}
+# Execution workdir shares objects of project repository instead of copying them
+git_prepare = {'shared': True}
 
 if TESTS_RUN:
     config['git'] = dict(fetch=dict(), clone=dict())
@@ -214,6 +216,9 @@ if 'git' in config:
     if 'clone' in git:
         git_clone = GitCloneSection('git.clone', config, git['clone']).all()
 
+    if 'prepare' in git:
+        git_prepare = GitCloneSection('git.prepare', config, git['prepare']).all()
+
 
 REPO_BACKENDS = {
     "MANUAL": {
@@ -224,6 +229,7 @@ REPO_BACKENDS = {
         "OPTIONS": {
             "CLONE_KWARGS": git_clone,
             "FETCH_KWARGS": git_fetch,
+            "PREP_KWARGS": git_prepare,
             "GIT_ENV": {
                 "GLOBAL": {
                     "GIT_SSL_NO_VERIFY": "true"
@@ -254,6 +260,9 @@ TASKS_HANDLERS = {
     "PLAYBOOK": {
         "BACKEND": "{}.main.tasks.tasks.ExecuteAnsiblePlaybook".format(VST_PROJECT_LIB_NAME)
     },
+    "HOOK": {
+        "BACKEND": "{}.main.tasks.tasks.HookTask".format(VST_PROJECT_LIB_NAME)
+    },
 }
 
 CLONE_RETRY = rpc.getint('clone_retry_count', fallback=5)
@@ -276,15 +285,44 @@ HOOKS = {
 }
 
 HOOKS_DIR = main.get("hooks_dir", fallback="/etc/polemarch/hooks/")
+# Hooks are delivered by celery workers with retries
+HOOKS_TIMEOUT = main.getseconds('hooks_timeout', fallback='30')
+HOOKS_POOL_SIZE = main.getint('hooks_pool_size', fallback=10)
+HOOKS_RETRY_COUNT = main.getint('hooks_retry_count', fallback=3)
+HOOKS_RETRY_DELAY = main.getseconds('hooks_retry_delay', fallback='5')
+# Object hooks are collected per transaction and sent in batches
+HOOKS_BATCH_SIZE = main.getint('hooks_batch_size', fallback=100)
+HOOKS_BATCH_LINGER = main.getseconds('hooks_batch_linger', fallback='0')
+# Scripts which are started once and receive events as ndjson
+HOOKS_PERSISTENT_SCRIPTS = list(filter(bool, map(
+    str.strip, main.get('hooks_persistent_scripts', fallback='').split(',')
+)))
+HOOKS_SCRIPT_CONCURRENCY = main.getint('hooks_script_concurrency', fallback=1)
 
 __EXECUTOR_DEFAULT = '{INTERPRETER} -m pm_ansible'
 EXECUTOR = main.get("executor_path", fallback=__EXECUTOR_DEFAULT).strip().split(' ')
+# Service ansible calls (inventory parsing, reference, config) are served by long-lived worker
+ANSIBLE_WORKER = main.getboolean('ansible_worker', fallback=True)
 SELFCARE = '/tmp/'
 
 MANUAL_PROJECT_VARS = config['project_manual_vars'].all() or \
                       dict(forks=4, timeout=30, fact_caching_timeout=3600, poll_interval=5)
 
 PROJECT_REPOSYNC_WAIT_SECONDS = main.getseconds('repo_sync_on_run_timeout', fallback='1:00')
+# Default way to prepare project sources in execution directory: copy, hardlink or reflink
+EXECUTION_WORKDIR_STRATEGY = main.get('execution_workdir_strategy', fallback='copy')
+# Prepared trees of git revisions are shared by executions (disabled when size is 0)
+EXECUTION_WORKDIR_CACHE_DIR = main.get('execution_workdir_cache_dir', fallback='')
+EXECUTION_WORKDIR_CACHE_SIZE = main.getbytes('execution_workdir_cache_size', fallback='0')
+
+# Execution output is written to database by batches
+HISTORY_OUTPUT_BUFFER_SIZE = main.getint('history_output_buffer_size', fallback=500)
+HISTORY_OUTPUT_BUFFER_TIMEOUT = main.getint('history_output_buffer_timeout', fallback=250) / 1000
+# Finished execution output could be stored as compressed chunks
+HISTORY_OUTPUT_COMPRESSION = main.getboolean('history_output_compression', fallback=False)
+HISTORY_OUTPUT_CHUNK_SIZE = main.getbytes('history_output_chunk_size', fallback='64K')
+# Live output stream is closed after this time and client reconnects (0 - no limit)
+HISTORY_STREAM_MAX_DURATION = main.getseconds('history_stream_max_duration', fallback='5:00')
 PROJECT_CI_HANDLER_CLASS = "{}.main.ci.DefaultHandler".format(VST_PROJECT_LIB_NAME)
 
 
@@ -1,10 +1,12 @@
 # pylint: disable=broad-except,no-member,redefined-outer-name
+import json
 import logging
 import traceback
 from django.conf import settings
 from ...wapp import app
 from ..utils import task, BaseTask
 from .exceptions import TaskError
+from ..exceptions import HookDeliveryError
 from ..models.utils import AnsibleModule, AnsiblePlaybook
 
 logger = logging.getLogger("polemarch")
@@ -36,6 +38,35 @@ class RepoTask(BaseTask):
             self.app.retry(exc=error)
 
 
+@task(app, ignore_result=True, bind=True, max_retries=getattr(settings, 'HOOKS_RETRY_COUNT', 3))
+class HookTask(BaseTask):
+    __slots__ = 'hook_id', 'recipient', 'when', 'message'
+
+    def __init__(self, app, hook_id, recipient, when, message, *args, **kwargs):
+        super(HookTask.task_class, self).__init__(app, *args, **kwargs)
+        self.hook_id, self.recipient, self.when, self.message = hook_id, recipient, when, message
+
+    def run(self):
+        from ..models import Hook
+        try:
+            hook = Hook.objects.get(pk=self.hook_id, enable=True)
+        except Hook.DoesNotExist:
+            return
+        try:
+            hook.handlers.deliver(hook, self.recipient, self.when, self.message)
+        except Exception as error:
+            retries = self.app.request.retries
+            if isinstance(error, HookDeliveryError) and retries < self.app.max_retries:
+                delay = getattr(settings, 'HOOKS_RETRY_DELAY', 5)
+                self.app.retry(exc=error, countdown=delay * 2 ** retries)
+            logger.error('Hook [{}] delivery to "{}" failed: {}'.format(hook.id, self.recipient, error))
+            hook.dead_letters.create(
+                recipient=self.recipient, when=self.when,
+                message=json.dumps(self.message, default=str),
+                error=str(error), attempts=retries + 1
+            )
+
+
 @task(app, ignore_result=True, bind=True)
 class ScheduledTask(BaseTask):
     __slots__ = ('job_id',)
@@ -1,6 +1,6 @@
 from __future__ import unicode_literals
 from datetime import timedelta
-from django.test import Client
+from django.test import Client, override_settings
 from django.contrib.auth.hashers import make_password
 from django.utils.timezone import now
 from unittest.mock import patch
@@ -218,6 +218,8 @@ class ApiUsersTestCase(ApiBaseTestCase):
         self.result(client.post, self.get_url('user'), 409, data)
         self._logout(client)
 
+    # Test transaction is never committed, so hooks are sent without collecting.
+    @override_settings(HOOKS_BATCH_SIZE=0)
     def test_api_users_insert_and_delete(self):
         patch_obj_pth = '{}.main.hooks.http.Backend.execute'.format(
             self.settings_obj.VST_PROJECT_LIB_NAME
@@ -11,6 +11,7 @@ from datetime import timedelta
 import git
 import requests
 from django.conf import settings
+from django.test import override_settings
 from django.utils.timezone import now
 from django.core.management import call_command
 from django_celery_beat.models import CrontabSchedule, IntervalSchedule, PeriodicTask
@@ -18,6 +19,7 @@ from yaml import dump, load as from_yaml, Loader
 
 from ._base import BaseTestCase, os
 from ..tasks import ScheduledTask
+from ..utils import HistoryStream
 from ..unittests.ansible import inventory_data, valid_inventory
 
 logger = logging.getLogger('polemarch')
@@ -1202,18 +1204,34 @@ class ProjectTestCase(BaseExecutionsTestCase):
                 )
             ])
             project_data = result[0]['data']
-            correct_add = self.bulk([dict(
-                method='post',
-                path=['project', project_data['id'], 'variables'],
-                data=dict(key='env_test_var', value='TestVar')),
+            correct_add = self.bulk([
+                dict(
+                    method='post',
+                    path=['project', project_data['id'], 'variables'],
+                    data=dict(key='env_test_var', value='TestVar')
+                ),
+                dict(
+                    method='post',
+                    path=['project', project_data['id'], 'variables'],
+                    data=dict(key='workdir_strategy', value='hardlink')
+                ),
             ])
             self.assertEqual(correct_add[0]['status'], 201)
-            error = self.bulk([dict(
-                method='post',
-                path=['project', project_data['id'], 'variables'],
-                data=dict(key='err_key', value='error')),
+            self.assertEqual(correct_add[1]['status'], 201)
+            error = self.bulk([
+                dict(
+                    method='post',
+                    path=['project', project_data['id'], 'variables'],
+                    data=dict(key='err_key', value='error')
+                ),
+                dict(
+                    method='post',
+                    path=['project', project_data['id'], 'variables'],
+                    data=dict(key='workdir_strategy', value='overlay')
+                ),
             ])
             self.assertEqual(error[0]['status'], 400)
+            self.assertEqual(error[1]['status'], 400)
             self.sync_project(project_data['id'])
             self.project_execute(project_data)
 
@@ -1297,9 +1315,25 @@ class ProjectTestCase(BaseExecutionsTestCase):
 
         # Test project
         self.revisions = [first_revision, second_revision]
-        self.project_workflow(
-            'GIT', repository=self.repo_dir, repo_password='', execute=True, playbook_path="not_playbook_dir"
+        workdir_cache = tempfile.mkdtemp()
+        cache_settings = dict(EXECUTION_WORKDIR_CACHE_DIR=workdir_cache, EXECUTION_WORKDIR_CACHE_SIZE=10 ** 9)
+        with self.patch('git.Repo.clone_from', side_effect=git.Repo.clone_from) as clone_from:
+            with override_settings(**cache_settings):
+                self.project_workflow(
+                    'GIT', repository=self.repo_dir, repo_password='', execute=True, playbook_path="not_playbook_dir"
+                )
+        # Execution checkout shares objects with project repo
+        # and is prepared once per revision.
+        prepare_calls = [c for c in clone_from.call_args_list if c[1].get('to_path', '').startswith(workdir_cache)]
+        self.assertTrue(prepare_calls)
+        self.assertEqual(
+            len(prepare_calls),
+            len([n for n in os.listdir(workdir_cache) if not n.startswith('.') and not n.endswith('.build')])
         )
+        for call in prepare_calls:
+            self.assertTrue(call[1]['shared'])
+            self.assertTrue(call[1]['no_checkout'])
+        shutil.rmtree(workdir_cache)
         self.project_workflow(
             'GIT', repository=self.repo_dir, repo_branch='new_branch', repo_key='key', playbook_path="not_playbook_dir"
         )
@@ -1364,7 +1398,7 @@ class ProjectTestCase(BaseExecutionsTestCase):
         response.reason = None
         response.text = "OK"
         ##
-        with self.patch('requests.post') as mock:
+        with self.patch('requests.Session.request') as mock:
             iterations = 2 * len(hook_urls)
             mock.side_effect = [response] * iterations
             subs = self.generate_subs()
@@ -1476,6 +1510,22 @@ class ProjectTestCase(BaseExecutionsTestCase):
         )
         self.assertIn('No route to host',
                       parsed['172.16.1.30']['msg'])
+        # Compressed output should be read transparently
+        lines_url = self.get_url('history', history.id, 'lines') + '?limit=5&after=3'
+        lines = self.get_result('get', lines_url)
+        pages_urls = [
+            self.get_url('history', history.id, 'lines') + query
+            for query in ('?limit=5', '?limit=40&offset=7', '?limit=5&offset=30&before=60', '?line_number=1')
+        ]
+        pages = [self.get_result('get', page_url) for page_url in pages_urls]
+        raw = self.get_result('get', self.get_url('history', history.id, 'raw'))
+        history.compress_output(chunk_size=1024)
+        self.assertEqual(history.raw_history_line.count(), 0)
+        self.assertTrue(history.raw_history_chunk.count() > 1)
+        self.assertEqual(self.get_result('get', url), parsed)
+        self.assertEqual(self.get_result('get', lines_url), lines)
+        self.assertEqual([self.get_result('get', page_url) for page_url in pages_urls], pages)
+        self.assertEqual(self.get_result('get', self.get_url('history', history.id, 'raw')), raw)
         for status in ['RUN', 'DELAY']:
             history.status = status
             history.save()
@@ -1485,6 +1535,114 @@ class ProjectTestCase(BaseExecutionsTestCase):
         history.save()
         self.get_result("get", url, code=404)
 
+    def test_history_tail(self):
+        history = self.get_model_class('History').objects.create(
+            project=None, mode="test.yml", status="RUN", raw_stdout="first\nsecond\n"
+        )
+        url = self.get_url('history', history.id, 'tail')
+        client = self._login()
+
+        response = client.get(url, dict(after_gnumber=1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'second\n')
+        self.assertEqual(response['X-Cursor'], '2')
+        # Tag of other part of output is not matched.
+        response = client.get(url, dict(after_gnumber=2), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        etag = response['ETag']
+        response = client.get(url, dict(after_gnumber=1), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.content, b'second\n')
+        response = client.get(url, HTTP_RANGE='bytes=0-4', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.content, b'first')
+
+        # Polling of unchanged output: user, history and last line lookups
+        with self.assertNumQueries(3):
+            response = client.get(url, dict(after_gnumber=2), HTTP_IF_NONE_MATCH='"other", {}'.format(etag))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(client.get(url, dict(after_gnumber=2), HTTP_IF_NONE_MATCH=etag[:-3] + '"').status_code, 200)
+        history.write_line('third', 3, '\n')
+        response = client.get(url, dict(after_gnumber=2), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'third\n')
+        self.assertEqual(response['X-Cursor'], '3')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(client.get(url, dict(after_gnumber='a')).status_code, 400)
+
+        # Byte offsets
+        response = client.get(url, dict(offset=6))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'second\nthird\n')
+        self.assertEqual(response['X-Cursor'], '19')
+        response = client.get(url, HTTP_RANGE='bytes=13-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b'third\n')
+        self.assertEqual(response['Content-Range'], 'bytes 13-18/19')
+        response = client.get(url, HTTP_RANGE='bytes=0-4')
+        self.assertEqual(response.content, b'first')
+        self.assertEqual(response['X-Cursor'], '5')
+        response = client.get(url, HTTP_RANGE='bytes=-6')
+        self.assertEqual(response.content, b'third\n')
+        response = client.get(url, HTTP_RANGE='bytes=19-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */19')
+        self.assertEqual(client.get(url, HTTP_RANGE='lines=1-').status_code, 200)
+
+    def test_history_stream(self):
+        history = self.get_model_class('History').objects.create(
+            project=None, mode="test.yml", status="RUN", raw_stdout="first\nsecond\n"
+        )
+        stream = HistoryStream(history.id)
+        stream.cache.delete_many([stream.head_key, stream.status_key])
+        client = self._login()
+        response = client.get(self.get_url('history', history.id, 'stream'), dict(after_gnumber=1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = iter(response.streaming_content)
+        self.assertEqual(
+            next(events), b'id: 2\ndata: [{"line_gnumber": 2, "line": "second\\n"}]\n\n'
+        )
+        # New lines are read from stream without database queries
+        stream.publish([(3, 'third\n'), (4, 'fourth\n')])
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                next(events),
+                b'id: 4\ndata: [{"line_gnumber": 3, "line": "third\\n"}, '
+                b'{"line_gnumber": 4, "line": "fourth\\n"}]\n\n'
+            )
+        history.status = 'OK'
+        history.save()
+        stream.finish(history.status)
+        self.assertEqual(list(events), [b':\n\n', b'event: finish\ndata: "OK"\n\n'])
+
+        # Finished history is sent at once
+        response = client.get(self.get_url('history', history.id, 'stream'), HTTP_LAST_EVENT_ID='1')
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            b'id: 2\ndata: [{"line_gnumber": 2, "line": "second\\n"}]\n\n'
+            b'event: finish\ndata: "OK"\n\n'
+        )
+        self.assertEqual(
+            client.get(self.get_url('history', history.id, 'stream'), dict(after_gnumber='a')).status_code, 400
+        )
+
+        # Long lines stored by parts are sent whole like live batches.
+        history.write_line('x' * 3000, 5, '\n')
+        response = client.get(self.get_url('history', history.id, 'stream'), dict(after_gnumber=4))
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            b'id: 5\ndata: [{"line_gnumber": 5, "line": "' + b'x' * 3000 + b'\\n"}]\n\n'
+            b'event: finish\ndata: "OK"\n\n'
+        )
+
+        # Stream of working history is closed after max duration and client reconnects.
+        history.status = 'RUN'
+        history.save()
+        stream.cache.delete(stream.status_key)
+        with self.settings(HISTORY_STREAM_MAX_DURATION=0.01):
+            response = client.get(self.get_url('history', history.id, 'stream'), dict(after_gnumber=4))
+            self.assertEqual(list(response.streaming_content)[-1], b'retry: 1000\n\n')
+
     def test_import_inventory(self):
         results = self.bulk([
             dict(method='post', path=['project'], data=dict(name='testProj')),
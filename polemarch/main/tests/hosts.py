@@ -1,5 +1,6 @@
 import logging
 from subprocess import check_output
+from django.test import override_settings
 from ._base import BaseTestCase, json
 
 logger = logging.getLogger('polemarch')
@@ -123,6 +124,8 @@ class InvBaseTestCase(BaseTestCase):
 
 class InventoriesTestCase(InvBaseTestCase):
 
+    # Test transaction is never committed, so hooks are sent without collecting.
+    @override_settings(HOOKS_BATCH_SIZE=0)
     def test_hosts(self):
 
         self._check_with_vars(
@@ -1,7 +1,9 @@
 from .ansible import AnsibleTestCase
-from .utils import TemplateCreateTestCase
+from .utils import (
+    TemplateCreateTestCase, WorkdirStrategyTestCase, WorkdirCacheTestCase, RedactorTestCase, ProjectSyncLockTestCase
+)
 from .api import UsersTestCase
 from .hooks import HooksTestCase
-from .tasks import TasksTestCase, TestTaskError, TestRepoTask
+from .tasks import TasksTestCase, TestTaskError, TestRepoTask, OutputBufferTestCase, HistoryCompressionTestCase
 from .models import ModelsTestCase
 from .migrations import TestDirectMigration
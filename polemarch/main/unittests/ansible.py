@@ -1,7 +1,11 @@
 import io
+import os
+from unittest.mock import patch
 from django.test import TestCase
 from django.core.management import call_command
-from ..utils import AnsibleInventoryParser
+from vstutils.utils import tmp_file_context
+from yaml import load
+from ..utils import AnsibleInventoryParser, AnsibleArgumentsReference, AnsibleConfigParser, PMAnsibleWorker
 
 inventory_data = '''
 test-host-single ansible_host=10.10.10.10
@@ -114,3 +118,71 @@ class AnsibleTestCase(TestCase):
         )
         for key, value in valid_inventory['vars'].items():
             self.assertEqual(inv_json['vars'][key], value)
+
+    def test_inventory_parser_worker(self):
+        PMAnsibleWorker.stop()
+        data = inventory_data + '\n[worker-group]\nworker-host\n'
+        with patch.object(PMAnsibleWorker, 'execute', wraps=PMAnsibleWorker.execute) as execute:
+            inv_json = AnsibleInventoryParser().get_inventory_data(data)
+            self.assertEqual(execute.call_count, 1)
+            self.assertIn('worker-group', [g['name'] for g in inv_json['groups']])
+            self.assertIsNotNone(PMAnsibleWorker.info)
+            worker_pid = PMAnsibleWorker.info['pid']
+            # Same content is not parsed twice.
+            self.assertEqual(AnsibleInventoryParser().get_inventory_data(data), inv_json)
+            self.assertEqual(execute.call_count, 1)
+            # Other content is parsed by the same worker.
+            AnsibleInventoryParser().get_inventory_data(inventory_data + '\n[other-group]\n')
+            self.assertEqual(execute.call_count, 2)
+            self.assertEqual(PMAnsibleWorker.info['pid'], worker_pid)
+        # Worker restarts after failure.
+        PMAnsibleWorker._process.kill()
+        PMAnsibleWorker._process.wait()
+        inv_json = AnsibleInventoryParser().get_inventory_data(inventory_data + '\n[restart-group]\n')
+        self.assertIn('restart-group', [g['name'] for g in inv_json['groups']])
+        self.assertNotEqual(PMAnsibleWorker.info['pid'], worker_pid)
+
+    def test_ansible_worker_lookups(self):
+        PMAnsibleWorker.stop()
+        reference = AnsibleArgumentsReference()
+        reference.clear_cache()
+        with patch.object(PMAnsibleWorker, 'execute', wraps=PMAnsibleWorker.execute) as execute:
+            reference = AnsibleArgumentsReference()
+            self.assertEqual(reference.version, PMAnsibleWorker.info['version'])
+            self.assertIn('playbook', reference.raw_dict)
+            with tmp_file_context(suffix='.cfg') as cfg:
+                config_dir = os.path.dirname(cfg.name)
+                parser = AnsibleConfigParser(config_dir)
+                parser.clear_cache()
+                self.assertIn('DEFAULT_FORKS', parser.get_data())
+                self.assertEqual(execute.call_args[0][1], config_dir)
+            self.assertEqual(execute.call_count, 2)
+        # Worker is restarted after ansible upgrade.
+        worker_pid = PMAnsibleWorker.info['pid']
+        PMAnsibleWorker.info['release_mtime'] -= 1
+        parser.clear_cache()
+        parser.get_data()
+        self.assertNotEqual(PMAnsibleWorker.info['pid'], worker_pid)
+
+    def test_arguments_reference_memo(self):
+        reference = AnsibleArgumentsReference()
+        ref = reference.get_ref(cache=True)
+        reference.raw_dict['module']['module-name'] = {'type': 'string'}
+        self.assertNotIn('module-name', AnsibleArgumentsReference().raw_dict['module'])
+
+        # Whole reference is not loaded again, only small version values are deserialized.
+        with patch('polemarch.main.utils.load', wraps=load) as yaml_load:
+            with patch.object(AnsibleArgumentsReference, 'get_data', wraps=reference.get_data) as get_data:
+                for _ in range(1000):
+                    AnsibleArgumentsReference().validate_args('playbook', {'forks': 1})
+            self.assertEqual(get_data.call_count, 0)
+            self.assertEqual(yaml_load.call_count, 1000)
+            self.assertTrue(all(len(c[0][0]) < 64 for c in yaml_load.call_args_list))
+
+        # Memo is invalidated by clear_cache and by version changes in cache.
+        reference.clear_cache()
+        self.assertNotIn(ref, AnsibleArgumentsReference._memo)
+        self.assertEqual(AnsibleArgumentsReference().version, reference.version)
+        reference.get_version_cache().set('other')
+        self.assertEqual(AnsibleArgumentsReference().version, reference.version)
+        self.assertEqual(reference.get_version_cache().get(), reference.version)
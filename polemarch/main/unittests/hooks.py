@@ -1,15 +1,57 @@
 import os
 import json
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
 try:
     from mock import patch
 except ImportError:  # nocv
     from unittest.mock import patch
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.db import transaction, connection
 from django.conf import settings
 from django.core.validators import ValidationError
 from requests import Response
 from vstutils.utils import raise_context
 from ..models import Hook
+from ..models.hooks import HookCollector
+from ..hooks.http import Backend as HttpBackend
+from ..hooks.script import ScriptRunnerPool
+
+
+class HookStubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super(HookStubServer, self).__init__(('127.0.0.1', 0), HookStubHandler)
+        self.requests = []
+        self.statuses = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/hook'.format(self.server_port)
+
+
+class HookStubHandler(BaseHTTPRequestHandler):
+    # Local HTTP stub for hooks with keep-alive connections.
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        if self.headers['Content-Type'] == 'application/json':
+            body = json.loads(body)
+        else:
+            body = parse_qs(body)
+        self.server.requests.append((self.client_address, body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
 
 
 class HooksTestCase(TestCase):
@@ -64,6 +106,12 @@ class HooksTestCase(TestCase):
             self.assertEqual(hook.run(message=dict(test="test")), "Err\nErr")
             self.assertEqual(cmd.call_count, 4)
 
+        # Sessions are shared only by hooks with the same pool size.
+        self.assertIs(HttpBackend.get_session(2), HttpBackend.get_session(2))
+        self.assertIsNot(HttpBackend.get_session(2), HttpBackend.get_session())
+        self.assertEqual(HttpBackend.get_session(2).get_adapter('http://test.lan')._pool_maxsize, 2)
+        HttpBackend.get_session(2).close()
+
     def check_output_run_http(self, method, url, data, **kwargs):
         # pylint: disable=protected-access, unused-argument
         self.assertEqual(method, "post")
@@ -83,7 +131,7 @@ class HooksTestCase(TestCase):
         hook = Hook.objects.create(
             type='HTTP', recipients=" | ".join(self.recipients)
         )
-        with patch('requests.api.request') as cmd:
+        with patch('requests.Session.request') as cmd:
             self.count = 0
             cmd.side_effect = self.check_output_run_http
             result = hook.run(message=dict(test="test"))
@@ -95,3 +143,181 @@ class HooksTestCase(TestCase):
             cmd.side_effect = self.check_output_error
             self.assertEqual(hook.run(message=dict(test="test")), "Err\nErr")
             self.assertEqual(cmd.call_count, 4)
+
+        # Sessions are shared only by hooks with the same pool size.
+        self.assertIs(HttpBackend.get_session(2), HttpBackend.get_session(2))
+        self.assertIsNot(HttpBackend.get_session(2), HttpBackend.get_session())
+        self.assertEqual(HttpBackend.get_session(2).get_adapter('http://test.lan')._pool_maxsize, 2)
+        HttpBackend.get_session(2).close()
+
+    def test_http_delivery(self):
+        server = HookStubServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            hook = Hook.objects.create(type='HTTP', recipients=server.url, when='on_object_add')
+            with override_settings(HOOKS_RETRY_DELAY=0):
+                # Failed deliveries are retried through the same keep-alive connection.
+                server.statuses = [500, 503]
+                Hook.objects.all().execute('on_object_add', dict(test='test'))
+                self.assertEqual(len(server.requests), 3)
+                self.assertEqual(len(set(r[0] for r in server.requests)), 1)
+                self.assertEqual(server.requests[-1][1]['type'], ['on_object_add'])
+                self.assertFalse(hook.dead_letters.exists())
+
+                Hook.objects.all().execute('on_object_del', dict(test='test'))
+                self.assertEqual(len(server.requests), 3)
+
+                # Undelivered messages are saved as dead letters.
+                server.statuses = [500] * 4
+                Hook.objects.all().execute('on_object_add', dict(test='dead'))
+                self.assertEqual(len(server.requests), 7)
+                letter = hook.dead_letters.get()
+                self.assertEqual(letter.attempts, 4)
+                self.assertEqual(letter.recipient, server.url)
+                self.assertEqual(json.loads(letter.message), dict(test='dead'))
+                self.assertTrue(letter.error.startswith('500 '))
+                letter.resend()
+                self.assertEqual(len(server.requests), 8)
+                self.assertFalse(hook.dead_letters.exists())
+        finally:
+            HttpBackend.get_session().close()
+            server.shutdown()
+            server.server_close()
+
+    def test_batching(self):
+        # pylint: disable=protected-access
+        server = HookStubServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            Hook.objects.create(type='HTTP', recipients=server.url, when='on_object_upd')
+            Hook.objects.create(type='HTTP', recipients=server.url, when='on_object_del')
+            with override_settings(HOOKS_BATCH_SIZE=2):
+                with transaction.atomic():
+                    for i in (1, 2, 1, 3, 2):
+                        Hook.objects.all().collect('on_object_upd', dict(id=i))
+                    Hook.objects.all().collect('on_object_del', dict(id=1))
+                    callbacks = [func for _, func in connection.run_on_commit if isinstance(func, HookCollector)]
+                    self.assertEqual(len(callbacks), 1)
+                    self.assertEqual(len(server.requests), 0)
+                # Emulate commit, because test transaction is never committed.
+                callbacks[0]()
+                payloads = [r[1] for r in server.requests]
+                self.assertEqual(len(payloads), 3)
+                self.assertEqual(payloads[0], dict(type='on_object_upd', payload=[dict(id=1), dict(id=2)]))
+                self.assertEqual(payloads[1]['payload'], ['id'])
+                self.assertEqual(payloads[2]['type'], ['on_object_del'])
+
+                # Messages of different transactions wait for linger time or full batch.
+                with override_settings(HOOKS_BATCH_LINGER=60):
+                    collectors = [HookCollector(), HookCollector()]
+                    for i, collector in enumerate(collectors, 4):
+                        collector.add('on_object_upd', dict(id=i))
+                    collectors[0]()
+                    self.assertIsNotNone(HookCollector._timer)
+                    self.assertEqual(len(server.requests), 3)
+                    collectors[1]()
+                    self.assertIsNone(HookCollector._timer)
+                    self.assertEqual(len(server.requests), 4)
+                    self.assertEqual(server.requests[-1][1]['payload'], [dict(id=4), dict(id=5)])
+        finally:
+            HttpBackend.get_session().close()
+            server.shutdown()
+            server.server_close()
+
+    @override_settings(HOOKS_BATCH_SIZE=2)
+    def test_collector_rollback(self):
+        # Collector of rolled back transaction is replaced by new one.
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Hook.objects.all().collect('on_object_upd', dict(id=1))
+                dropped = connection.hook_collector[0]
+                Hook.objects.all().collect('on_object_upd', dict(id=2))
+                self.assertIs(connection.hook_collector[0], dropped)
+                raise ValueError
+        with transaction.atomic():
+            Hook.objects.all().collect('on_object_upd', dict(id=3))
+        collector = connection.hook_collector[0]
+        self.assertIsNot(collector, dropped)
+        self.assertEqual(list(collector.messages.values()), [dict(id=3)])
+        self.assertEqual([func for _, func in connection.run_on_commit if isinstance(func, HookCollector)], [collector])
+
+    def test_script_batch(self):
+        hook = Hook.objects.create(type='SCRIPT', recipients='test.sh', when='on_object_add')
+        with patch('subprocess.check_output') as cmd, override_settings(HOOKS_BATCH_SIZE=10):
+            Hook.objects.all().execute_batches(dict(on_object_add=[dict(id=1), dict(id=2)]))
+            self.assertEqual(cmd.call_count, 1)
+            self.assertEqual(json.loads(cmd.call_args[1]['input']), [dict(id=1), dict(id=2)])
+        self.assertFalse(hook.dead_letters.exists())
+
+    def test_routes(self):
+        # Routes of hooks from rolled back transactions of other tests are dropped.
+        Hook.update_routes_version()
+        Hook.objects.all().routes('on_object_add')
+        with self.assertNumQueries(0):
+            Hook.objects.all().execute('on_object_add', dict(test='test'))
+        hook = Hook.objects.create(type='HTTP', recipients='http://test.lan', when='on_object_upd')
+        any_hook = Hook.objects.create(type='HTTP', recipients='http://test.lan')
+        with self.assertNumQueries(1):
+            self.assertEqual(Hook.objects.all().routes('on_object_upd'), [hook, any_hook])
+        with self.assertNumQueries(0):
+            self.assertEqual(Hook.objects.all().routes('on_object_add'), [any_hook])
+        any_hook.enable = False
+        any_hook.save()
+        self.assertEqual(Hook.objects.all().routes('on_object_upd', 'on_object_add'), [hook])
+        hook.delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(Hook.objects.all().routes('on_object_upd'), [])
+        self.assertEqual(Hook.objects.filter(enable=False).routes('on_object_add'), [])
+
+    def test_persistent_script(self):
+        script = '{}/runner.sh'.format(settings.HOOKS_DIR)
+        with open(script, 'w') as file:
+            file.write(
+                '#!/bin/sh\n'
+                'while read line; do\n'
+                '  id=$(echo "$line" | sed \'s/^{"id": \\([0-9]*\\),.*/\\1/\')\n'
+                '  case "$line" in\n'
+                '    *fail*) echo "{\\"id\\": $id, \\"error\\": \\"failed\\"}";;\n'
+                '    *extra*) echo "extra"; echo "{\\"id\\": 0}";\n'
+                '      echo "{\\"id\\": $id, \\"pid\\": $$}"; echo "extra";;\n'
+                '    *) echo "{\\"id\\": $id, \\"pid\\": $$, \\"event\\": $line}";;\n'
+                '  esac\n'
+                'done\n'
+            )
+        os.chmod(script, 0o755)
+        self.scripts.append(script)
+        sleeper = '{}/sleeper.sh'.format(settings.HOOKS_DIR)
+        with open(sleeper, 'w') as file:
+            file.write('#!/bin/sh\nexec sleep 30\n')
+        os.chmod(sleeper, 0o755)
+        self.scripts.append(sleeper)
+        hook = Hook.objects.create(type='SCRIPT', recipients='runner.sh')
+        try:
+            with override_settings(HOOKS_PERSISTENT_SCRIPTS=['runner.sh', 'sleeper.sh'], HOOKS_TIMEOUT=1):
+                reply = json.loads(hook.run(message=dict(test='test')))
+                pid = reply['pid']
+                self.assertEqual(reply['event'], dict(id=1, when='on_execution', payload=dict(test='test')))
+                # Script is started once for all events.
+                self.assertEqual(json.loads(hook.run('on_object_add', message=1))['pid'], pid)
+                self.assertEqual(hook.run(message='fail'), 'failed')
+                # Extra lines of output and replies to other events are skipped.
+                self.assertEqual(json.loads(hook.run(message='extra')), dict(id=4, pid=pid))
+                self.assertEqual(json.loads(hook.run(message=2)), dict(id=5, pid=pid, event=dict(
+                    id=5, when='on_execution', payload=2
+                )))
+                # Exited script is restarted.
+                pool = ScriptRunnerPool.get(script, settings.HOOKS_DIR, 1)
+                pool.idle[0].process.kill()
+                pool.idle[0].process.wait()
+                self.assertNotEqual(json.loads(hook.run(message=3))['pid'], pid)
+                self.assertEqual(len(pool.idle), 1)
+                # Script, which doesn't read events, is restarted after write timeout.
+                sleeper_hook = Hook.objects.create(type='SCRIPT', recipients='sleeper.sh')
+                self.assertIn('timed out after 1 seconds', sleeper_hook.run(message='x' * 1024 * 1024))
+                self.assertFalse(ScriptRunnerPool.get(sleeper, settings.HOOKS_DIR, 1).idle[0].alive)
+                # Events wait for free process only for timeout.
+                pool.semaphore.acquire()
+                self.assertEqual(hook.run(message=4), 'All processes of {} are busy.'.format(script))
+                pool.semaphore.release()
+        finally:
+            ScriptRunnerPool.stop_all()
@@ -1,4 +1,14 @@
+import os
+import tempfile
+import git
+from unittest.mock import ANY, patch
+from yaml import load as from_yaml, Loader
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.contrib.contenttypes.models import ContentType
+from django.test.utils import CaptureQueriesContext
 from ..tests._base import BaseTestCase
+from ..exceptions import Conflict
 
 
 class ModelsTestCase(BaseTestCase):
@@ -11,3 +21,379 @@ class ModelsTestCase(BaseTestCase):
         self.assertEqual(class_handler.model, ObjClass)
         self.assertEqual(object_handler.instance, obj)
         self.assertEqual(object_handler.model, ObjClass)
+
+    def test_inventory_render_placeholders(self):
+        # Text of placeholders in other values is not replaced by secrets.
+        Host, Inventory = map(self.get_model_class, ('Host', 'Inventory'))
+        inventory = Inventory.objects.create(name='placeholders-test')
+        hosts = [Host.objects.create(name='h{}'.format(i)) for i in range(3)]
+        hosts[0].vars = dict(ansible_ssh_pass='topsecret')
+        hosts[1].vars = dict(ansible_user='__POLEMARCH_SECRET_0__')
+        hosts[2].vars = dict(ansible_user='__POLEMARCH_SECRET_7__')
+        inventory.hosts.add(*hosts)
+        for _ in range(2):
+            data, _ = inventory.get_inventory()
+            self.assertEqual(from_yaml(data, Loader=Loader), {'all': {'hosts': {
+                'h0': {'ansible_ssh_pass': 'topsecret'},
+                'h1': {'ansible_user': '__POLEMARCH_SECRET_0__'},
+                'h2': {'ansible_user': '__POLEMARCH_SECRET_7__'},
+            }}})
+
+    def test_inventory_render_cache(self):
+        Host, Group, Inventory = map(self.get_model_class, ('Host', 'Group', 'Inventory'))
+        inventory = Inventory.objects.create(name='render-test')
+        inventory.vars = dict(ansible_user='root', ansible_become_pass='s3cret: "yes"')
+        other_inventory = Inventory.objects.create(name='render-test-other')
+        other_version = other_inventory.get_content_version()
+        hosts = [Host.objects.create(name='host-{}'.format(i)) for i in range(3)]
+        hosts[0].vars = dict(ansible_host='10.0.0.1', ansible_ssh_private_key_file='KEY')
+        parent = Group.objects.create(name='parent', children=True)
+        child = Group.objects.create(name='child')
+        child.vars = dict(ansible_port='22')
+        child.hosts.set(hosts[1:])
+        parent.groups.add(child)
+        inventory.hosts.add(hosts[0])
+        inventory.groups.add(parent, child)
+
+        data, keys = inventory.get_inventory()
+        self.assertEqual(len(keys), 1)
+        with open(keys[0].name) as key_file:
+            self.assertEqual(key_file.read(), 'KEY')
+        child_data = {'hosts': {'host-1': None, 'host-2': None}, 'vars': {'ansible_port': '22'}}
+        self.assertEqual(from_yaml(data, Loader=Loader), {'all': {
+            'hosts': {'host-0': {'ansible_host': '10.0.0.1', 'ansible_ssh_private_key_file': keys[0].name}},
+            'children': {'parent': {'children': {'child': child_data}}, 'child': child_data},
+            'vars': {'ansible_user': 'root', 'ansible_become_pass': 's3cret: "yes"'},
+        }})
+
+        # Rendered inventory is cached until any inventory item changes,
+        # but secrets are not stored in cache.
+        cached = Inventory.get_render_cache().get(
+            Inventory.render_cache_key.format(inventory.id, inventory.get_content_version())
+        )
+        self.assertNotIn('KEY', str(cached))
+        self.assertNotIn('s3cret', str(cached))
+        with self.assertNumQueries(1):
+            cached_data, cached_keys = inventory.get_inventory()
+        self.assertNotEqual(cached_keys[0].name, keys[0].name)
+        self.assertEqual(cached_data, data.replace(keys[0].name, cached_keys[0].name))
+        hosts[2].vars = dict(ansible_host='10.0.0.3')
+        data, _ = inventory.get_inventory()
+        self.assertIn('ansible_host: 10.0.0.3', data)
+        child.hosts.remove(hosts[2])
+        data, _ = inventory.get_inventory()
+        self.assertNotIn('host-2', data)
+        hosts[2].delete()
+        parent.vars = dict(ansible_port='2222')
+        data, _ = inventory.get_inventory()
+        self.assertIn("ansible_port: '2222'", data)
+        parent.delete()
+        data, _ = inventory.get_inventory()
+        self.assertNotIn('parent', data)
+
+        # Changes of other inventories items do not invalidate inventory.
+        self.assertEqual(other_inventory.get_content_version(), other_version)
+
+    def test_subgroups_resolving(self):
+        Group = self.get_model_class('Group')
+        root = Group.objects.create(name='root', children=True)
+        level = [root]
+        tree = [root]
+        for depth in range(4):
+            next_level = []
+            for parent in level:
+                for number in range(2):
+                    group = Group.objects.create(name='g-{}-{}-{}'.format(parent.id, depth, number), children=True)
+                    parent.groups.add(group)
+                    next_level.append(group)
+            tree += next_level
+            level = next_level
+        leaf = level[-1]
+        qs = Group.objects.filter(id=root.id)
+        with self.assertNumQueries(1):
+            self.assertCountEqual(list(qs.get_subgroups_id()), [g.id for g in tree])
+        self.assertCountEqual(qs._get_subgroups_id_by_levels(), [g.id for g in tree])
+        parents = Group.objects.filter(id=leaf.id).get_parents()
+        self.assertEqual(parents.count(), 5)
+        self.assertCountEqual(
+            Group.objects.filter(id=leaf.id)._get_subgroups_id_by_levels(tp='childrens'),
+            parents.values_list('id', flat=True)
+        )
+        with self.assertRaises(Group.CiclicDependencyError):
+            leaf.groups.add(root)
+
+    def _import_inventory(self, data, **kwargs):
+        Inventory = self.get_model_class('Inventory')
+        with patch.object(Inventory, 'parse_inventory_from_str', return_value=data):
+            with self.patch('polemarch.main.models.send_polemarch_models') as send_hook:
+                with CaptureQueriesContext(connection) as queries:
+                    inventory = Inventory.import_inventory_from_string(name='imported', raw_data='', **kwargs)
+        # Only creation of inventory and aggregated import events
+        send_hook.assert_called_with('on_object_upd', inventory, import_stats=ANY)
+        self.assertEqual(send_hook.call_count, 1 if 'inventory_instance' in kwargs else 2)
+        return inventory, send_hook.call_args[1]['import_stats'], len(queries)
+
+    def _get_import_data(self, hosts_count):
+        hosts = [dict(name='host-{}'.format(i), vars=dict(ansible_port=i)) for i in range(hosts_count)]
+        return dict(
+            vars=dict(ansible_user='root', ansible_ssh_pass='[~~ENCRYPTED~~]'),
+            hosts=hosts,
+            groups=[
+                dict(name='parent', groups=['child'], hosts=[], vars=dict()),
+                dict(name='child', groups=[], hosts=[h['name'] for h in hosts[1:]], vars=dict(ansible_become=True)),
+            ]
+        )
+
+    def test_inventory_bulk_import(self):
+        data = self._get_import_data(10)
+        inventory, stats, small_queries = self._import_inventory(data)
+        self.assertEqual(stats['hosts_created'], 10)
+        self.assertEqual(stats['groups_created'], 2)
+        self.assertEqual(stats['variables_created'], 12)
+        self.assertEqual(inventory.vars, {'ansible_user': 'root'})
+        self.assertEqual(inventory.hosts.get(name='host-3').vars, {'ansible_port': '3'})
+        parent = inventory.groups.get(name='parent')
+        self.assertEqual(list(parent.groups.values_list('name', flat=True)), ['child'])
+        child = parent.groups.get()
+        self.assertEqual(child.hosts.count(), 9)
+        self.assertEqual(child.vars, {'ansible_become': 'True'})
+
+        # Items with the same names of other imports are not attached
+        other, _, _ = self._import_inventory(self._get_import_data(10))
+        self.assertFalse(other.hosts.filter(id__in=inventory.hosts.values('id')).exists())
+        self.assertEqual(other.hosts.count(), 10)
+        self.assertCountEqual(set(other.hosts.values_list('notes', flat=True)), [''])
+
+        # Re-import applies only difference
+        inventory.vars = dict(ansible_user='admin', ansible_ssh_pass='secret')
+        data['vars']['ansible_user'] = 'user'
+        data['hosts'].pop()
+        data['hosts'][0]['vars'] = dict(ansible_host='10.0.0.1')
+        data['groups'][1]['hosts'] = ['host-0']
+        host_id = inventory.hosts.get(name='host-0').id
+        inventory, stats, _ = self._import_inventory(data, inventory_instance=inventory)
+        self.assertEqual(stats, dict(
+            hosts_created=0, hosts_deleted=1, groups_created=0, groups_deleted=0,
+            variables_created=1, variables_updated=1, variables_deleted=1,
+        ))
+        self.assertEqual(inventory.vars, {'ansible_ssh_pass': 'secret', 'ansible_user': 'user'})
+        self.assertEqual(inventory.hosts.get(name='host-0').id, host_id)
+        self.assertEqual(inventory.hosts.get(name='host-0').vars, {'ansible_host': '10.0.0.1'})
+        self.assertEqual(list(child.hosts.values_list('name', flat=True)), ['host-0'])
+
+        # Count of queries doesn't depend on inventory size except batches of bulk inserts
+        _, _, big_queries = self._import_inventory(self._get_import_data(200))
+        self.assertLessEqual(big_queries, small_queries + 3)
+
+        # Data is validated before any changes
+        data['hosts'][0]['vars']['ansible_host'] = 'invalid host'
+        data['groups'].append(dict(name='invalid group', groups=[], hosts=[], vars={}))
+        with self.assertRaises(ValidationError) as err:
+            self._import_inventory(data, inventory_instance=inventory)
+        self.assertCountEqual(err.exception.message_dict.keys(), ['host-0', 'invalid group'])
+        data['hosts'][0]['vars']['ansible_host'] = '10.0.0.1'
+        data['groups'] = [dict(name='loop', groups=['loop'], hosts=[], vars={})]
+        with self.assertRaises(self.get_model_class('Group').CiclicDependencyError):
+            self._import_inventory(data, inventory_instance=inventory)
+
+    def test_set_vars(self):
+        Host, Project, Variable = map(self.get_model_class, ('Host', 'Project', 'Variable'))
+        host = Host.objects.create(name='vars-host')
+        ContentType.objects.get_for_model(Host)
+        variables = dict(ansible_host='10.0.0.1', **{'var_{}'.format(i): str(i) for i in range(39)})
+        with patch('polemarch.main.models.send_polemarch_models') as hook:
+            # Savepoint, select of existing variables, bulk insert, lookup
+            # of related inventories by groups and hosts and savepoint release.
+            with self.assertNumQueries(6):
+                host.vars = variables
+            hook.assert_called_once_with('on_object_upd', host)
+            self.assertEqual(host.vars, variables)
+            old_ids = dict(host.variables.values_list('key', 'id'))
+
+            # Only difference is written.
+            hidden = Variable.objects.create(content_object=host, key='var_40', value='hidden', hidden=True)
+            hook.reset_mock()
+            variables = dict(variables, var_0='changed', var_40='new', ansible_host='[~~ENCRYPTED~~]')
+            del variables['var_2']
+            with self.assertNumQueries(9):
+                host.vars = variables
+            self.assertEqual(hook.call_count, 1)
+            self.assertEqual(host.vars, dict(variables, ansible_host='10.0.0.1'))
+            new_ids = dict(host.variables.values_list('key', 'id'))
+            self.assertEqual(new_ids['var_0'], old_ids['var_0'])
+            self.assertEqual(new_ids['var_3'], old_ids['var_3'])
+            self.assertFalse(Variable.objects.filter(pk=hidden.pk).exists())
+
+            # Select of variables and savepoint of transaction.
+            with self.assertNumQueries(3):
+                host.vars = variables
+            self.assertEqual(hook.call_count, 1)
+
+        # Changed variables are validated before write.
+        with self.assertRaises(ValidationError):
+            host.vars = dict(variables, ansible_host='invalid host')
+        self.assertEqual(host.vars['ansible_host'], '10.0.0.1')
+        project = Project.objects.create(name='vars-project', repository='git://test.lan')
+        project.vars = dict(repo_sync_on_run=True)
+        with self.assertRaises(Conflict):
+            project.vars = dict(repo_sync_on_run=True, ci_template='1')
+        with self.assertRaises(ValidationError):
+            project.vars = dict(unknown_key='1')
+        self.assertEqual(project.vars, dict(repo_sync_on_run=True))
+
+    def test_prefetched_vars(self):
+        Host, Project = map(self.get_model_class, ('Host', 'Project'))
+        host = Host.objects.create(name='prefetch-host')
+        host.vars = dict(zvar='1', ansible_zzz='2', ansible_user='root', avar='3', ansible_host='10.0.0.1')
+        host.variables.create(key='hidden_var', value='4', hidden=True)
+        expected = list(host.vars.items())
+        host = Host.objects.prefetch_related('variables').get(pk=host.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(list(host.vars.items()), expected)
+        host.vars = dict(avar='5')
+        self.assertEqual(host.vars, dict(avar='5'))
+
+        # Project list doesn't query variables of every project.
+        client = self._login()
+        counts = []
+        for count in (3, 6):
+            for i in range(Project.objects.count(), count):
+                Project.objects.create(name='prefetch-{}'.format(i), repository='git://test.lan').vars = dict(
+                    repo_type='GIT'
+                )
+            with CaptureQueriesContext(connection) as queries:
+                results = self.result(client.get, self.get_url('project'))['results']
+            counts.append(len(queries))
+            self.assertEqual([project['type'] for project in results], ['GIT'] * count)
+        self.assertEqual(counts[0], counts[1])
+        self._logout(client)
+
+    def test_playbooks_index(self):
+        Project = self.get_model_class('Project')
+        project = Project.objects.create(name='index-project', repository='MANUAL')
+        repo_class = project.repo_class.__class__
+        with tempfile.TemporaryDirectory() as projects_dir, self.settings(PROJECTS_DIR=projects_dir):
+            project.clone()
+            for name in ('first.yml', 'second.yml'):
+                with open(os.path.join(project.path, name), 'w') as playbook:
+                    playbook.write('---\n')
+            project.sync()
+            old_ids = dict(project.playbook.values_list('playbook', 'id'))
+            self.assertEqual(set(old_ids), {'bootstrap.yml', 'first.yml', 'second.yml'})
+
+            # Only added and removed playbooks are written.
+            os.remove(os.path.join(project.path, 'first.yml'))
+            with open(os.path.join(project.path, 'third.yml'), 'w') as playbook:
+                playbook.write('---\n')
+            project.sync()
+            new_ids = dict(project.playbook.values_list('playbook', 'id'))
+            self.assertEqual(set(new_ids), {'bootstrap.yml', 'second.yml', 'third.yml'})
+            self.assertEqual(new_ids['second.yml'], old_ids['second.yml'])
+            self.assertEqual(new_ids['bootstrap.yml'], old_ids['bootstrap.yml'])
+
+            # Playbooks of the same revision are not searched again.
+            with patch.object(repo_class, '_get_sync_revision', return_value='rev'), \
+                    patch.object(repo_class, '_set_tasks_list') as set_tasks:
+                callbacks_count = len(connection.run_on_commit)
+                project.sync()
+                # Emulate commit, because test transaction is never committed.
+                for _, callback in connection.run_on_commit[callbacks_count:]:
+                    callback()
+                project.sync()
+                self.assertEqual(set_tasks.call_count, 1)
+                project.vars = dict(playbook_path='roles')
+                project.sync()
+                self.assertEqual(set_tasks.call_count, 2)
+
+    def test_files_index(self):
+        from ..repo._base import FilesIndex
+        index = FilesIndex(['main.yml', 'main.yml', 'README.md', 'pb/site.yml', 'pb/nested/deploy.yml', 'sm1/x.yml'])
+        self.assertEqual(len(index), 5)
+        search = lambda pattern: [str(path) for path in index.search(pattern)]
+        self.assertEqual(search('*.yml'), ['main.yml'])
+        self.assertEqual(search('pb/*.yml'), ['pb/site.yml'])
+        self.assertEqual(search('pb//*.yml'), ['pb/site.yml'])
+        self.assertEqual(search('./pb/*.yml'), ['pb/site.yml'])
+        self.assertEqual(search('./*.yml'), ['main.yml'])
+        self.assertEqual(search('pb/nested/*.yml'), ['pb/nested/deploy.yml'])
+        self.assertEqual(search('*/*.yml'), ['pb/site.yml', 'sm1/x.yml'])
+        self.assertEqual(search('**/*.yml'), ['main.yml', 'pb/nested/deploy.yml', 'pb/site.yml', 'sm1/x.yml'])
+        self.assertEqual(search('[!m]*.??'), ['README.md'])
+
+    def test_git_files_index(self):
+        from ..repo.vcs import Git
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = {name: os.path.join(tmp, name) for name in ('sub', 'main', 'clone')}
+            for name in ('sub', 'main'):
+                repo = git.Repo.init(paths[name])
+                with open(os.path.join(paths[name], name + '.yml'), 'w') as playbook:
+                    playbook.write('---\n')
+                repo.index.add([name + '.yml'])
+                repo.index.commit('init')
+            repo.git.submodule('add', paths['sub'], 'sm')
+            repo.index.commit('add submodule')
+            project = self.get_model_class('Project')(name='files-project', repository=paths['main'])
+            self.assertCountEqual(Git(project)._get_files(repo), ['.gitmodules', 'main.yml', 'sm', 'sm/sub.yml'])
+            # Not initialized submodules are skipped.
+            clone = git.Repo.clone_from(paths['main'], paths['clone'])
+            self.assertCountEqual(Git(project)._get_files(clone), ['.gitmodules', 'main.yml', 'sm'])
+
+    def test_modules_index(self):
+        from ..tests.executions import test_module_content
+        Project = self.get_model_class('Project')
+        project = Project.objects.create(name='modules-project', repository='MANUAL')
+        with tempfile.TemporaryDirectory() as projects_dir, self.settings(PROJECTS_DIR=projects_dir):
+            project.clone()
+            with open(os.path.join(project.path, 'ansible.cfg'), 'w') as config:
+                config.write('[defaults]\nlibrary = lib\n')
+            os.mkdir(os.path.join(project.path, 'lib'))
+            with open(os.path.join(project.path, 'lib', 'first_module.py'), 'w') as module:
+                module.write(test_module_content)
+            callbacks_count = len(connection.run_on_commit)
+            project.sync()
+            # Emulate commit, because test transaction is never committed.
+            for _, callback in connection.run_on_commit[callbacks_count:]:
+                callback()
+            old_ids = dict(project.modules.values_list('path', 'id'))
+            self.assertEqual(list(old_ids), ['polemarch.project.first_module'])
+
+            # Unchanged module directories are not scanned.
+            with patch('polemarch.main.repo._base.AnsibleModules') as modules:
+                project.sync()
+                modules.assert_not_called()
+
+            # Only added modules are written.
+            with open(os.path.join(project.path, 'lib', 'second_module.py'), 'w') as module:
+                module.write(test_module_content)
+            project.sync()
+            new_ids = dict(project.modules.values_list('path', 'id'))
+            self.assertEqual(set(new_ids), {'polemarch.project.first_module', 'polemarch.project.second_module'})
+            self.assertEqual(new_ids['polemarch.project.first_module'], old_ids['polemarch.project.first_module'])
+
+    def test_unchanged_revision(self):
+        Project = self.get_model_class('Project')
+        project = Project.objects.create(name='revision-project', repository='MANUAL')
+        repo_class = project.repo_class.__class__
+        with tempfile.TemporaryDirectory() as projects_dir, self.settings(PROJECTS_DIR=projects_dir):
+            project.clone()
+            with patch.object(repo_class, '_get_sync_revision', return_value='rev'), \
+                    patch.object(repo_class, '_handle_yaml') as handle_yaml, \
+                    patch.object(repo_class.handler_class, 'get_ci_call_object') as ci_call:
+                callbacks_count = len(connection.run_on_commit)
+                project.sync()
+                # Emulate commit, because test transaction is never committed.
+                for _, callback in connection.run_on_commit[callbacks_count:]:
+                    callback()
+                self.assertEqual((handle_yaml.call_count, ci_call.call_count), (1, 1))
+
+                # Files of the same revision are not processed and CI is not triggered.
+                repo = project.repo_class
+                repo.get()
+                self.assertTrue(repo.unchanged)
+                self.assertEqual((handle_yaml.call_count, ci_call.call_count), (1, 1))
+                self.assertEqual(project.playbook.count(), 1)
+
+            repo = project.repo_class
+            repo.get()
+            self.assertFalse(repo.unchanged)
+            self.assertEqual(project.playbook.count(), 1)
@@ -1,9 +1,14 @@
+import io
+from unittest.mock import patch
+from django.core.management import call_command
 from django.core.validators import ValidationError
+from django.db.models import Q
 from django.test import TestCase
 from ..tasks.exceptions import TaskError
 from ..tasks import RepoTask
 from ..exceptions import PMException
-from ..models import History
+from ..models import History, HistoryChunk
+from ..models.utils import OutputBuffer, Executor
 
 
 class TasksTestCase(TestCase):
@@ -37,3 +42,92 @@ class TestRepoTask(TestCase):
         project = "TestProject"
         with self.assertRaises(RepoTask.task_class.UnknownRepoOperation):
             RepoTask(app, project, "error")
+
+
+class OutputBufferTestCase(TestCase):
+
+    def test_output_buffer(self):
+        history = History.objects.create(mode='test.yml', status='RUN')
+        output_buffer = OutputBuffer(history, size=3, timeout=60)
+        with self.assertNumQueries(0):
+            output_buffer.append('first', 1)
+            output_buffer.append('second', 2)
+        self.assertEqual(len(output_buffer), 2)
+        with self.assertNumQueries(1):
+            output_buffer.append('third', 3)
+        self.assertEqual(len(output_buffer), 0)
+        self.assertEqual(history.raw_stdout, 'first\nsecond\nthird\n')
+
+        output_buffer.append('fourth', 4)
+        output_buffer.timeout = 0
+        self.assertTrue(output_buffer.expired)
+        output_buffer.append('fifth', 5)
+        self.assertEqual(len(output_buffer), 0)
+        with self.assertNumQueries(0):
+            output_buffer.flush()
+        self.assertEqual(history.raw_stdout, 'first\nsecond\nthird\nfourth\nfifth\n')
+
+    def test_interrupted_execution(self):
+        history = History.objects.create(mode='test.yml', status='RUN')
+        executor = Executor(history)
+        executor.exchanger.send(True)
+        with self.assertRaises(Executor.CalledProcessError):
+            executor.execute(['sh', '-c', 'while true; do echo line; sleep 0.01; done'], '/tmp')
+        lines = list(history.raw_history_line.exclude(line='\n').values_list('line_gnumber', 'line'))
+        # Message of process handler is numbered by executing thread together with output.
+        self.assertEqual(sorted(number for number, _ in lines), list(range(1, len(lines) + 1)))
+        self.assertIn('\n[ERROR]: User interrupted execution', [line for _, line in lines])
+
+
+class HistoryCompressionTestCase(TestCase):
+
+    def test_output_benchmark(self):
+        out = io.StringIO()
+        call_command('benchmark_history_output', '--lines=50', stdout=out)
+        self.assertRegex(out.getvalue(), r'unbuffered: 100 lines in .*lines/s\.\nbuffered: 100 lines in ')
+        self.assertFalse(History.objects.filter(mode='benchmark').exists())
+
+    def test_compress_output(self):
+        history = History.objects.create(mode='test.yml', status='OK')
+        history.write_lines((('line {}'.format(i), i, '\n') for i in range(1, 101)))
+        history.write_line('x' * 3000, 101)
+        stdout = history.raw_stdout
+
+        out = io.StringIO()
+        call_command('compress_history', '--chunk-size=256', interactive=False, stdout=out)
+        self.assertIn('1 histories have been successfully compressed.', out.getvalue())
+        history.refresh_from_db()
+        self.assertTrue(history.compressed_output)
+        self.assertEqual(history.raw_history_line.count(), 0)
+        self.assertTrue(history.raw_history_chunk.count() > 1)
+        self.assertEqual(history.raw_stdout, stdout)
+        self.assertEqual(
+            history.get_raw(filters=(Q(line__contains='line 1'),), excludes=(Q(line_gnumber__gt=11),)),
+            'line 1line 10line 11'
+        )
+        self.assertEqual(
+            [line.line for line in history.get_lines(after=98, before=100)], ['line 99', '\n']
+        )
+        # Page of lines unpacks only chunks of the page.
+        lines = history.get_lines()
+        lines.reverse()
+        reversed_lines = history.get_reversed_lines(after=5)
+        self.assertEqual(len(reversed_lines), len([line for line in lines if line.line_gnumber > 5]))
+        with patch.object(HistoryChunk, 'lines', autospec=True, side_effect=HistoryChunk.lines) as unpack:
+            page = reversed_lines[40:45]
+        self.assertGreater(history.raw_history_chunk.count(), 2)
+        self.assertLessEqual(unpack.call_count, 2)
+        as_tuples = lambda page_lines: [(line.line_gnumber, line.line_number, line.line) for line in page_lines]
+        self.assertEqual(as_tuples(page), as_tuples([line for line in lines if line.line_gnumber > 5][40:45]))
+
+        # Lines written after compression are kept separately until next compression
+        history.write_line('last', 102)
+        self.assertEqual(history.raw_stdout, stdout + 'last')
+        history.compress_output()
+        self.assertEqual(history.raw_history_line.count(), 0)
+        self.assertEqual(history.raw_stdout, stdout + 'last')
+
+        del history.raw_stdout
+        self.assertFalse(history.compressed_output)
+        self.assertEqual(history.raw_history_chunk.count(), 0)
+        self.assertEqual(history.raw_stdout, '')
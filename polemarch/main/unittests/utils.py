@@ -1,7 +1,21 @@
 from __future__ import unicode_literals
+import io
+import os
+import re
+import time
+import errno
+import shutil
+import tempfile
+import threading
+from contextlib import suppress
+from unittest.mock import patch
+from django.test import TestCase
+from django.core.management import call_command
 from ..tests._base import BaseTestCase
 from django.core.validators import ValidationError
 from ..exceptions import UnknownTypeException
+from ..models import Project
+from ..utils import copy_tree, HardlinkCopier, WorkdirCache, Redactor, ProjectSyncLock, trie_regex
 
 
 class TemplateCreateTestCase(BaseTestCase):
@@ -19,3 +33,228 @@ class TemplateCreateTestCase(BaseTestCase):
                 project=test_proj,
                 kind='Task'
             )
+
+
+class WorkdirStrategyTestCase(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'src')
+        for i in range(20):
+            path = os.path.join(self.src, 'roles', 'role{}'.format(i), 'files')
+            os.makedirs(path)
+            for j in range(10):
+                with open(os.path.join(path, 'file{}'.format(j)), 'wb') as fd:
+                    fd.write(os.urandom(64 * 1024))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_benchmark(self):
+        out = io.StringIO()
+        call_command('benchmark_workdir_strategy', '--files=20', '--size=1024', '--dir', self.tmp, stdout=out)
+        self.assertRegex(out.getvalue(), r'copy: 20 files .*\nhardlink: 20 files .*\nreflink: 20 files ')
+        self.assertEqual(os.listdir(self.tmp), ['src'])
+
+    def test_strategies(self):
+        test_file = os.path.join('roles', 'role0', 'files', 'file0')
+        with open(os.path.join(self.src, test_file), 'rb') as fd:
+            data = fd.read()
+        src_stat = os.stat(os.path.join(self.src, test_file))
+        for strategy in ('copy', 'hardlink', 'reflink'):
+            dst = copy_tree(self.src, os.path.join(self.tmp, strategy), strategy)
+            with open(os.path.join(dst, test_file), 'rb') as fd:
+                self.assertEqual(fd.read(), data)
+            dst_stat = os.stat(os.path.join(dst, test_file))
+            self.assertEqual(dst_stat.st_ino == src_stat.st_ino, strategy == 'hardlink')
+            self.assertEqual(dst_stat.st_nlink, 2 if strategy == 'hardlink' else 1)
+            # New files stay in workdir only.
+            with open(os.path.join(dst, 'roles', 'role0', 'files', 'new'), 'w') as fd:
+                fd.write(strategy)
+            self.assertFalse(os.path.exists(os.path.join(self.src, 'roles', 'role0', 'files', 'new')))
+
+        # Linking to other filesystem falls back to copy after first failure.
+        copier = HardlinkCopier()
+        with patch('os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')) as link:
+            shutil.copytree(self.src, os.path.join(self.tmp, 'other_fs'), copy_function=copier)
+        self.assertEqual(link.call_count, 1)
+        self.assertFalse(copier.supported)
+        self.assertNotEqual(os.stat(os.path.join(self.tmp, 'other_fs', test_file)).st_ino, src_stat.st_ino)
+
+        # Unknown strategy (i.e. typo in settings) falls back to copy.
+        dst = copy_tree(self.src, os.path.join(self.tmp, 'unknown'), 'unknown')
+        self.assertNotEqual(os.stat(os.path.join(dst, test_file)).st_ino, src_stat.st_ino)
+
+
+class WorkdirCacheTestCase(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.prepared = []
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _prepare(self, path):
+        self.prepared.append(path)
+        os.makedirs(path)
+        with open(os.path.join(path, 'main.yml'), 'wb') as fd:
+            fd.write(b'0' * 1000)
+
+    def _acquire(self, key):
+        cache = WorkdirCache(key, path=self.path, max_size=2500)
+        return cache, cache.acquire(self._prepare)
+
+    def test_workdir_cache(self):
+        first, first_tree = self._acquire('1-rev1')
+        second, second_tree = self._acquire('1-rev1')
+        # Same revision is prepared once and shared.
+        self.assertEqual(len(self.prepared), 1)
+        self.assertEqual(first_tree, second_tree)
+        self.assertTrue(os.path.isfile(os.path.join(first_tree, 'main.yml')))
+        self.assertNotIn(self.prepared[0], first_tree)
+        first.release()
+        second.release()
+
+        third, _ = self._acquire('1-rev2')
+        # Budget is exceeded, but entries are referenced or fit.
+        fourth, _ = self._acquire('1-rev3')
+        self.assertEqual(len(self.prepared), 3)
+        self.assertFalse(os.path.exists(first.entry))
+        self.assertTrue(os.path.exists(third.entry))
+        self.assertTrue(os.path.exists(fourth.entry))
+        # Referenced entries are kept over budget.
+        fifth, _ = self._acquire('1-rev4')
+        self.assertTrue(os.path.exists(third.entry))
+        self.assertTrue(os.path.exists(fourth.entry))
+        for cache in (third, fourth, fifth):
+            cache.release()
+        # Least recently used entry is evicted first.
+        sixth, _ = self._acquire('1-rev5')
+        sixth.release()
+        self.assertFalse(os.path.exists(third.entry))
+        self.assertFalse(os.path.exists(fourth.entry))
+        self.assertTrue(os.path.exists(fifth.entry))
+        self.assertTrue(os.path.exists(sixth.entry))
+
+        # Failed preparation leaves nothing in cache.
+        with self.assertRaises(ValueError):
+            WorkdirCache('1-rev6', path=self.path).acquire(lambda path: int('error'))
+        self.assertEqual(sorted(n for n in os.listdir(self.path) if not n.endswith('.build')), [
+            '.lock', '1-rev4', '1-rev5'
+        ])
+
+
+class RedactorTestCase(TestCase):
+    def test_trie_regex(self):
+        words = ['pass', 'password', 'passwd', 'secret', 'a.b', 'x' * 5000]
+        regex = re.compile(trie_regex(words))
+        self.assertEqual(regex.findall('password passwd pass secre a.b axb'), ['password', 'passwd', 'pass', 'a.b'])
+        self.assertEqual(regex.findall('x' * 5001), ['x' * 5000])
+
+    def test_redact(self):
+        keys = ['ansible_ssh_pass', 'ansible_become_pass']
+        inventory = (
+            'all:\n'
+            '  hosts:\n'
+            '    localhost:\n'
+            '      ansible_ssh_pass: "s3cr3t-value"\n'
+            '      ansible_become_pass: other-secret\n'
+            '      ansible_user: root\n'
+        )
+        redactor = Redactor.from_text(keys, inventory)
+        self.assertEqual(redactor(inventory), (
+            'all:\n'
+            '  hosts:\n'
+            '    localhost:\n'
+            '      ansible_ssh_pass: [~~ENCRYPTED~~]\n'
+            '      ansible_become_pass: [~~ENCRYPTED~~]\n'
+            '      ansible_user: root\n'
+        ))
+        # Secret values are masked in output without keys too.
+        self.assertEqual(
+            redactor('ok: [localhost] => {"msg": "s3cr3t-value other-secret"}'),
+            'ok: [localhost] => {"msg": "[~~ENCRYPTED~~] [~~ENCRYPTED~~]"}'
+        )
+        self.assertEqual(redactor('"ansible_ssh_pass": "x"\n'), '"ansible_ssh_pass": [~~ENCRYPTED~~]\n')
+        # Values at the end of text, in json and quoted with spaces are masked too.
+        self.assertEqual(redactor('ansible_ssh_pass: s3cret'), 'ansible_ssh_pass: [~~ENCRYPTED~~]')
+        self.assertEqual(
+            redactor('{"ansible_ssh_pass": "x", "ansible_become_pass": "a \\" b"}'),
+            '{"ansible_ssh_pass": [~~ENCRYPTED~~], "ansible_become_pass": [~~ENCRYPTED~~]}'
+        )
+        redactor = Redactor.from_text(keys, 'ansible_ssh_pass: "with space \\"q\\""')
+        self.assertEqual(redactor('echo with space "q"'), 'echo [~~ENCRYPTED~~]')
+        self.assertEqual(redactor('ansible_user: root'), 'ansible_user: root')
+        # Short values are not masked to keep output readable.
+        self.assertEqual(Redactor(values=['ab', 'abcd'])('ab abcd'), 'ab [~~ENCRYPTED~~]')
+        self.assertEqual(Redactor()('text'), 'text')
+
+
+class ProjectSyncLockTestCase(TestCase):
+    def run_threads(self, count, func, **kwargs):
+        results, barrier = [], threading.Barrier(count)
+
+        def target():
+            barrier.wait()
+            with suppress(Exception):
+                results.append(ProjectSyncLock('test').execute(func, 5, **kwargs))
+
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalescing(self):
+        calls, running, events = [], [], []
+
+        def sync():
+            running.append(1)
+            events.append('start')
+            self.assertEqual(len(running), 1)
+            calls.append(1)
+            time.sleep(0.3)
+            events.append('end')
+            running.pop()
+            return 'synced'
+
+        # Concurrent syncs wait for the first one.
+        self.assertEqual(sorted(self.run_threads(10, sync), key=str), [None] * 9 + ['synced'])
+        self.assertEqual(len(calls), 1)
+
+        # Explicit syncs are not coalesced, but not run together.
+        events.clear()
+        self.assertEqual(self.run_threads(3, sync, coalesce=False), ['synced'] * 3)
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(events, ['start', 'end'] * 3)
+
+        # Waiters sync by themselves after failed sync.
+        def failed_sync():
+            if not calls:
+                time.sleep(0.2)
+                calls.append(1)
+                raise Exception('Failed sync.')
+            return sync()
+
+        calls.clear()
+        self.assertEqual(self.run_threads(3, failed_sync), ['synced', None])
+        self.assertEqual(len(calls), 2)
+
+    def test_timeout(self):
+        lock = ProjectSyncLock('test')
+        self.assertTrue(lock.send('other'))
+        try:
+            with self.assertRaises(ProjectSyncLock.Busy):
+                ProjectSyncLock('test').execute(lambda: None, 0.2)
+        finally:
+            lock.release(False)
+        self.assertEqual(ProjectSyncLock('test').execute(lambda: 'synced', 0.2), 'synced')
+
+    def test_explicit_sync_timeout(self):
+        # Explicit sync and clone wait for other sync as long as lock could be held.
+        project = Project(id=1, repository='MANUAL')
+        with patch.object(ProjectSyncLock, 'execute') as execute:
+            project.sync()
+            project.clone()
+        self.assertEqual([c[0][1] for c in execute.call_args_list], [ProjectSyncLock.TIMEOUT] * 2)
+        self.assertTrue(all(c[1] == dict(coalesce=False) for c in execute.call_args_list))
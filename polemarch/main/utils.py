@@ -7,6 +7,20 @@ import sys
 import re
 import os
 import json
+import time
+import errno
+import fcntl
+import shutil
+import select
+import uuid
+import hashlib
+import tempfile
+import threading
+from typing import Any, Callable, Iterable
+from functools import lru_cache
+from itertools import groupby
+from operator import attrgetter
+from contextlib import contextmanager, suppress
 from os.path import dirname
 
 try:
@@ -18,6 +32,7 @@ from vstutils.utils import (
     ON_POSIX,
     tmp_file_context,
     BaseVstObject,
+    KVExchanger,
     Executor,
     UnhandledExecutor,
     subprocess
@@ -39,6 +54,81 @@ def project_path():
     return dirname(dirname(file))  # nocv
 
 
+class FileCopier:
+    """
+    Copy function for `shutil.copytree` with regular copy of files.
+    """
+    __slots__ = ()
+
+    def __call__(self, src: str, dst: str) -> str:
+        return shutil.copy2(src, dst)
+
+
+class CloningCopier(FileCopier):
+    """
+    Copy function, which tries cheaper way to get the file by `clone()`
+    of subclass and falls back to regular copy after first failure,
+    when filesystem doesn't support it.
+    """
+    # pylint: disable=no-member
+    __slots__ = ('supported',)
+    unsupported_errors = (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS)
+
+    def __init__(self):
+        self.supported = True
+
+    def __call__(self, src: str, dst: str) -> str:
+        if self.supported:
+            try:
+                self.clone(src, dst)
+                return dst
+            except OSError as err:
+                if err.errno not in self.unsupported_errors:
+                    raise  # nocv
+                self.supported = False
+        return super(CloningCopier, self).__call__(src, dst)
+
+
+class HardlinkCopier(CloningCopier):
+    __slots__ = ()
+
+    def clone(self, src: str, dst: str):
+        os.link(src, dst)
+
+
+class ReflinkCopier(CloningCopier):
+    __slots__ = ()
+    # ioctl request for cloning file extents on copy-on-write filesystems (btrfs, xfs)
+    FICLONE = 0x40049409
+
+    def clone(self, src: str, dst: str):  # nocv
+        with open(src, 'rb') as src_fd, open(dst, 'wb') as dst_fd:
+            fcntl.ioctl(dst_fd.fileno(), self.FICLONE, src_fd.fileno())
+        shutil.copystat(src, dst)
+
+
+WORKDIR_STRATEGIES = {
+    'copy': FileCopier,
+    'hardlink': HardlinkCopier,
+    'reflink': ReflinkCopier,
+}
+
+
+def copy_tree(src: str, dst: str, strategy: str = 'copy') -> str:
+    """
+    Copy directory tree with one of `WORKDIR_STRATEGIES`.
+    Directories are always created, so new files stay in destination only.
+
+    :param src: source directory.
+    :param dst: destination directory (must not exist).
+    :param strategy: `copy`, `hardlink` or `reflink`. Unknown strategy falls back to `copy`.
+    """
+    if strategy not in WORKDIR_STRATEGIES:
+        logger.warning('Unknown workdir strategy "{}", files will be copied.'.format(strategy))
+        strategy = 'copy'
+    return shutil.copytree(src, dst, copy_function=WORKDIR_STRATEGIES[strategy]())
+
+
 class PMObject(BaseVstObject):
 
     def pm_ansible(self, *args):
@@ -57,6 +147,376 @@ class CmdExecutor(Executor, PMObject):
     __slots__ = ()
 
 
+def get_tree_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with suppress(OSError):
+                size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+class WorkdirCache(PMObject):
+    """
+    Revision-keyed cache of prepared project trees shared by executions on one host.
+    Every user of entry holds shared `flock` on it, so entry is referenced while any
+    lock exists (locks are released by OS even if process was killed).
+    Unreferenced entries are evicted by least recent usage, when total size
+    of cache exceeds disk budget.
+    """
+    __slots__ = ('path', 'max_size', 'key', '_lock_fd')
+    lock_name = '.lock'
+    size_name = 'size'
+
+    def __init__(self, key: str, path: str = None, max_size: int = None):
+        self.path = path or self.get_django_settings('EXECUTION_WORKDIR_CACHE_DIR') or os.path.join(
+            self.get_django_settings('PROJECTS_DIR'), '.workdir_cache'
+        )
+        self.max_size = self.get_django_settings('EXECUTION_WORKDIR_CACHE_SIZE', 0) if max_size is None else max_size
+        self.key = key
+        self._lock_fd = None
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return cls.get_django_settings('EXECUTION_WORKDIR_CACHE_SIZE', 0) > 0
+
+    @property
+    def entry(self) -> str:
+        return os.path.join(self.path, self.key)
+
+    @property
+    def tree(self) -> str:
+        return os.path.join(self.entry, 'tree')
+
+    @contextmanager
+    def _locked(self, name: str):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, name), 'a') as lock_fd:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            yield
+
+    def _use(self) -> bool:
+        # Must be called under cache lock, so there is no concurrent eviction.
+        if self._lock_fd is not None:
+            return True  # nocv
+        if not os.path.exists(os.path.join(self.entry, self.size_name)):
+            return False
+        self._lock_fd = open(os.path.join(self.entry, self.lock_name), 'a')
+        fcntl.flock(self._lock_fd, fcntl.LOCK_SH)
+        os.utime(self.entry)
+        return True
+
+    def acquire(self, prepare: Callable[[str], Any]) -> str:
+        """
+        Get path of prepared tree and reference it until `release`.
+
+        :param prepare: function which prepares tree by passed path, called only
+                        when there is no tree in cache. Concurrent calls with same key
+                        wait for the one which prepares tree.
+        """
+        with self._locked(self.lock_name):
+            if self._use():
+                return self.tree
+        with self._locked('{}.build'.format(self.key)):
+            with self._locked(self.lock_name):
+                if self._use():
+                    return self.tree  # nocv
+            tmp_entry = tempfile.mkdtemp(dir=self.path, prefix='.{}-'.format(self.key))
+            try:
+                prepare(os.path.join(tmp_entry, 'tree'))
+                open(os.path.join(tmp_entry, self.lock_name), 'a').close()
+                with open(os.path.join(tmp_entry, self.size_name), 'w') as size_fd:
+                    size_fd.write(str(get_tree_size(tmp_entry)))
+                with self._locked(self.lock_name):
+                    if not self._use():
+                        shutil.rmtree(self.entry, ignore_errors=True)
+                        os.rename(tmp_entry, self.entry)
+                        self._use()
+                    self.evict()
+            finally:
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+        return self.tree
+
+    def release(self) -> None:
+        if self._lock_fd is not None:
+            with suppress(OSError):
+                os.utime(self.entry)
+            self._lock_fd.close()
+            self._lock_fd = None
+
+    def evict(self) -> None:
+        """
+        Remove least recently used and unreferenced entries while
+        cache exceeds budget. Must be called under cache lock.
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            size_file = os.path.join(self.path, name, self.size_name)
+            if name.startswith('.') or not os.path.isfile(size_file):
+                continue
+            with open(size_file, 'r') as size_fd:
+                entries.append((os.stat(os.path.join(self.path, name)).st_mtime, name, int(size_fd.read())))
+        total_size = sum(entry[2] for entry in entries)
+        for _, name, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            entry = os.path.join(self.path, name)
+            with open(os.path.join(entry, self.lock_name), 'a') as lock_fd:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                os.remove(os.path.join(entry, self.size_name))
+                shutil.rmtree(entry, ignore_errors=True)
+            with suppress(OSError):
+                os.remove('{}.build'.format(entry))
+            total_size -= size
+
+
+class HistoryStream(KVExchanger):
+    """
+    Live stream of execution output relayed through cache.
+    Executor publishes flushed batches of lines with sequence numbers
+    and every viewer reads them from cache without database queries.
+    """
+    TIMEOUT = 600
+    POLL_INTERVAL = 0.5
+    IDLE_TIMEOUT = 60
+
+    def __init__(self, history_id, timeout=None):
+        super(HistoryStream, self).__init__('history_stream_{}'.format(history_id), timeout)
+        self.seq = None
+
+    @property
+    def head_key(self):
+        return self.key + '_head'
+
+    @property
+    def status_key(self):
+        return self.key + '_status'
+
+    def get_batch_key(self, seq):
+        return '{}_{}'.format(self.key, seq)
+
+    def publish(self, lines):
+        # Only one producer (executor) is allowed for history
+        # pylint: disable=no-member
+        if self.seq is None:
+            self.seq = self.cache.get(self.head_key, 0)
+        self.seq += 1
+        self.cache.set(self.get_batch_key(self.seq), lines, self.timeout)
+        self.cache.set(self.head_key, self.seq, self.timeout)
+
+    def finish(self, status):
+        # pylint: disable=no-member
+        self.cache.set(self.status_key, status, self.timeout)
+
+    def _get_from_db(self, history, after):
+        # Long lines are stored by parts, but stream sends whole lines.
+        return [
+            (gnumber, ''.join(line.line for line in parts))
+            for gnumber, parts in groupby(history.get_lines(after=after), attrgetter('line_gnumber'))
+        ]
+
+    def follow(self, history, after=0, max_duration=None):
+        """
+        Generator of output batches `[(gnumber, line), ...]` after `after` gnumber.
+        Empty batch is yielded when there is no new output.
+        Generator stops when execution is finished or after `max_duration` seconds.
+        """
+        # pylint: disable=no-member
+        seq = self.cache.get(self.head_key, 0)
+        finished = not history.working
+        idle_since = started = time.monotonic()
+        batch = self._get_from_db(history, after)
+        while True:
+            if batch:
+                after = batch[-1][0]
+                idle_since = time.monotonic()
+            if finished:
+                yield batch + self._get_from_db(history, after)
+                return
+            yield batch
+            if max_duration is not None and time.monotonic() - started >= max_duration:
+                return
+            if not batch:
+                time.sleep(self.POLL_INTERVAL)
+            state = self.cache.get_many([self.head_key, self.status_key])
+            head, finished = state.get(self.head_key, 0), self.status_key in state
+            batch = []
+            if head > seq:
+                keys = [self.get_batch_key(n) for n in range(seq + 1, head + 1)]
+                batches = self.cache.get_many(keys)
+                if len(batches) < len(keys):
+                    batch = self._get_from_db(history, after)  # nocv
+                else:
+                    batch = [line for key in keys for line in batches[key] if line[0] > after]
+                seq = head
+            if not finished and time.monotonic() - idle_since >= self.IDLE_TIMEOUT:
+                # Executor could be killed without finishing stream
+                history.refresh_from_db(fields=['status'])
+                finished = not history.working
+                idle_since = time.monotonic()
+
+
+class ProjectSyncLock(KVExchanger):
+    """
+    Lock of project sync stored in cache. Waiters are woken up by notification
+    when lock is released: threads of current process by condition and other
+    processes by token of finished sync, which is polled in cache with backoff.
+    """
+    TIMEOUT = 3600
+    POLL_INTERVAL = 0.05
+    MAX_POLL_INTERVAL = 1
+    _conditions = {}
+    _conditions_lock = threading.Lock()
+
+    class Busy(Exception):
+        pass
+
+    def __init__(self, project_id, timeout=None):
+        super(ProjectSyncLock, self).__init__('project_sync_{}'.format(project_id), timeout)
+        with self._conditions_lock:
+            self.condition = self._conditions.setdefault(self.key, threading.Condition())
+
+    @property
+    def done_key(self):
+        return self.key + '_done'
+
+    @property
+    def done(self):
+        # pylint: disable=no-member
+        return self.cache.get(self.done_key)
+
+    @property
+    def locked(self) -> bool:
+        # pylint: disable=no-member
+        return self.cache.get(self.key) is not None
+
+    def release(self, success: bool):
+        # pylint: disable=no-member
+        if success:
+            self.cache.set(self.done_key, uuid.uuid4().hex, self.timeout)
+        self.delete()
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait(self, done, timeout: float) -> bool:
+        """
+        Waits release of lock. Returns `True` if sync was finished by holder.
+        """
+        deadline = time.monotonic() + timeout
+        interval = self.POLL_INTERVAL
+        while self.locked:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            with self.condition:
+                self.condition.wait(min(interval, remaining))
+            interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+        return self.done != done
+
+    def execute(self, func: Callable, timeout: float, coalesce: bool = True) -> Any:
+        """
+        Calls `func` under lock. When lock is held by other sync, waits for it
+        and with `coalesce` returns `None` without call if that sync was successful.
+        """
+        deadline = time.monotonic() + timeout
+        done = self.done
+        while not self.send(os.getpid()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise self.Busy('Project busy (timeout={}).'.format(timeout))
+            if self.wait(done, remaining) and coalesce:
+                return None
+        success = False
+        try:
+            result = func()
+            success = True
+            return result
+        finally:
+            self.release(success)
+
+
+def trie_regex(words: Iterable[str]) -> str:
+    """
+    Regex for literal words built by prefix tree, so regex engine checks
+    every position of text by one path of tree instead of every word.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node) -> str:
+        prefix = ''
+        # Chains without branches are written as literals without recursion.
+        while len(node) == 1 and '' not in node:
+            char, node = next(iter(node.items()))
+            prefix += re.escape(char)
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return prefix
+        pattern = branches[0] if len(branches) == 1 else '(?:{})'.format('|'.join(branches))
+        return prefix + ('(?:{})?'.format(pattern) if '' in node else pattern)
+
+    return build(trie)
+
+
+class Redactor(PMObject):
+    """
+    Masks secrets in text with precompiled regexes: values of hidden keys
+    written as `key: value` and known secret values anywhere in text.
+    Keys and values are matched by separate regexes, because regex engine
+    can scan text fast only for patterns with known first characters.
+    """
+    __slots__ = ('passes',)
+    mask = '[~~ENCRYPTED~~]'
+    min_value_length = 4
+    # Quoted value (i.e. in json) or value up to whitespace or end of text.
+    value_regex = r'(?:"(?:[^"\\\n]|\\.)*"|\'[^\'\n]*\'|\S+)'
+
+    def __init__(self, keys: Iterable[str] = (), values: Iterable[str] = ()):
+        self.passes = self.compile(
+            tuple(sorted(set(keys))),
+            tuple(sorted(set(v for v in values if len(v) >= self.min_value_length)))
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def compile(keys: tuple, values: tuple) -> tuple:
+        passes = []
+        if keys:
+            regex = r'((?:{})["\']?:\s){}'.format(trie_regex(keys), Redactor.value_regex)
+            passes.append((re.compile(regex), r'\1' + Redactor.mask))
+        if values:
+            passes.append((re.compile(trie_regex(values)), Redactor.mask))
+        return tuple(passes)
+
+    @classmethod
+    def from_text(cls, keys: Iterable[str], text: str) -> 'Redactor':
+        # Values of hidden keys are masked everywhere, i.e. in ansible output.
+        keys = tuple(keys)
+        values = []
+        if keys:
+            regex = re.compile(r'(?:{})["\']?:\s({})'.format(trie_regex(keys), cls.value_regex))
+            for value in regex.findall(text):
+                values += [value, value.strip('\'"')]
+                if value.startswith('"'):
+                    try:
+                        values.append(json.loads(value))
+                    except ValueError:  # nocv
+                        pass
+        return cls(keys, values)
+
+    def __call__(self, text: str) -> str:
+        for regex, template in self.passes:
+            text = regex.sub(template, text)
+        return text
+
+
 class task(object):
     """ Decorator for Celery task classes
 
@@ -156,12 +616,99 @@ class AnsibleCache(SubCacheInterface):
     cache_name = "ansible"
 
 
+class PMAnsibleWorker(PMObject):
+    """
+    Client of long-lived `pm_ansible` worker (see `ansible_worker.py`).
+    Worker imports ansible once and serves commands one by one,
+    so there is no interpreter start-up cost on every call.
+    Worker is started lazily once per process and restarted after fork, failure
+    or ansible upgrade (detected by modification of ansible release file).
+    """
+    __slots__ = ()
+    script = os.path.join(dirname(file), 'ansible_worker.py')
+    timeout = 300
+    info = None
+    _lock = threading.Lock()
+    _process = None
+    _pid = None
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        executor = cls.get_django_settings('EXECUTOR')
+        return bool(
+            cls.get_django_settings('ANSIBLE_WORKER', False) and
+            len(executor) == 3 and executor[1:] == ['-m', 'pm_ansible']
+        )
+
+    @classmethod
+    def _read(cls, process: subprocess.Popen):
+        if not select.select([process.stdout], [], [], cls.timeout)[0]:
+            raise subprocess.TimeoutExpired(process.args, cls.timeout)
+        line = process.stdout.readline()
+        if not line:
+            raise EOFError('Ansible worker exited with code {}.'.format(process.poll()))
+        return json.loads(line)
+
+    @classmethod
+    def _start(cls):
+        process = subprocess.Popen(
+            [cls.get_django_settings('EXECUTOR')[0], cls.script],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, bufsize=1, close_fds=ON_POSIX,
+            env=os.environ.copy()
+        )
+        cls._process, cls._pid = process, os.getpid()
+        try:
+            cls.info = cls._read(process)
+            cls.info['release_mtime'] = os.stat(cls.info['release']).st_mtime
+        except BaseException:
+            cls.stop()
+            raise
+
+    @classmethod
+    def is_outdated(cls) -> bool:
+        try:
+            return os.stat(cls.info['release']).st_mtime != cls.info['release_mtime']
+        except OSError:  # nocv
+            return True
+
+    @classmethod
+    def stop(cls):
+        process, cls._process, cls.info = cls._process, None, None
+        if process is not None and cls._pid == os.getpid():
+            process.kill()
+            process.wait()
+
+    @classmethod
+    def execute(cls, args: list, cwd: str) -> str:
+        if cls._pid != os.getpid():
+            # Process was forked, so worker and lock belong to parent.
+            cls._lock, cls._process, cls.info = threading.Lock(), None, None
+        with cls._lock:
+            if cls._process is not None and (cls._process.poll() is not None or cls.is_outdated()):
+                cls.stop()
+            if cls._process is None:
+                cls._start()
+            try:
+                cls._process.stdin.write(json.dumps(dict(args=args, cwd=cwd)) + '\n')
+                cls._process.stdin.flush()
+                response = cls._read(cls._process)
+            except BaseException:
+                cls.stop()
+                raise
+        if response['error']:
+            raise subprocess.CalledProcessError(1, args, response['output'], response['error'])
+        return response['output']
+
+
 class PMAnsible(PMObject):
     __slots__ = ('execute_path', 'cache',)
     # Json regex
     _regex = re.compile(r"([\{\[\"]{1}.*[\}\]\"]{1})", re.MULTILINE | re.DOTALL)
     ref_name = 'object'
     cache_timeout = 86400*7
+    # Commands which could be served by long-lived worker
+    use_worker = False
 
     class ExecutorClass(UnhandledExecutor):
         def execute(self, cmd: list, cwd: str):
@@ -197,14 +744,23 @@ class PMAnsible(PMObject):
     def get_args(self):
         return self.pm_ansible(self.get_ref())
 
+    def execute(self) -> str:
+        cmd_command = self.get_args()
+        if self.use_worker and PMAnsibleWorker.is_enabled():
+            try:
+                return PMAnsibleWorker.execute(cmd_command[len(self.pm_ansible()):], self.execute_path)
+            except subprocess.CalledProcessError:
+                raise
+            except Exception:  # nocv
+                logger.warning('Ansible worker failed, fallback to subprocess call.', exc_info=True)
+        cmd = self.ExecutorClass(stderr=UnhandledExecutor.DEVNULL)
+        return cmd.execute(cmd_command, self.execute_path)
+
     def get_data(self):
         cache = self.get_ansible_cache()
         result = cache.get()
         if result is None:
-            cmd = self.ExecutorClass(stderr=UnhandledExecutor.DEVNULL)
-            cmd_command = self.get_args()
-            cmd.execute(cmd_command, self.execute_path)
-            result = self._get_only_json(cmd.output)
+            result = self._get_only_json(self.execute())
             cache.set(result)
         return result
 
@@ -216,6 +772,9 @@ class AnsibleArgumentsReference(PMAnsible):
     __slots__ = 'raw_dict', 'version'
 
     ref_name = 'reference'
+    use_worker = True
+    # Process-local copies of reference by cache ref, checked by version stored in cache.
+    _memo = {}
     # Excluded args from user calls
     _EXCLUDE_ARGS = [
         # Excluded because we use this differently in code
@@ -258,6 +817,14 @@ class AnsibleArgumentsReference(PMAnsible):
             cmd += ['--exclude', cmd_name]
         return cmd
 
+    def get_version_cache(self):
+        return AnsibleCache(self.get_ref(cache=True) + '-version', self.cache_timeout)
+
+    def clear_cache(self):
+        super(AnsibleArgumentsReference, self).clear_cache()
+        self.get_version_cache().clear()
+        self._memo.pop(self.get_ref(cache=True), None)
+
     def _extract_from_cli(self):
         '''
         Format dict with args for API
@@ -266,13 +833,24 @@ class AnsibleArgumentsReference(PMAnsible):
         :rtype: dict
         '''
         # pylint: disable=protected-access,
-        data = self.get_data()
-        self.version = data['version']
-        result = data['keywords'].copy()
-        result['module']['group'] = {"type": "string", "help": ""}
-        result['periodic_playbook'] = result['playbook']
-        result['periodic_module'] = result['module']
-        return result
+        # Whole reference is deserialized from cache only once per process and version,
+        # then only small version value is checked.
+        ref = self.get_ref(cache=True)
+        version_cache = self.get_version_cache()
+        version = version_cache.get()
+        memo = self._memo.get(ref)
+        if memo is None or version is None or memo[0] != version:
+            data = self.get_data()
+            result = data['keywords'].copy()
+            result['module']['group'] = {"type": "string", "help": ""}
+            result['periodic_playbook'] = result['playbook']
+            result['periodic_module'] = result['module']
+            memo = self._memo[ref] = (data['version'], result)
+            if version != data['version']:
+                version_cache.set(data['version'])
+        self.version, result = memo
+        # Commands args are copied, because executors extend them.
+        return {command: args.copy() for command, args in result.items()}
 
 
 class AnsibleModules(PMAnsible):
@@ -285,6 +863,12 @@ class AnsibleModules(PMAnsible):
         self.key = None
         self.module_paths = paths
 
+    @property
+    def use_worker(self):
+        # Project modules are imported into the interpreter and full scan imports
+        # every ansible module, so only lookups of ansible modules use the worker.
+        return bool(self.key) and not self.module_paths
+
     def get_args(self):  # nocv
         cmd = super(AnsibleModules, self).get_args()
         cmd += ['--cachedir', 'NoCache']
@@ -315,14 +899,16 @@ class AnsibleModules(PMAnsible):
 
 
 class AnsibleInventoryParser(PMAnsible):
-    __slots__ = ('path',)
+    __slots__ = ('path', 'data_hash',)
     ref_name = 'inventory_parser'
+    cache_timeout = 86400
+    use_worker = True
 
-    def get_ansible_cache(self):
-        cache = super(AnsibleInventoryParser, self).get_ansible_cache()
-        cache.get = lambda: None
-        cache.set = lambda value: None
-        return cache
+    def get_ref(self, cache=False):
+        ref = super(AnsibleInventoryParser, self).get_ref(cache)
+        if cache:
+            ref += '-{}'.format(self.data_hash)
+        return ref
 
     def get_args(self):
         args = super(AnsibleInventoryParser, self).get_args()
@@ -330,10 +916,18 @@ class AnsibleInventoryParser(PMAnsible):
         return args
 
     def get_inventory_data(self, raw_data):
-        with tmp_file_context(data=raw_data) as tmp_file:
-            self.path = tmp_file.name
-            return self.get_data()
+        # Same content is parsed only once, parse results are cached by hash of it.
+        self.data_hash = hashlib.sha256(raw_data.encode('utf-8')).hexdigest()
+        self.cache = AnsibleCache(self.get_ref(cache=True), self.cache_timeout)
+        result = self.cache.get()
+        if result is None:
+            with tmp_file_context(data=raw_data) as tmp_file:
+                self.path = tmp_file.name
+                result = self._get_only_json(self.execute())
+            self.cache.set(result)
+        return result
 
 
 class AnsibleConfigParser(PMAnsible):
     ref_name = 'config'
+    use_worker = True